@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the time it takes to flatten the compound actions of a program (see
+p4_action.flatten()), for two shapes of action hierarchies: a wide one, in
+which many actions call the same few actions, and a deep one, in which every
+action calls the previous one.
+
+    python benchmarks/action_flatten.py [--wide N] [--deep N] [--repeat N]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_gen import write_program, temporary_directory, build
+
+NUM_FIELDS = 16
+
+def generate_header(lines):
+    lines += ["header_type bench_t {", "    fields {"]
+    for i in range(NUM_FIELDS):
+        lines.append("        f%d : 32;" % i)
+    lines += ["    }", "}", "header bench_t bench;",
+              "parser start {", "    extract(bench);", "    return ingress;",
+              "}"]
+
+def generate_tables(lines, actions, actions_per_table = 50):
+    # every action is used by a table, so that none is removed
+    num_tables = 0
+    for i in range(0, len(actions), actions_per_table):
+        lines += ["table t%d {" % num_tables,
+                  "    reads { bench.f%d : exact; }" % (num_tables % NUM_FIELDS),
+                  "    actions {"]
+        for action in actions[i:i + actions_per_table]:
+            lines.append("        %s;" % action)
+        lines += ["    }", "}"]
+        num_tables += 1
+    lines.append("control ingress {")
+    for i in range(num_tables):
+        lines.append("    apply(t%d);" % i)
+    lines += ["}", "control egress { }"]
+
+def generate_wide_program(num_actions):
+    """
+    'num_actions' actions which call the same three base actions with their
+    own parameters and with constants
+    """
+    lines = []
+    generate_header(lines)
+    for i in range(3):
+        lines += ["action base%d(x, y) {" % i,
+                  "    modify_field(bench.f%d, x);" % i,
+                  "    add_to_field(bench.f%d, y + 1);" % (i + 3),
+                  "    subtract_from_field(bench.f%d, 7);" % (i + 6), "}"]
+    for i in range(num_actions):
+        lines += ["action a%d(v) {" % i,
+                  "    base0(v, %d);" % i,
+                  "    base1(v, v);",
+                  "    base2(%d, 5);" % (i % 4), "}"]
+    generate_tables(lines, ["a%d" % i for i in range(num_actions)])
+    return "\n".join(lines)
+
+def generate_deep_program(depth):
+    """
+    A chain of 'depth' actions, each one calling the previous one before
+    making a primitive call of its own
+    """
+    lines = []
+    generate_header(lines)
+    lines += ["action d0(v) {",
+              "    modify_field(bench.f0, v);", "}"]
+    for i in range(1, depth):
+        lines += ["action d%d(v) {" % i,
+                  "    d%d(v);" % (i - 1),
+                  "    add_to_field(bench.f%d, v + %d);" % (i % NUM_FIELDS, i),
+                  "}"]
+    generate_tables(lines, ["d%d" % i for i in range(depth)])
+    return "\n".join(lines)
+
+def flatten_time(h, repeat):
+    compound_actions = [action for action in h.p4_actions.values()
+                        if action.call_sequence]
+    times = []
+    for _ in range(repeat):
+        for action in compound_actions:
+            action.flat_call_sequence = None
+        start = time.time()
+        expansions = {}
+        for action in compound_actions:
+            action.flatten(h, expansions)
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--wide", type = int, default = 5000,
+                           help = "number of actions of the wide hierarchy")
+    argparser.add_argument("--deep", type = int, default = 300,
+                           help = "depth of the deep hierarchy")
+    argparser.add_argument("--repeat", type = int, default = 3)
+    args = argparser.parse_args()
+
+    with temporary_directory() as tmp_dir:
+        programs = [("wide", generate_wide_program(args.wide)),
+                    ("deep", generate_deep_program(args.deep))]
+        for name, text in programs:
+            source = write_program(text, tmp_dir)
+            start = time.time()
+            h = build(source, analyze = False, parse_cache = False)
+            build_time = time.time() - start
+            num_calls = sum(len(action.flat_call_sequence)
+                            for action in h.p4_actions.values())
+            print "%s: %d actions, %d flattened primitive calls" % (
+                name, len(h.p4_actions), num_calls)
+            print "%-30s %8.3f s" % ("  build", build_time)
+            print "%-30s %8.3f s" % ("  flatten", flatten_time(h, args.repeat))
+
+if __name__ == "__main__":
+    main()
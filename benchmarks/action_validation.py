@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the time it takes to validate the types of the actions of a program
+in which a few hundred actions are shared by thousands of tables, with and
+without the cache of the validations (see p4_action.validate_types()), for
+increasing numbers of tables.
+
+    python benchmarks/action_validation.py [--actions N] [--tables N,N...]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir.hlir import p4
+from p4_hlir.hlir.p4_imperatives import _validation_cache
+from p4_gen import write_program, temporary_directory, build
+
+NUM_FIELDS = 16
+
+def generate_program(num_actions, num_tables, actions_per_table = 10):
+    lines = ["header_type bench_t {", "    fields {"]
+    for i in range(NUM_FIELDS):
+        lines.append("        f%d : 32;" % i)
+    lines += ["    }", "}", "header bench_t bench;",
+              "parser start {", "    extract(bench);", "    return ingress;",
+              "}"]
+    lines += ["action base(x, y) {",
+              "    modify_field(bench.f0, x);",
+              "    add_to_field(bench.f1, y);", "}"]
+    for i in range(num_actions):
+        lines += ["action a%d(v) {" % i,
+                  "    base(v, %d);" % i,
+                  "    modify_field(bench.f%d, bench.f%d);" % (
+                      i % NUM_FIELDS, (i + 1) % NUM_FIELDS),
+                  "    add_to_field(bench.f%d, v);" % ((i + 2) % NUM_FIELDS),
+                  "}"]
+    for i in range(num_tables):
+        lines += ["table t%d {" % i,
+                  "    reads { bench.f%d : exact; }" % (i % NUM_FIELDS),
+                  "    actions {"]
+        for j in range(actions_per_table):
+            lines.append("        a%d;" % ((i * 7 + j) % num_actions))
+        lines += ["    }", "}"]
+    lines.append("control ingress {")
+    for i in range(num_tables):
+        lines.append("    apply(t%d);" % i)
+    lines += ["}", "control egress { }"]
+    return "\n".join(lines)
+
+def validation_time(h, cached):
+    # same as p4.p4_action_validate_types(), without flattening the actions
+    # (the arguments were already resolved by the build)
+    cache = _validation_cache() if cached else None
+    start = time.time()
+    with h.context.activate():
+        called_actions = set()
+        for table in h.p4_tables.values():
+            for action in table.actions:
+                action.validate_types(
+                    h, table,
+                    [(table.name, None, None, p4.p4_table_entry_data)] *
+                    len(action.signature),
+                    called_actions, cache
+                )
+    return time.time() - start
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--actions", type = int, default = 300)
+    argparser.add_argument("--tables", default = "1000,2000,4000",
+                           help = "comma-separated numbers of tables")
+    args = argparser.parse_args()
+
+    with temporary_directory() as tmp_dir:
+        print "%d actions, 10 actions per table" % args.actions
+        print "%8s %12s %12s" % ("tables", "uncached", "cached")
+        for num_tables in [int(n) for n in args.tables.split(",")]:
+            source = write_program(generate_program(args.actions, num_tables),
+                                   tmp_dir)
+            # the table graph of a long chain of tables is not optimized
+            h = build(source, optimize = False, analyze = False,
+                      parse_cache = False)
+            print "%8d %10.3f s %10.3f s" % (
+                num_tables, validation_time(h, False),
+                validation_time(h, True))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reports the memory used by the AST of a P4 program, in bytes per node.
+
+'before' is the size the same nodes would have as regular objects with a
+__dict__, a set of pragmas each and one file name string per line marker;
+'after' is the size of the actual __slots__ nodes, which share the empty
+pragma set and the interned file names.
+
+    python benchmarks/ast_memory.py [--actions N] [--tables N] [source.p4 ...]
+"""
+
+import os
+import sys
+import re
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir.frontend.preprocessor import Preprocessor
+from p4_hlir.frontend.parser import P4Parser
+from p4_hlir.frontend.ast import P4TreeNode, P4Object
+from p4_gen import generate_program
+
+class _DictNode(object):
+    pass
+
+def iter_nodes(objects):
+    visited = set()
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, P4TreeNode):
+            if id(obj) in visited: continue
+            visited.add(id(obj))
+            yield obj
+            stack.extend(obj.__getstate__().values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+
+def dict_node_size(node):
+    plain = _DictNode()
+    plain.__dict__.update(node.__getstate__())
+    size = sys.getsizeof(plain) + sys.getsizeof(plain.__dict__)
+    if isinstance(node, P4Object) and not node._pragmas:
+        size += sys.getsizeof(set())
+    return size
+
+def measure(text):
+    objects, errors_cnt = P4Parser().parse(text)
+    if errors_cnt > 0:
+        sys.exit("parse errors")
+    nodes = list(iter_nodes(objects))
+
+    before = 0
+    after = 0
+    shared = {}
+    for node in nodes:
+        before += dict_node_size(node)
+        after += sys.getsizeof(node)
+        shared[id(node.filename)] = sys.getsizeof(node.filename)
+        if isinstance(node, P4Object):
+            if node._pragmas:
+                before += sys.getsizeof(node._pragmas)
+            shared[id(node._pragmas)] = sys.getsizeof(node._pragmas)
+    after += sum(shared.values())
+    # the lexer creates a new file name string for every line marker
+    for filename in re.findall(r'^# \d+ "([^"]*)"', text, re.MULTILINE):
+        before += sys.getsizeof(filename)
+    return len(nodes), before, after
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("sources", metavar = "source", nargs = "*")
+    argparser.add_argument("--actions", type = int, default = 2000)
+    argparser.add_argument("--tables", type = int, default = 1000)
+    args = argparser.parse_args()
+
+    programs = []
+    if args.sources:
+        preprocessor = Preprocessor(use_cache = False)
+        for source in args.sources:
+            programs.append((source, preprocessor.preprocess_file(source)))
+    else:
+        text = generate_program(args.actions, args.tables)
+        programs.append(("generated (%d actions, %d tables)" %
+                         (args.actions, args.tables), text))
+
+    for name, text in programs:
+        num_nodes, before, after = measure(text)
+        print name
+        print "  nodes:          %d" % num_nodes
+        print "  before: %8.1f bytes/node (%d bytes)" % \
+            (float(before) / num_nodes, before)
+        print "  after:  %8.1f bytes/node (%d bytes)" % \
+            (float(after) / num_nodes, after)
+        print "  saved:  %7.1f%%" % (100.0 * (before - after) / before)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reports the memory used by the fields (p4_field) of a P4 program with header
+stacks and a large metadata header, in bytes per field.
+
+'before' is the size the same fields would have as regular objects with a
+__dict__ and an empty list of calculations each; 'after' is the size of the
+actual __slots__ fields, which share the empty calculation tuple. In both cases
+the fields of the instances of a header type share the names and the attribute
+sets of the header type, which are not counted.
+
+    python benchmarks/field_memory.py [--stack-depth N] [--fields N] [source.p4 ...]
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir.hlir.p4_headers import p4_field
+from p4_gen import write_program, temporary_directory, build
+
+def generate_program(stack_depth, num_fields, num_stacks = 4):
+    lines = []
+    for i in range(num_stacks):
+        lines += ["header_type tag%d_t {" % i, "    fields {"]
+        for j in range(num_fields):
+            lines.append("        f%d : 8;" % j)
+        lines += ["    }", "}"]
+        lines.append("header tag%d_t tag%d[%d];" % (i, i, stack_depth))
+    lines += ["header_type meta_t {", "    fields {"]
+    for j in range(num_fields * 10):
+        lines.append("        m%d : 16;" % j)
+    lines += ["    }", "}", "metadata meta_t meta;"]
+    lines.append("parser start {")
+    for i in range(num_stacks):
+        for j in range(stack_depth):
+            lines.append("    extract(tag%d[next]);" % i)
+    lines.append("    set_metadata(meta.m0, tag0[0].f0);")
+    lines += ["    return ingress;", "}"]
+    lines += ["action a(v) { modify_field(meta.m1, v); }",
+              "table t { reads { tag1[1].f1 : exact; } actions { a; } }",
+              "control ingress { apply(t); }",
+              "control egress { }"]
+    return "\n".join(lines)
+
+class _DictField(object):
+    pass
+
+def dict_field_size(field):
+    plain = _DictField()
+    plain.__dict__.update(zip(p4_field.__slots__, field.__getstate__()))
+    size = sys.getsizeof(plain) + sys.getsizeof(plain.__dict__)
+    if not field.calculation:
+        size += sys.getsizeof([])
+    return size
+
+def measure(h):
+    fields = h.p4_fields.values()
+    before = 0
+    after = 0
+    for field in fields:
+        before += dict_field_size(field)
+        after += sys.getsizeof(field)
+        if field.calculation:
+            before += sys.getsizeof(field.calculation)
+            after += sys.getsizeof(field.calculation)
+    return len(fields), before, after
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("sources", metavar = "source", nargs = "*")
+    argparser.add_argument("--stack-depth", type = int, default = 64)
+    argparser.add_argument("--fields", type = int, default = 50,
+                           help = "fields per header type (10 times more in "
+                           "the metadata header)")
+    args = argparser.parse_args()
+
+    programs = []
+    with temporary_directory() as tmp_dir:
+        if args.sources:
+            for source in args.sources:
+                programs.append((source, build(source)))
+        else:
+            source = write_program(
+                generate_program(args.stack_depth, args.fields), tmp_dir
+            )
+            programs.append(("generated (stack depth %d, %d fields)" %
+                             (args.stack_depth, args.fields), build(source)))
+
+    for name, h in programs:
+        num_fields, before, after = measure(h)
+        print name
+        print "  fields:         %d" % num_fields
+        print "  before: %8.1f bytes/field (%d bytes)" % \
+            (float(before) / num_fields, before)
+        print "  after:  %8.1f bytes/field (%d bytes)" % \
+            (float(after) / num_fields, after)
+        print "  saved:  %7.1f%%" % (100.0 * (before - after) / before)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the time it takes to resolve references to the fields of wide
+headers ('instance.field' and 'latest.field', as in set_metadata statements
+and select keys) with p4_field_reference(), compared with splitting the
+reference and scanning the fields of the instance.
+
+    python benchmarks/field_reference.py [--fields N] [--instances N] [--repeat N]
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir.hlir.p4_headers import p4_field_reference
+from p4_gen import write_program, temporary_directory, build, best_time
+
+def generate_program(num_fields, num_instances):
+    lines = ["header_type h_t {", "    fields {"]
+    for i in range(num_fields):
+        lines.append("        f%d : 8;" % i)
+    lines += ["    }", "}"]
+    lines.append("header h_t h[%d];" % num_instances)
+    lines.append("parser start {")
+    for i in range(num_instances):
+        lines.append("    extract(h[next]);")
+    lines += ["    return ingress;", "}"]
+    lines += ["action a(v) { modify_field(h[0].f0, v); }",
+              "table t { reads { h[1].f1 : exact; } actions { a; } }",
+              "control ingress { apply(t); }",
+              "control egress { }"]
+    return "\n".join(lines)
+
+def linear_field_reference(hlir, str_ref, latest = None):
+    # p4_field_reference() before the field index
+    tokens = str_ref.split(".")
+    if tokens[0] == "latest":
+        tokens = (latest.name + "." + tokens[1]).split(".")
+    inst = hlir.p4_header_instances[tokens[0]]
+    for field in inst.fields:
+        if field.name == tokens[1]:
+            return field
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--fields", type = int, default = 500)
+    argparser.add_argument("--instances", type = int, default = 16)
+    argparser.add_argument("--repeat", type = int, default = 3)
+    args = argparser.parse_args()
+
+    with temporary_directory() as tmp_dir:
+        h = build(write_program(generate_program(args.fields, args.instances),
+                                tmp_dir))
+
+    instances = [h.p4_header_instances["h[%d]" % i]
+                 for i in range(args.instances)]
+    refs = [(instance.name + ".f%d" % i, None)
+            for instance in instances for i in range(args.fields)]
+    refs += [("latest.f%d" % i, instance)
+             for instance in instances for i in range(args.fields)]
+
+    def resolve_all(function):
+        return lambda: [function(h, ref, latest) for ref, latest in refs]
+
+    if resolve_all(linear_field_reference)() != \
+       resolve_all(p4_field_reference)():
+        sys.exit("the references are not resolved to the same fields")
+
+    linear, _ = best_time(args.repeat, resolve_all(linear_field_reference))
+    indexed, _ = best_time(args.repeat, resolve_all(p4_field_reference))
+
+    print "%d references to fields of %d instances with %d fields" % (
+        len(refs), args.instances, args.fields)
+    print "%-20s %8.3f s" % ("linear scan", linear)
+    print "%-20s %8.3f s  (%.1fx faster)" % ("field index", indexed,
+                                             linear / indexed)
+
+if __name__ == "__main__":
+    main()
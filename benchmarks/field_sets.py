@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the two representations of sets of fields in the table dependency
+analysis: Python sets of p4_field objects and the bitmasks of field ids used by
+p4_hlir.hlir.analysis_utils. The program has wide headers and actions which
+write whole header instances; for every dependency of its table graph, the
+fields shared by the two tables are computed as in
+rmt_table_dependency.resolve_type().
+
+    python benchmarks/field_sets.py [--tables N] [--headers N] [--fields N] [--repeat N]
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir.hlir import table_dependency
+from p4_hlir.hlir.analysis_utils import fields_from_mask
+from p4_hlir.util.build_context import context_of
+from p4_gen import write_program, temporary_directory, build, best_time
+
+def generate_program(num_tables, num_headers, num_fields):
+    lines = []
+    for i in range(num_headers):
+        lines += ["header_type h%d_t {" % i, "    fields {"]
+        for j in range(num_fields):
+            lines.append("        f%d : 16;" % j)
+        lines += ["    }", "}", "header h%d_t h%d;" % (i, i),
+                  "header h%d_t c%d;" % (i, i)]
+    lines.append("parser start {")
+    for i in range(num_headers):
+        lines.append("    extract(h%d);" % i)
+    lines += ["    return ingress;", "}"]
+    for i in range(num_tables):
+        h = i % num_headers
+        lines.append("action a%d(v) {" % i)
+        lines.append("    modify_field(h%d.f%d, v);" % (h, i % num_fields))
+        if i % 3 == 0:
+            lines.append("    copy_header(c%d, h%d);" % (h, (h + 1) % num_headers))
+        elif i % 3 == 1:
+            lines.append("    remove_header(h%d);" % ((h + 2) % num_headers))
+        lines.append("}")
+        lines.append("table t%d {" % i)
+        lines.append("    reads { h%d.f%d : exact; c%d : valid; }"
+                     % ((h + 3) % num_headers, (i * 7) % num_fields, h))
+        lines.append("    actions { a%d; }" % i)
+        lines.append("}")
+    lines.append("control ingress {")
+    for i in range(num_tables):
+        lines.append("    apply(t%d);" % i)
+    lines += ["}", "control egress { }"]
+    return "\n".join(lines)
+
+def shared_fields(dependencies, fields_of):
+    # the intersections of rmt_table_dependency.resolve_type(), for all the
+    # dependency types
+    result = []
+    for from_, to, read, write in dependencies:
+        from_match = fields_of[from_][0]
+        to_match, to_all, to_write = fields_of[to]
+        result.append((write & to_match, write & to_all,
+                       (from_match & to_write) | (read & to_write)))
+    return result
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--tables", type = int, default = 300)
+    argparser.add_argument("--headers", type = int, default = 20)
+    argparser.add_argument("--fields", type = int, default = 64)
+    argparser.add_argument("--repeat", type = int, default = 3)
+    args = argparser.parse_args()
+
+    with temporary_directory() as tmp_dir:
+        source = write_program(
+            generate_program(args.tables, args.headers, args.fields), tmp_dir
+        )
+        h = build(source, analyze = False)
+
+    context = context_of(h)
+    with context.activate():
+        graph_time, graph = best_time(
+            args.repeat,
+            lambda: table_dependency.rmt_build_table_graph_ingress(h)
+        )
+        tables = graph._nodes.values()
+        masks = dict((table, (table.match_fields, table.action_fields,
+                              table.action_fields_write))
+                     for table in tables)
+        sets = dict((table, tuple(fields_from_mask(mask)
+                                  for mask in masks[table]))
+                    for table in tables)
+        mask_deps = []
+        set_deps = []
+        for table in tables:
+            for dependency in table.next_tables.values():
+                mask_deps.append((table, dependency.to,
+                                  dependency.action_fields_read,
+                                  dependency.action_fields_write))
+                set_deps.append((table, dependency.to,
+                                 fields_from_mask(dependency.action_fields_read),
+                                 fields_from_mask(dependency.action_fields_write)))
+
+        set_time, set_result = best_time(
+            args.repeat,
+            lambda: shared_fields(set_deps, sets)
+        )
+        mask_time, mask_result = best_time(
+            args.repeat,
+            lambda: shared_fields(mask_deps, masks)
+        )
+        for shared_sets, shared_masks in zip(set_result, mask_result):
+            if list(shared_sets) != [fields_from_mask(m) for m in shared_masks]:
+                sys.exit("the two representations give different results")
+
+    print "%d tables, %d fields, %d dependencies" % (
+        len(tables), len(context.fields_by_id), len(mask_deps))
+    print "%-30s %8.3f s" % ("table graph (bitsets)", graph_time)
+    print "%-30s %8.3f s" % ("shared fields (sets)", set_time)
+    print "%-30s %8.3f s  (%.1fx faster)" % ("shared fields (bitsets)",
+                                             mask_time, set_time / mask_time)
+
+if __name__ == "__main__":
+    main()
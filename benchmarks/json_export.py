@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the time and the memory it takes to export a program with many fields
+in JSON (see p4_hlir/json_export.py). The memory is the growth of the maximum
+resident set size of the process during the export, the program is built
+first.
+
+    python benchmarks/json_export.py [--instances N] [--fields N] [--lines]
+"""
+
+import os
+import sys
+import time
+import argparse
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir import json_export
+from p4_gen import write_program, temporary_directory, build
+
+def generate_program(num_instances, num_fields, num_tables = 50):
+    lines = ["header_type h_t {", "    fields {"]
+    for i in range(num_fields):
+        lines.append("        f%d : 8;" % i)
+    lines += ["    }", "}"]
+    for i in range(num_instances):
+        lines.append("header h_t h%d;" % i)
+    # unused instances would be removed
+    lines.append("parser start {")
+    for i in range(num_instances):
+        lines.append("    extract(h%d);" % i)
+    lines += ["    return ingress;", "}"]
+    for i in range(num_tables):
+        lines.append("action a%d(v) { modify_field(h%d.f%d, v); }"
+                     % (i, i % num_instances, i % num_fields))
+        lines.append("table t%d { reads { h%d.f%d : exact; } actions { a%d; } }"
+                     % (i, (i * 7) % num_instances, (i + 1) % num_fields, i))
+    lines.append("control ingress {")
+    for i in range(num_tables):
+        lines.append("    apply(t%d);" % i)
+    lines += ["}", "control egress { }"]
+    return "\n".join(lines)
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--instances", type = int, default = 1000)
+    argparser.add_argument("--fields", type = int, default = 100,
+                           help = "fields per header instance")
+    argparser.add_argument("--lines", action = "store_true", default = False,
+                           help = "export JSON Lines")
+    args = argparser.parse_args()
+
+    with temporary_directory() as tmp_dir:
+        h = build(write_program(generate_program(args.instances, args.fields),
+                                tmp_dir))
+
+        path = os.path.join(tmp_dir, "prog.json")
+        rss_before = max_rss_kb()
+        start = time.time()
+        with open(path, "w") as f:
+            json_export.export(h, f, lines = args.lines)
+        elapsed = time.time() - start
+        rss_after = max_rss_kb()
+
+        print "%d fields, export of %d KB" % (len(h.p4_fields),
+                                              os.path.getsize(path) // 1024)
+        print "%-20s %8.3f s" % ("time", elapsed)
+        print "%-20s %8d KB (%d KB after the build)" % (
+            "max RSS growth", rss_after - rss_before, rss_before)
+
+if __name__ == "__main__":
+    main()
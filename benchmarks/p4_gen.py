@@ -0,0 +1,133 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Generates synthetic P4 programs of arbitrary size for the benchmarks, and
+the helpers the benchmarks share to build and time them.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from contextlib import contextmanager
+from cStringIO import StringIO
+
+from p4_hlir.main import HLIR
+
+def generate_program(num_actions = 100, num_tables = 50, num_fields = 16):
+    """
+    Returns the text of a valid P4 program with 'num_actions' compound
+    actions and 'num_tables' tables, all applied in sequence from ingress.
+    """
+    lines = []
+    lines.append("header_type bench_t {")
+    lines.append("    fields {")
+    for i in range(num_fields):
+        lines.append("        f%d : 32;" % i)
+    lines.append("    }")
+    lines.append("}")
+    lines.append("")
+    lines.append("header bench_t bench;")
+    lines.append("")
+    lines.append("parser start {")
+    lines.append("    extract(bench);")
+    lines.append("    return ingress;")
+    lines.append("}")
+    lines.append("")
+    for i in range(num_actions):
+        lines.append("@pragma bench action_%d" % i if i % 10 == 0 else "")
+        lines.append("action a%d(v) {" % i)
+        lines.append("    modify_field(bench.f%d, v);" % (i % num_fields))
+        lines.append("    add_to_field(bench.f%d, %d);" %
+                     ((i + 1) % num_fields, i))
+        lines.append("}")
+        lines.append("")
+    for i in range(num_tables):
+        lines.append("table t%d {" % i)
+        lines.append("    reads {")
+        lines.append("        bench.f%d : exact;" % (i % num_fields))
+        lines.append("    }")
+        lines.append("    actions {")
+        for j in range(3):
+            lines.append("        a%d;" % ((i * 3 + j) % num_actions))
+        lines.append("    }")
+        lines.append("    size : 1024;")
+        lines.append("}")
+        lines.append("")
+    lines.append("control ingress {")
+    for i in range(num_tables):
+        lines.append("    apply(t%d);" % i)
+    lines.append("}")
+    lines.append("")
+    lines.append("control egress {")
+    lines.append("}")
+    lines.append("")
+    return "\n".join(lines)
+
+def write_program(text, directory = None):
+    """
+    Writes 'text' to a new .p4 file and returns its path
+    """
+    fd, path = tempfile.mkstemp(suffix = ".p4", dir = directory)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    return path
+
+@contextmanager
+def temporary_directory():
+    """
+    Creates a directory for the programs of a benchmark, which is removed
+    with its content at the end of the 'with' block
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        yield tmp_dir
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def quiet(function):
+    """
+    Calls 'function' with the standard output, where the HLIR prints its
+    warnings, discarded, and returns its result
+    """
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        return function()
+    finally:
+        sys.stdout = stdout
+
+def build(source, **build_options):
+    """
+    Builds the program in 'source' quietly with the given HLIR.build()
+    options and returns the HLIR, exits if the build fails
+    """
+    h = HLIR(source)
+    if not quiet(lambda: h.build(**build_options)):
+        sys.exit("build failed")
+    return h
+
+def best_time(repeat, function):
+    """
+    Calls 'function' 'repeat' times, returns the shortest time it took and
+    the result of the last call
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return min(times), result
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the time it takes to rebuild a generated P4 program incrementally
+with HLIR.rebuild() after a localized edit (the body of an action, the fields
+read by a table) with the time it takes to build it from scratch. The rebuilt
+HLIR is checked against the one built from scratch with p4_hlir.compare. The
+declarations are parsed incrementally in both cases.
+
+    python benchmarks/rebuild.py [--actions N] [--tables N]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir.main import HLIR
+from p4_hlir.compare import compare
+from p4_gen import generate_program, write_program, temporary_directory, quiet
+
+def timed(function):
+    start = time.time()
+    result = function()
+    return time.time() - start, result
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--actions", type = int, default = 3000)
+    argparser.add_argument("--tables", type = int, default = 300)
+    args = argparser.parse_args()
+
+    text = generate_program(args.actions, args.tables)
+    # (description, old text, new text), applied in sequence
+    edits = [
+        ("action body",
+         "modify_field(bench.f5, v);", "modify_field(bench.f7, v);"),
+        ("action body (lines moved)",
+         "add_to_field(bench.f2, 1);",
+         "add_to_field(bench.f2, 1);\n    add_to_field(bench.f3, 1);"),
+        ("table reads",
+         "table t3 {\n    reads {\n        bench.f3 : exact;",
+         "table t3 {\n    reads {\n        bench.f4 : exact;"),
+    ]
+
+    with temporary_directory() as tmp_dir:
+        source = write_program(text, tmp_dir)
+        h = HLIR(source)
+        if not quiet(lambda: h.rebuild(parse_cache = False)):
+            sys.exit("build failed")
+        h.analyze()
+
+        print "%d actions, %d tables" % (args.actions, args.tables)
+        for description, old, new in edits:
+            text = text.replace(old, new, 1)
+            with open(source, "w") as f:
+                f.write(text)
+
+            rebuild_time, success = timed(
+                lambda: quiet(lambda: h.rebuild(parse_cache = False))
+            )
+            if not success or h.build_stats["rebuild"] != "incremental":
+                sys.exit("%s: no incremental rebuild" % description)
+            analysis_time, _ = timed(h.analyze)
+
+            # the declarations are parsed incrementally by both, only the
+            # HLIR is built from scratch
+            h_ref = HLIR(source)
+            build_time, success = timed(lambda: quiet(
+                lambda: h_ref.build(incremental_parse = True,
+                                    parse_cache = False)
+            ))
+            if not success:
+                sys.exit("build failed")
+            build_time += timed(h_ref.analyze)[0]
+            differences = compare(h, h_ref)
+            if differences:
+                sys.exit("%s: the rebuilt HLIR differs from the built one:\n%s"
+                         % (description, "\n".join(differences[:10])))
+
+            total_time = rebuild_time + analysis_time
+            print "%-30s %8.3f s" % (description + ": build", build_time)
+            print "%-30s %8.3f s  (%.1fx faster)" % (
+                description + ": rebuild", total_time,
+                build_time / total_time)
+
+if __name__ == "__main__":
+    main()
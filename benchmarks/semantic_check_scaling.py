@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures how the time spent in semantic checking scales with the size of the
+program, on synthetic programs with up to --actions actions and --tables
+tables (10000 and 5000 by default).
+
+    python benchmarks/semantic_check_scaling.py [--actions N] [--tables N]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir.frontend.parser import P4Parser
+from p4_hlir.frontend.semantic_check import P4SemanticChecker
+from p4_hlir.frontend.ast import P4Program
+from p4_hlir.frontend.primitives import get_std_primitives
+from p4_gen import generate_program
+
+def measure(parser, primitives, num_actions, num_tables):
+    text = generate_program(num_actions, num_tables)
+    p4_objects, errors_cnt = parser.parse(text)
+    if errors_cnt > 0:
+        sys.exit("parse errors")
+    p4_program = P4Program("", -1, p4_objects)
+
+    sc = P4SemanticChecker()
+    # the semantic checker prints a warning for every unreachable object
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        start = time.time()
+        errors_cnt = sc.semantic_check(p4_program, primitives)
+        elapsed = time.time() - start
+    finally:
+        sys.stdout = stdout
+    if errors_cnt > 0:
+        sys.exit("semantic errors")
+    return len(p4_objects), elapsed, sc.pass_times
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--actions", type = int, default = 10000)
+    argparser.add_argument("--tables", type = int, default = 5000)
+    argparser.add_argument("--steps", type = int, default = 4,
+                           help = "number of program sizes, each one twice "
+                           "as large as the previous one")
+    args = argparser.parse_args()
+
+    primitives = get_std_primitives()
+    parser = P4Parser()
+
+    print "%8s %8s %8s %10s %12s" % ("actions", "tables", "objects",
+                                     "check (s)", "us/object")
+    for step in reversed(range(args.steps)):
+        num_actions = max(1, args.actions >> step)
+        num_tables = max(1, args.tables >> step)
+        parser.reset()
+        num_objects, elapsed, pass_times = measure(parser, primitives,
+                                                   num_actions, num_tables)
+        print "%8d %8d %8d %10.3f %12.1f" % (num_actions, num_tables,
+                                             num_objects, elapsed,
+                                             1e6 * elapsed / num_objects)
+        print "    " + ", ".join("%s %.3f" % (name, t)
+                                 for name, t in pass_times.items())
+
+if __name__ == "__main__":
+    main()
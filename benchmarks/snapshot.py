@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the time it takes to build a generated P4 program with the time it
+takes to load a snapshot of it written by HLIR.save().
+
+    python benchmarks/snapshot.py [--actions N] [--tables N] [--repeat N]
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir.main import HLIR
+from p4_gen import generate_program, write_program, temporary_directory, \
+    build, best_time
+
+def graph(h):
+    # the table graph and the dependencies, by name
+    return sorted(
+        (name, sorted((str(k), v.name if v else None)
+                      for k, v in node.next_.items()),
+         sorted((k.name, v.dependency_type)
+                for k, v in node.dependencies_for.items()))
+        for name, node in h.p4_nodes.items()
+    )
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--actions", type = int, default = 3000)
+    argparser.add_argument("--tables", type = int, default = 300)
+    argparser.add_argument("--repeat", type = int, default = 3)
+    args = argparser.parse_args()
+
+    with temporary_directory() as tmp_dir:
+        source = write_program(generate_program(args.actions, args.tables),
+                               tmp_dir)
+        path = os.path.join(tmp_dir, "prog.snapshot")
+
+        build_cold, h = best_time(
+            args.repeat, lambda: build(source, parse_cache = False)
+        )
+        build_warm, h = best_time(args.repeat, lambda: build(source))
+        save_time, _ = best_time(args.repeat, lambda: h.save(path))
+        load_time, loaded = best_time(args.repeat, lambda: HLIR.load(path))
+        if graph(loaded) != graph(h):
+            sys.exit("the loaded HLIR differs from the built one")
+
+        print "%d actions, %d tables, snapshot of %d KB" % (
+            args.actions, args.tables, os.path.getsize(path) // 1024)
+        print "%-30s %8.3f s" % ("build", build_cold)
+        print "%-30s %8.3f s" % ("build (parse cache)", build_warm)
+        print "%-30s %8.3f s" % ("HLIR.save()", save_time)
+        print "%-30s %8.3f s  (%.1fx / %.1fx faster)" % (
+            "HLIR.load()", load_time, build_cold / load_time,
+            build_warm / load_time)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the start-up time of p4-hlir: importing p4_hlir.main, running
+'p4-validate --help' and validating a trivial program, each in a new Python
+process.
+
+    python benchmarks/startup.py [--repeat N]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+P4_VALIDATE = os.path.join(ROOT, "bin", "p4-validate")
+
+TRIVIAL_PROGRAM = """
+header_type h_t { fields { f : 32; } }
+header h_t h;
+parser start { extract(h); return ingress; }
+action a() { modify_field(h.f, 1); }
+table t { actions { a; } }
+control ingress { apply(t); }
+"""
+
+def run(argv, repeat, cwd):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    times = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            returncode = subprocess.call(argv, env = env, cwd = cwd,
+                                         stdout = devnull, stderr = devnull)
+            times.append(time.time() - start)
+            if returncode != 0:
+                sys.exit("'%s' failed" % " ".join(argv))
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--repeat", type = int, default = 10)
+    args = argparser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmp_dir, "trivial.p4")
+        with open(source, "w") as f:
+            f.write(TRIVIAL_PROGRAM)
+        benchmarks = [
+            ("python (no import)", [sys.executable, "-c", "pass"]),
+            ("import p4_hlir.main",
+             [sys.executable, "-c", "import p4_hlir.main"]),
+            ("p4-validate --help", [sys.executable, P4_VALIDATE, "--help"]),
+            ("p4-validate trivial.p4",
+             [sys.executable, P4_VALIDATE, source]),
+        ]
+        print "%-24s %10s %10s" % ("", "min (ms)", "median (ms)")
+        for name, argv in benchmarks:
+            best, median = run(argv, args.repeat, tmp_dir)
+            print "%-24s %10.1f %10.1f" % (name, 1000 * best, 1000 * median)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the time it takes to optimize the table graph of a program in which
+nested conditions test again the validity of headers already tested by an
+enclosing condition (see p4.optimize_table_graph()) with the time taken by
+sweeping all the edges of the graph until none changes, for increasing
+numbers of blocks. The optimized graphs are checked to be the same with
+p4_hlir.compare.
+
+    python benchmarks/table_graph_optimization.py [--blocks N,N...]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from p4_hlir.compare import compare
+from p4_hlir.hlir import p4
+from p4_hlir.hlir import p4_tables
+from p4_hlir.hlir import exclusive_conditions
+from p4_gen import write_program, temporary_directory, build, quiet
+
+NUM_HEADERS = 8
+
+def generate_program(num_blocks):
+    lines = ["header_type bench_t {", "    fields {", "        f : 32;",
+             "    }", "}"]
+    for i in range(NUM_HEADERS):
+        lines.append("header bench_t h%d;" % i)
+    lines += ["parser start {", "    extract(h0);", "    return ingress;", "}",
+              "action nop() { }"]
+    for i in range(num_blocks):
+        for name in ["a", "b", "c"]:
+            lines += ["table %s%d {" % (name, i),
+                      "    reads { h%d.f : exact; }" % (i % NUM_HEADERS),
+                      "    actions { nop; }", "}"]
+    lines.append("control ingress {")
+    for i in range(num_blocks):
+        h = "h%d" % (i % NUM_HEADERS)
+        lines += ["    if (valid(%s)) {" % h,
+                  "        apply(a%d);" % i,
+                  "        if (valid(%s)) {" % h,
+                  "            apply(b%d);" % i,
+                  "            if (valid(%s)) { apply(c%d); }" % (h, i),
+                  "        }",
+                  "    }"]
+    lines += ["}", "control egress { }"]
+    return "\n".join(lines)
+
+def sweep_optimize_table_graph(hlir):
+    # p4.optimize_table_graph(), examining all the edges until none changes
+    for ingress_ptr in hlir.p4_ingress_ptr:
+        p4_tables._set_modified_hdrs(hlir, ingress_ptr, set())
+    if hlir.p4_egress_ptr:
+        p4_tables._set_modified_hdrs(hlir, hlir.p4_egress_ptr, set())
+    xconds = exclusive_conditions.Solver(hlir)
+    change = True
+    while change:
+        change = False
+        for _, p4_node in hlir.p4_nodes.items():
+            for a, nt in p4_node.next_.items():
+                conditions = p4_tables._get_all_conditions(p4_node, [])
+                if a in {True, False}:
+                    conditions += [(p4_node.condition, a)]
+                if isinstance(nt, p4.p4_conditional_node):
+                    cond_value = xconds.evaluate_condition(
+                        nt._modified_hdrs, nt.condition, conditions
+                    )
+                    if cond_value is not None:
+                        p4_node.next_[a] = nt.next_[cond_value]
+                        change = True
+    for _, p4_node in hlir.p4_nodes.items():
+        del p4_node._modified_hdrs
+    p4_tables._purge_unused_nodes(hlir)
+
+def optimization_time(h, optimize):
+    def run():
+        with h.context.activate():
+            optimize(h)
+    start = time.time()
+    quiet(run)
+    return time.time() - start
+
+def main():
+    argparser = argparse.ArgumentParser(description = __doc__.split("\n\n")[1])
+    argparser.add_argument("--blocks", default = "100,200,300",
+                           help = "comma-separated numbers of blocks")
+    args = argparser.parse_args()
+
+    with temporary_directory() as tmp_dir:
+        print "%8s %8s %12s %12s %11s %9s" % (
+            "blocks", "nodes", "sweep", "worklist", "iterations", "rewrites")
+        for num_blocks in [int(n) for n in args.blocks.split(",")]:
+            source = write_program(generate_program(num_blocks), tmp_dir)
+            h_sweep = build(source, optimize = False, analyze = False,
+                            parse_cache = False)
+            h = build(source, optimize = False, analyze = False,
+                      parse_cache = False)
+            num_nodes = len(h.p4_nodes)
+            sweep_time = optimization_time(h_sweep, sweep_optimize_table_graph)
+            worklist_time = optimization_time(h, p4.optimize_table_graph)
+            differences = compare(h_sweep, h, analyze = False)
+            if differences:
+                sys.exit("the optimized graphs differ:\n%s"
+                         % "\n".join(differences[:10]))
+            print "%8d %8d %10.3f s %10.3f s %11d %9d" % (
+                num_blocks, num_nodes, sweep_time, worklist_time,
+                h.build_stats["table_graph_iterations"],
+                h.build_stats["table_graph_rewrites"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Structural comparison of two HLIR instances, e.g. of a program rebuilt
+incrementally with HLIR.rebuild() and of the same program built from scratch.
+
+The HLIR objects of both instances are compared attribute by attribute. An
+HLIR object referenced by another one is compared by type and name only, so
+that the comparison does not depend on the identity of the objects, nor on the
+iteration order of the dictionaries and sets which are not ordered.
+"""
+
+from p4_hlir.util.OrderedSet import OrderedSet
+from p4_hlir.util.startup import lazy_import
+
+p4 = lazy_import("p4_hlir.hlir.p4")
+_analysis_utils = lazy_import("p4_hlir.hlir.analysis_utils")
+
+# attributes of the HLIR instance which are not part of the program
+_IGNORED_HLIR_ATTRIBUTES = frozenset([
+    "source_files", "source_txt", "preprocessor_args", "analysis_args",
+    "primitives", "source_dependencies", "build_stats", "context",
+    "p4_analyses", "_declarations",
+])
+
+# attributes of the HLIR objects which are not part of the program
+_IGNORED_ATTRIBUTES = frozenset(["_analyses"])
+
+def _is_reference(value):
+    return isinstance(value, (p4.p4_object, p4.p4_field,
+                              _analysis_utils.p4_pseudo_field))
+
+def _state(value):
+    if hasattr(value, "__dict__"):
+        state = dict(vars(value))
+    else:
+        state = {}
+    for name in getattr(type(value), "__slots__", ()):
+        if hasattr(value, name):
+            state[name] = getattr(value, name)
+    for name in _IGNORED_ATTRIBUTES:
+        state.pop(name, None)
+    return state
+
+def _canonical(value):
+    """
+    A representation of an attribute value made of tuples, strings and
+    numbers, in which the HLIR objects are references
+    """
+    if _is_reference(value):
+        # the name of a field is qualified by the name of its instance
+        return ("ref", type(value).__name__, str(value))
+    elif value is None or isinstance(value, (bool, int, long, float,
+                                             basestring)):
+        return value
+    elif isinstance(value, type):
+        return ("type", value.__name__)
+    elif isinstance(value, p4.p4_enum):
+        return ("enum", type(value).__name__, str(value))
+    elif isinstance(value, (list, tuple, OrderedSet)):
+        return (type(value).__name__,) + tuple(_canonical(v) for v in value)
+    elif isinstance(value, (set, frozenset)):
+        return ("set",) + tuple(sorted(_canonical(v) for v in value))
+    elif isinstance(value, dict):
+        items = [(_canonical(k), _canonical(v)) for k, v in value.items()]
+        if type(value) is dict:
+            items.sort()
+        return (type(value).__name__,) + tuple(items)
+    else:
+        return (type(value).__name__,) + _canonical_state(value)
+
+def _canonical_state(value):
+    return tuple(sorted(
+        (name, _canonical(v)) for name, v in _state(value).items()
+    ))
+
+def _describe(value, max_length = 200):
+    text = repr(value)
+    if len(text) > max_length:
+        text = text[:max_length] + "..."
+    return text
+
+def compare(hlir_a, hlir_b, analyze = True):
+    """
+    Returns the differences between two HLIR instances, as a list of messages
+    (empty if they are the same). Unless analyze is False, the analyses which
+    have not run yet are run first on both instances, so that their
+    annotations are compared too.
+    """
+    if analyze:
+        hlir_a.analyze()
+        hlir_b.analyze()
+
+    differences = []
+    state_a = _state(hlir_a)
+    state_b = _state(hlir_b)
+    for name in sorted(set(state_a) | set(state_b)):
+        if name in _IGNORED_HLIR_ATTRIBUTES:
+            continue
+        if name not in state_a or name not in state_b:
+            differences.append("HLIR attribute '%s' is missing" % name)
+            continue
+        value_a, value_b = state_a[name], state_b[name]
+        is_collection = (
+            isinstance(value_a, dict) and isinstance(value_b, dict) and
+            all(_is_reference(v) for v in value_a.values()) and
+            all(_is_reference(v) for v in value_b.values())
+        )
+        if not is_collection:
+            # p4_objects, p4_ingress_ptr...
+            canonical_a, canonical_b = _canonical(value_a), _canonical(value_b)
+            if canonical_a != canonical_b:
+                differences.append("%s: %s != %s" % (
+                    name, _describe(canonical_a), _describe(canonical_b)
+                ))
+            continue
+
+        # p4_tables, p4_fields...: the objects themselves are compared
+        if value_a.keys() != value_b.keys():
+            differences.append("%s: keys %s != %s" % (
+                name, _describe(value_a.keys()), _describe(value_b.keys())
+            ))
+        for key in value_a:
+            if key not in value_b:
+                continue
+            object_a, object_b = value_a[key], value_b[key]
+            if type(object_a) is not type(object_b):
+                differences.append("%s[%r]: %s != %s" % (
+                    name, key, type(object_a).__name__,
+                    type(object_b).__name__
+                ))
+                continue
+            attributes_a = _state(object_a)
+            attributes_b = _state(object_b)
+            for attribute in sorted(set(attributes_a) | set(attributes_b)):
+                canonical_a = _canonical(attributes_a.get(attribute))
+                canonical_b = _canonical(attributes_b.get(attribute))
+                if canonical_a != canonical_b:
+                    differences.append("%s[%r].%s: %s != %s" % (
+                        name, key, attribute, _describe(canonical_a),
+                        _describe(canonical_b)
+                    ))
+    return differences
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from p4_hlir.util.build_context import current_context
+
 class Types:
     (header_type,
      header_instance,
@@ -61,48 +63,96 @@ class Types:
     def get_name(type_):
         return Types.types_to_names[type_]
 
+# Pragma set of the objects which do not have any pragma, shared to save memory.
+# The parser replaces it with a new set for every object which has pragmas.
+NO_PRAGMAS = frozenset()
+
+# AST nodes declare their attributes in __slots__ instead of using a __dict__,
+# which makes them much smaller. A subclass must list in its own __slots__ the
+# attributes it adds, including the ones set outside of __init__ (e.g. by the
+# semantic checker).
 class P4TreeNode(object):
-    errors_cnt = 0
-    warnings_cnt = 0
+    __slots__ = ("filename", "lineno")
+
+    # class -> names of all the slots of its instances
+    _all_slots = {}
 
     def __init__(self, filename, lineno):
+        # all the nodes of a file share the same file name string
+        if type(filename) is str:
+            filename = intern(filename)
         self.filename = filename
         self.lineno = lineno
 
+    @classmethod
+    def get_slots(cls):
+        slots = P4TreeNode._all_slots.get(cls)
+        if slots is None:
+            slots = []
+            for klass in reversed(cls.__mro__):
+                slots += klass.__dict__.get("__slots__", ())
+            slots = tuple(slots)
+            P4TreeNode._all_slots[cls] = slots
+        return slots
+
+    def __getstate__(self):
+        # slots which were never assigned are left out
+        state = {}
+        for name in self.get_slots():
+            try:
+                state[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        if type(self.filename) is str:
+            self.filename = intern(self.filename)
+
     def check(self, symbols, header_fields, types = None):
         raise NotImplementedError("semantic check method was not implemented")
 
     def dump_to_p4(self, hlir):
         raise NotImplementedError("dump_to_p4 method was not implemented")
 
+    # The diagnostic counters are kept in the context of the current build
+
     @classmethod
     def print_error(cls, msg):
-        cls.errors_cnt += 1
-        print "Semantic error: " + msg
+        context = current_context()
+        context.errors_cnt += 1
+        print >> context.get_output(), "Semantic error: " + msg
 
     @classmethod
     def get_errors_cnt(cls):
-        return cls.errors_cnt
+        return current_context().errors_cnt
 
     @classmethod
     def reset_errors_cnt(cls):
-        cls.errors_cnt = 0
+        current_context().errors_cnt = 0
 
     @classmethod
     def print_warning(cls, msg):
-        cls.warnings_cnt += 1
-        print "Semantic warning: " + msg
+        context = current_context()
+        context.warnings_cnt += 1
+        print >> context.get_output(), "Semantic warning: " + msg
 
 class P4Program(P4TreeNode):
+    __slots__ = ("objects",)
+
     def __init__(self, filename, lineno, objects):
         super(P4Program, self).__init__(filename, lineno)
         self.objects = objects
 
 class P4Object(P4TreeNode):
+    __slots__ = ("_mark", "_pragmas")
+
     def __init__(self, filename, lineno):
         super(P4Object, self).__init__(filename, lineno)
         self._mark = False
-        self._pragmas = set()
+        self._pragmas = NO_PRAGMAS
 
     def mark(self):
         pass
@@ -114,24 +164,34 @@ class P4Object(P4TreeNode):
         return True
 
 class P4Expression(P4TreeNode):
+    __slots__ = ()
+
     def __init__(self, filename, lineno):
         super(P4Expression, self).__init__(filename, lineno)
 
 class P4NoExpression(P4Expression):
+    __slots__ = ()
+
     def __init__(self, filename, lineno):
         super(P4NoExpression, self).__init__(filename, lineno)
 
 class P4ValidExpression(P4Expression):
+    __slots__ = ("header_ref",)
+
     def __init__(self, filename, lineno, header_ref):
         super(P4ValidExpression, self).__init__(filename, lineno)
         self.header_ref = header_ref
 
 class P4BoolConstantExpression(P4Expression):
+    __slots__ = ("value",)
+
     def __init__(self, filename, lineno, value):
         super(P4BoolConstantExpression, self).__init__(filename, lineno)
         self.value = value
 
 class P4BinaryExpression(P4Expression):
+    __slots__ = ("op", "left", "right")
+
     def __init__(self, filename, lineno, op, left, right):
         super(P4BinaryExpression, self).__init__(filename, lineno)
         self.op = op
@@ -139,6 +199,8 @@ class P4BinaryExpression(P4Expression):
         self.right = right
 
 class P4BoolBinaryExpression(P4Expression):
+    __slots__ = ("op", "left", "right")
+
     def __init__(self, filename, lineno, op, left, right):
         super(P4BoolBinaryExpression, self).__init__(filename, lineno)
         self.op = op
@@ -146,41 +208,55 @@ class P4BoolBinaryExpression(P4Expression):
         self.right = right
 
 class P4UnaryExpression(P4Expression):
+    __slots__ = ("op", "right")
+
     def __init__(self, filename, lineno, op, right):
         super(P4UnaryExpression, self).__init__(filename, lineno)
         self.op = op
         self.right = right
 
 class P4BoolUnaryExpression(P4Expression):
+    __slots__ = ("op", "right")
+
     def __init__(self, filename, lineno, op, right):
         super(P4BoolUnaryExpression, self).__init__(filename, lineno)
         self.op = op
         self.right = right
 
 class P4RefExpression(P4Expression):
+    __slots__ = ("name", "_array_ref")
+
     def __init__(self, filename, lineno, name):
         super(P4RefExpression, self).__init__(filename, lineno)
         self.name = name
 
 class P4HeaderRefExpression(P4RefExpression):
+    __slots__ = ("idx",)
+
     def __init__(self, filename, lineno, header, idx = None):
         super(P4HeaderRefExpression, self).__init__(filename, lineno, header)
         self.idx = idx
 
 # header ref can be latest !
 class P4FieldRefExpression(P4Expression):
+    __slots__ = ("header_ref", "field")
+
     def __init__(self, filename, lineno, header_ref, field):
         super(P4FieldRefExpression, self).__init__(filename, lineno)
         self.header_ref = header_ref # can be HeaderRef or Ref
         self.field = field
 
 class P4CurrentExpression(P4Expression):
+    __slots__ = ("offset", "width")
+
     def __init__(self, filename, lineno, offset, width):
         super(P4CurrentExpression, self).__init__(filename, lineno)
         self.offset = offset
         self.width = width
 
 class P4NamedObject(P4Object):
+    __slots__ = ("name",)
+
     def __init__(self, filename, lineno, name):
         super(P4NamedObject, self).__init__(filename, lineno)
         self.name = name
@@ -198,6 +274,8 @@ class P4NamedObject(P4Object):
         return self._mark
 
 class P4HeaderType(P4NamedObject):
+    __slots__ = ("layout", "length", "max_length")
+
     def __init__(self, filename, lineno, name, layout, length, max_length):
         super(P4HeaderType, self).__init__(filename, lineno, name)
         self.layout = layout
@@ -213,6 +291,8 @@ class P4HeaderType(P4NamedObject):
         else: return self._mark
 
 class P4HeaderInstance(P4NamedObject):
+    __slots__ = ("header_type",)
+
     def __init__(self, filename, lineno, header_type, name):
         super(P4HeaderInstance, self).__init__(filename, lineno, name)
         self.header_type = header_type
@@ -221,12 +301,16 @@ class P4HeaderInstance(P4NamedObject):
         return Types.header_instance
 
 class P4HeaderInstanceRegular(P4HeaderInstance):
+    __slots__ = ("size",)
+
     def __init__(self, filename, lineno, header_type, name, size = None):
         super(P4HeaderInstanceRegular, self).__init__(filename, lineno,
                                                       header_type, name)
         self.size = size
 
 class P4HeaderInstanceMetadata(P4HeaderInstance):
+    __slots__ = ("initializer",)
+
     def __init__(self, filename, lineno, header_type, name, initializer = []):
         super(P4HeaderInstanceMetadata, self).__init__(filename, lineno,
                                                        header_type, name)
@@ -238,6 +322,8 @@ class P4HeaderInstanceMetadata(P4HeaderInstance):
         else: return self._mark
 
 class P4FieldList(P4NamedObject):
+    __slots__ = ("entries",)
+
     def __init__(self, filename, lineno, name, entries):
         super(P4FieldList, self).__init__(filename, lineno, name)
         self.entries = entries
@@ -246,6 +332,8 @@ class P4FieldList(P4NamedObject):
         return Types.field_list
 
 class P4FieldListCalculation(P4NamedObject):
+    __slots__ = ("input_list", "algo", "out_width")
+
     def __init__(self, filename, lineno, name, input_list, algo, out_width):
         super(P4FieldListCalculation, self).__init__(filename, lineno, name)
         self.input_list = input_list
@@ -256,12 +344,16 @@ class P4FieldListCalculation(P4NamedObject):
         return Types.field_list_calculation
 
 class P4CalculatedField(P4Object):
+    __slots__ = ("field_ref", "update_verify_list")
+
     def __init__(self, filename, lineno, field_ref, update_verify_list):
         super(P4CalculatedField, self).__init__(filename, lineno)
         self.field_ref = field_ref
         self.update_verify_list = update_verify_list
 
 class P4UpdateVerify(P4TreeNode):
+    __slots__ = ("op", "field_list_calculation", "if_cond")
+
     def __init__(self, filename, lineno, op, field_list_calculation,
                  if_cond = None):
         super(P4UpdateVerify, self).__init__(filename, lineno)
@@ -270,6 +362,8 @@ class P4UpdateVerify(P4TreeNode):
         self.if_cond = if_cond
 
 class P4ValueSet(P4NamedObject):
+    __slots__ = ()
+
     def __init__(self, filename, lineno, name):
         super(P4ValueSet, self).__init__(filename, lineno, name)
 
@@ -277,6 +371,8 @@ class P4ValueSet(P4NamedObject):
         return Types.value_set
 
 class P4ParserFunction(P4NamedObject):
+    __slots__ = ("extract_and_set_statements", "return_statement")
+
     def __init__(self, filename, lineno, name,
                  extract_and_set_statements, return_statement):
         super(P4ParserFunction, self).__init__(filename, lineno, name)
@@ -291,6 +387,9 @@ class P4ParserFunction(P4NamedObject):
         else: return self._mark
 
 class P4Counter(P4NamedObject):
+    __slots__ = ("type_", "direct_or_static", "instance_count", "min_width",
+                 "attributes")
+
     def __init__(self, filename, lineno, name, type_,
                  direct_or_static, instance_count,
                  min_width, attributes):
@@ -305,6 +404,8 @@ class P4Counter(P4NamedObject):
         return Types.counter
 
 class P4Meter(P4NamedObject):
+    __slots__ = ("type_", "result", "direct_or_static", "instance_count")
+
     def __init__(self, filename, lineno, name, type_,
                  direct_or_static, result, instance_count):
         super(P4Meter, self).__init__(filename, lineno, name)
@@ -317,6 +418,9 @@ class P4Meter(P4NamedObject):
         return Types.meter
 
 class P4Register(P4NamedObject):
+    __slots__ = ("width", "layout", "direct_or_static", "instance_count",
+                 "attributes")
+
     def __init__(self, filename, lineno, name, width, layout,
                  direct_or_static, instance_count, attributes):
         super(P4Register, self).__init__(filename, lineno, name)
@@ -330,11 +434,15 @@ class P4Register(P4NamedObject):
         return Types.register
 
 class P4Action(P4NamedObject):
+    __slots__ = ("formals",)
+
     def __init__(self, filename, lineno, name, formals):
         self.formals = formals
         super(P4Action, self).__init__(filename, lineno, name)
 
 class P4PrimitiveAction(P4Action):
+    __slots__ = ("optional", "required_args", "types", "std")
+
     def __init__(self, filename, lineno, name,
                  formals = [], optional = None, types = None, std = False):
         super(P4PrimitiveAction, self).__init__(filename, lineno, name, formals)
@@ -354,6 +462,8 @@ class P4PrimitiveAction(P4Action):
         else: return self._mark
 
 class P4ActionFunction(P4Action):
+    __slots__ = ("action_body", "required_args")
+
     def __init__(self, filename, lineno, name, param_list, action_body):
         super(P4ActionFunction, self).__init__(filename, lineno, name, param_list)
         self.action_body = action_body
@@ -363,12 +473,17 @@ class P4ActionFunction(P4Action):
         return Types.action_function
 
 class P4ActionCall(P4TreeNode):
+    __slots__ = ("action", "arg_list")
+
     def __init__(self, filename, lineno, name, arg_list = []):
         super(P4ActionCall, self).__init__(filename, lineno)
         self.action = name
         self.arg_list = arg_list
 
 class P4Table(P4NamedObject):
+    __slots__ = ("reads", "action_spec", "action_profile", "default_action",
+                 "min_size", "max_size", "size", "support_timeout")
+
     def __init__(self, filename, lineno, name, action_spec, action_profile,
                  default_action = None,
                  reads = [], min_size = None, max_size = None, size = None,
@@ -387,18 +502,24 @@ class P4Table(P4NamedObject):
         return Types.table
 
 class P4TableFieldMatch(P4TreeNode):
+    __slots__ = ("field_or_masked", "match_type")
+
     def __init__(self, filename, lineno, field_or_masked, match_type):
         super(P4TableFieldMatch, self).__init__(filename, lineno)
         self.field_or_masked = field_or_masked
         self.match_type = match_type
 
 class P4TableDefaultAction(P4TreeNode):
+    __slots__ = ("action_name", "action_data")
+
     def __init__(self, filename, lineno, action_name, action_data):
         super(P4TableDefaultAction, self).__init__(filename, lineno)
         self.action_name = action_name
         self.action_data = action_data
 
 class P4ActionProfile(P4NamedObject):
+    __slots__ = ("action_spec", "size", "selector")
+
     def __init__(self, filename, lineno, name, action_spec,
                  size = None, selector = None):
         super(P4ActionProfile, self).__init__(filename, lineno, name)
@@ -410,6 +531,8 @@ class P4ActionProfile(P4NamedObject):
         return Types.action_profile
 
 class P4ActionSelector(P4NamedObject):
+    __slots__ = ("selection_key", "selection_mode", "selection_type")
+
     def __init__(self, filename, lineno, name, selection_key,
                  selection_mode = None, selection_type = None):
         super(P4ActionSelector, self).__init__(filename, lineno, name)
@@ -421,6 +544,8 @@ class P4ActionSelector(P4NamedObject):
         return Types.action_selector
 
 class P4ControlFunction(P4NamedObject):
+    __slots__ = ("statements",)
+
     def __init__(self, filename, lineno, name, statements):
         super(P4ControlFunction, self).__init__(filename, lineno, name)
         self.statements = statements
@@ -433,40 +558,56 @@ class P4ControlFunction(P4NamedObject):
         else: return self._mark
 
 class P4ControlFunctionStatement(P4TreeNode):
+    __slots__ = ()
+
     def __init__(self, filename, lineno):
         super(P4ControlFunctionStatement, self).__init__(filename, lineno)
 
 class P4ControlFunctionApply(P4ControlFunctionStatement):
+    __slots__ = ("table",)
+
     def __init__(self, filename, lineno, table):
         super(P4ControlFunctionApply, self).__init__(filename, lineno)
         self.table = table
 
 class P4ControlFunctionApplyAndSelect(P4ControlFunctionStatement):
+    __slots__ = ("table", "case_list")
+
     def __init__(self, filename, lineno, table, case_list):
         super(P4ControlFunctionApplyAndSelect, self).__init__(filename, lineno)
         self.table = table
         self.case_list = case_list
 
 class P4ControlFunctionApplyCase(P4TreeNode):
+    __slots__ = ("statements",)
+
     def __init__(self, filename, lineno, statements):
         super(P4ControlFunctionApplyCase, self).__init__(filename, lineno)
         self.statements = statements
 
 class P4ControlFunctionApplyActionCase(P4ControlFunctionApplyCase):
+    __slots__ = ("action_list",)
+
     def __init__(self, filename, lineno, action_list, statements):
         super(P4ControlFunctionApplyActionCase, self).__init__(filename, lineno, statements)
         self.action_list = action_list
 
 class P4ControlFunctionApplyActionDefaultCase(P4ControlFunctionApplyCase):
+    __slots__ = ()
+
     def __init__(self, filename, lineno, statements):
         super(P4ControlFunctionApplyActionDefaultCase, self).__init__(filename, lineno, statements)
 
 class P4ControlFunctionApplyHitMissCase(P4ControlFunctionApplyCase):
+    __slots__ = ("hit_or_miss",)
+
     def __init__(self, filename, lineno, hit_or_miss, statements):
         super(P4ControlFunctionApplyHitMissCase, self).__init__(filename, lineno, statements)
         self.hit_or_miss = hit_or_miss
 
 class P4ControlFunctionIfElse(P4ControlFunctionStatement):
+    __slots__ = ("cond", "if_body", "else_body")
+
     def __init__(self, filename, lineno, cond, if_body, else_body = []):
         super(P4ControlFunctionIfElse, self).__init__(filename, lineno)
         self.cond = cond
@@ -474,11 +615,15 @@ class P4ControlFunctionIfElse(P4ControlFunctionStatement):
         self.else_body = else_body
 
 class P4ControlFunctionCall(P4ControlFunctionStatement):
+    __slots__ = ("name",)
+
     def __init__(self, filename, lineno, name):
         super(P4ControlFunctionCall, self).__init__(filename, lineno)
         self.name = name
 
 class P4ParserException(P4NamedObject):
+    __slots__ = ("set_statements", "return_or_drop")
+
     def __init__(self, filename, lineno, name, set_statements, return_or_drop):
         super(P4ParserException, self).__init__(filename, lineno, name)
         self.set_statements = set_statements
@@ -488,68 +633,94 @@ class P4ParserException(P4NamedObject):
         return Types.parser_exception
 
 class P4ParserExceptionDrop(P4TreeNode):
+    __slots__ = ()
+
     def __init__(self, filename, lineno):
         super(P4ParserExceptionDrop, self).__init__(filename, lineno)
 
 class P4ParserExceptionReturn(P4TreeNode):
+    __slots__ = ("control_function",)
+
     def __init__(self, filename, lineno, control_function):
         super(P4ParserExceptionReturn, self).__init__(filename, lineno)
         self.control_function = control_function
 
 class P4ParserExtract(P4TreeNode):
+    __slots__ = ("header_ref",)
+
     def __init__(self, filename, lineno, header_ref):
         super(P4ParserExtract, self).__init__(filename, lineno)
         self.header_ref = header_ref
 
 class P4ParserSetMetadata(P4TreeNode):
+    __slots__ = ("field_ref", "expr")
+
     def __init__(self, filename, lineno, field_ref, expr):
         super(P4ParserSetMetadata, self).__init__(filename, lineno)
         self.field_ref = field_ref
         self.expr = expr
 
 class P4ParserReturn(P4TreeNode):
+    __slots__ = ()
+
     def __init__(self, filename, lineno):
         super(P4ParserReturn, self).__init__(filename, lineno)
 
 class P4ParserImmediateReturn(P4ParserReturn):
+    __slots__ = ("name",)
+
     def __init__(self, filename, lineno, name):
         super(P4ParserImmediateReturn, self).__init__(filename, lineno)
         self.name = name
 
 class P4ParserSelectReturn(P4ParserReturn):
+    __slots__ = ("select", "cases")
+
     def __init__(self, filename, lineno, select, cases): # select is list
         super(P4ParserSelectReturn, self).__init__(filename, lineno)
         self.select = select
         self.cases = cases
 
 class P4ParserSelectCase(P4TreeNode):
+    __slots__ = ("values", "return_")
+
     def __init__(self, filename, lineno, values, return_):
         super(P4ParserSelectCase, self).__init__(filename, lineno)
         self.values = values
         self.return_ = return_
 
 class P4ParserSelectDefaultCase(P4TreeNode):
+    __slots__ = ("return_",)
+
     def __init__(self, filename, lineno, return_):
         super(P4ParserSelectDefaultCase, self).__init__(filename, lineno)
         self.return_ = return_
 
 class P4ParserParseError(P4TreeNode):
+    __slots__ = ("parse_error",)
+
     def __init__(self, filename, lineno, parse_error):
         super(P4ParserParseError, self).__init__(filename, lineno)
         self.parse_error = parse_error
 
 class P4String(P4Expression):
+    __slots__ = ("s",)
+
     def __init__(self, filename, lineno, s):
         super(P4String, self).__init__(filename, lineno)
         self.s = s
 
 class P4Integer(P4Expression):
+    __slots__ = ("i", "width")
+
     def __init__(self, filename, lineno, i, width = 0):
         super(P4Integer, self).__init__(filename, lineno)
         self.i = i
         self.width = width
 
 class P4Bool(P4Expression):
+    __slots__ = ("b",)
+
     def __init__(self, filename, lineno, b):
         super(P4Bool, self).__init__(filename, lineno)
         self.b = b
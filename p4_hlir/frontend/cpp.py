@@ -0,0 +1,1272 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A C preprocessor written in pure Python.
+
+It implements the subset of the C preprocessor used by P4 programs
+(#include, object-like and function-like macros with # and ##, conditional
+compilation, #line, -D, -U and -I) and formats its output the same way as
+'gcc -E' does, including the '# <line> "<file>"' markers, so that the
+tokenizer cannot tell the difference. The structure (token contexts, padding
+tokens, line change callbacks) closely follows the one of libcpp, which is what
+makes the output match gcc's byte for byte.
+"""
+
+import os
+import re
+
+class CppError(Exception):
+    pass
+
+# Implicitly included by gcc on most Linux distributions
+STDC_PREDEF = "/usr/include/stdc-predef.h"
+
+SYSTEM_INCLUDE_DIRS = ["/usr/local/include", "/usr/include"]
+
+_token_re = re.compile("|".join([
+    r'(?P<ws>[ \t\f\v\r]+)',
+    r'(?P<comment>/\*.*?\*/|//[^\n]*)',
+    r'(?P<opencomment>/\*)',
+    r'(?P<number>\.?[0-9](?:[eEpP][+-]|[0-9A-Za-z_.])*)',
+    r'(?P<string>(?:u8|[uUL])?"(?:[^"\\\n]|\\.)*")',
+    r'(?P<char>[uUL]?\'(?:[^\'\\\n]|\\.)*\')',
+    r'(?P<name>[A-Za-z_$][A-Za-z0-9_$]*)',
+    r'(?P<punct>%:%:|\.\.\.|<<=|>>=|->|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||'
+    r'[-+*/%&|^]=|\#\#|<:|:>|<%|%>|%:|[][(){}.&*+\-~!/%<>^|?:;=,\#])',
+    r'(?P<other>.)',
+]), re.S)
+
+# Token flags
+PREV_WHITE = 1
+BOL = 2
+PASTE_LEFT = 4
+NO_EXPAND = 8
+STRINGIFY_ARG = 16
+
+class Token(object):
+    __slots__ = ["type", "value", "flags", "line", "col", "arg_index"]
+
+    def __init__(self, type, value, flags = 0, line = 0, col = 0):
+        self.type = type
+        self.value = value
+        self.flags = flags
+        self.line = line
+        self.col = col
+        self.arg_index = None
+
+    def copy(self, flags = None):
+        t = Token(self.type, self.value,
+                  self.flags if flags is None else flags, self.line, self.col)
+        t.arg_index = self.arg_index
+        return t
+
+    def is_op(self, value):
+        return self.type == "punct" and self.value == value
+
+    def __repr__(self):
+        return "Token(%s, %r)" % (self.type, self.value)
+
+class Padding(object):
+    """
+    Padding tokens carry no text, they only tell the output routine where
+    whitespace may be needed ('source' is the token whose PREV_WHITE flag
+    decides, None means only avoid accidental pasting).
+    """
+    __slots__ = ["source"]
+    type = "padding"
+    flags = 0
+
+    def __init__(self, source):
+        self.source = source
+
+_AVOID_PASTE = Padding(None)
+
+def tokenize(text, line = 1):
+    """
+    Tokenize a single line of text (used for -D definitions)
+    """
+    tokens = []
+    flags = 0
+    for m in _token_re.finditer(text):
+        kind = m.lastgroup
+        if kind in ("ws", "comment"):
+            flags |= PREV_WHITE
+            continue
+        tokens.append(Token(kind, m.group(kind), flags, line, m.start() + 1))
+        flags = 0
+    return tokens
+
+class _Macro(object):
+    def __init__(self, name, params, variadic, body):
+        self.name = name
+        self.params = params # None for object-like macros
+        self.variadic = variadic
+        self.body = body
+        self.disabled = False
+
+class _Context(object):
+    __slots__ = ["macro", "tokens", "index"]
+
+    def __init__(self, macro, tokens):
+        self.macro = macro
+        self.tokens = tokens
+        self.index = 0
+
+class _IfState(object):
+    __slots__ = ["was_skipping", "taken", "seen_else", "line", "mi_cmacro"]
+
+    def __init__(self, was_skipping, taken, line):
+        self.was_skipping = was_skipping
+        self.taken = taken
+        self.seen_else = False
+        self.line = line
+        self.mi_cmacro = None
+
+class _FileReader(object):
+    """
+    Splits a source file into logical lines of tokens. Line splices and
+    comments spanning several lines are handled here.
+    """
+    def __init__(self, name, text, sysp, leave_markers):
+        self.name = name
+        self.sysp = sysp
+        # markers printed when the end of the file is reached
+        self.leave_markers = leave_markers
+        self.phys_lines = text.split("\n")
+        if self.phys_lines and self.phys_lines[-1] == "":
+            self.phys_lines.pop()
+        self.next_phys = 0
+        self.line = None # tokens of the current logical line
+        self.line_start = 0
+        self.tok_idx = 0
+        # added to the physical line numbers by #line
+        self.line_offset = 0
+        self.lookahead = []
+        self.if_stack = []
+        # multiple include optimization: mi_cmacro is set to the controlling
+        # macro if the file is entirely wrapped in #ifndef ... #endif
+        self.mi_valid = True
+        self.mi_cmacro = None
+
+    def _next_phys_line(self, segments, text):
+        s = self.phys_lines[self.next_phys]
+        segments.append((len(text), self.next_phys + 1 + self.line_offset))
+        self.next_phys += 1
+        while s.endswith("\\") and self.next_phys < len(self.phys_lines):
+            s = s[:-1]
+            segments.append((len(text) + len(s),
+                             self.next_phys + 1 + self.line_offset))
+            s += self.phys_lines[self.next_phys]
+            self.next_phys += 1
+        return text + s
+
+    def read_line(self):
+        """
+        Tokenize the next logical line, returns False at the end of the file
+        """
+        if self.next_phys >= len(self.phys_lines):
+            return False
+        segments = []
+        text = self._next_phys_line(segments, "")
+        tokens = []
+        flags = BOL
+        pos = 0
+        while pos < len(text):
+            m = _token_re.match(text, pos)
+            kind = m.lastgroup
+            if kind == "opencomment":
+                if self.next_phys >= len(self.phys_lines):
+                    raise CppError("%s:%d:%d: error: unterminated comment" %
+                                   (self.name, segments[0][1], pos + 1))
+                text = self._next_phys_line(segments, text + "\n")
+                continue
+            pos = m.end()
+            if kind in ("ws", "comment"):
+                flags |= PREV_WHITE
+                continue
+            offset = m.start()
+            line, line_offset = segments[0][1], 0
+            for seg_offset, seg_line in segments:
+                if seg_offset > offset: break
+                line, line_offset = seg_line, seg_offset
+            tokens.append(Token(kind, m.group(kind), flags, line,
+                                offset - line_offset + 1))
+            flags = 0
+        self.line = tokens
+        self.line_start = segments[0][1]
+        self.tok_idx = 0
+        return True
+
+class _Printer(object):
+    """
+    Formats the token stream the same way as gcc's c-ppoutput.c
+    """
+    def __init__(self):
+        self.out = []
+        self.src_line = 1
+        self.src_file = None
+        self.printed = False
+        self.prev = None
+        self.source = None
+
+    @staticmethod
+    def _quote(name):
+        return name.replace("\\", "\\\\").replace("\"", "\\\"")
+
+    def print_line(self, name, line, flags = "", sysp = 0):
+        if self.printed:
+            self.out.append("\n")
+        self.printed = False
+        self.src_line = line
+        self.src_file = name
+        self.out.append("# %d \"%s\"%s%s\n" % (line, self._quote(name), flags,
+                                               " 3 4" if sysp else ""))
+
+    def maybe_print_line(self, name, line, sysp = 0):
+        if self.printed:
+            self.out.append("\n")
+            self.src_line += 1
+            self.printed = False
+        if (line >= self.src_line and line < self.src_line + 8 and
+            name == self.src_file):
+            self.out.append("\n" * (line - self.src_line))
+            self.src_line = line
+            return False
+        self.print_line(name, line, "", sysp)
+        return True
+
+    def line_change(self, name, line, col, sysp = 0):
+        emitted = self.maybe_print_line(name, line, sysp)
+        self.prev = None
+        self.source = None
+        # gcc puts the token back in its original column, the last space
+        # being provided by the PREV_WHITE flag of the token itself
+        self.printed = True
+        if col > 2:
+            self.out.append(" " * (col - 2))
+        return emitted
+
+    def text(self):
+        return "".join(self.out)
+
+def _avoid_paste(a, b):
+    """
+    Returns True if a space is needed between tokens 'a' and 'b' so that
+    they are not read back as a single token
+    """
+    c = b.value[0] if b.type == "punct" else None
+    if a.type == "punct":
+        v = a.value
+        if c == "=" and v in ("=", "!", ">", "<", "+", "-", "*", "/", "%",
+                              "&", "|", "^", ">>", "<<"):
+            return True
+        if v == ">": return c == ">"
+        if v == "<": return c in ("<", "%", ":")
+        if v == "+": return c == "+"
+        if v == "-": return c in ("-", ">")
+        if v == "/": return c in ("/", "*")
+        if v in ("%",): return c in (":", "%")
+        if v == "&": return c == "&"
+        if v == "|": return c == "|"
+        if v == ":": return c in (":", ">")
+        if v == "->": return c == "*"
+        if v == ".": return c in (".", "%") or b.type == "number"
+        if v in ("#", "%:"): return c in ("#", "%")
+        return False
+    if a.type == "name":
+        return b.type in ("name", "char", "string")
+    if a.type == "number":
+        return (b.type in ("number", "name", "char") or
+                c in (".", "+", "-"))
+    if a.type == "other":
+        return a.value[0] == "\\" and b.type == "name"
+    return False
+
+_conditional_directives = set(["if", "ifdef", "ifndef", "elif", "else",
+                               "endif"])
+
+class CPreprocessor(object):
+    """
+    Usage: CPreprocessor(args).preprocess_file(filename) or
+    CPreprocessor(args).preprocess_str(text); 'args' are gcc style command
+    line arguments (only -D, -U and -I are supported).
+    """
+    def __init__(self, args = []):
+        self.macros = {}
+        self.quote_dirs = []
+        self.include_dirs = []
+        self.system_dirs = [d for d in SYSTEM_INCLUDE_DIRS if os.path.isdir(d)]
+        self.cmdline = []
+        self._parse_args(args)
+
+        self.readers = []
+        self.contexts = []
+        self.printer = _Printer()
+        self.skipping = False
+        self.in_directive = False
+        self.prevent_expansion = 0
+        self.parsing_args = 0
+        self.invocation = None
+        self.last_loc = None
+        self.counter = 0
+        self.once = set()
+        self.mi_guards = {}
+
+    def _parse_args(self, args):
+        args = list(args)
+        while args:
+            arg = args.pop(0)
+            for opt in ("-D", "-U", "-I", "-iquote", "-isystem"):
+                if arg.startswith(opt):
+                    value = arg[len(opt):]
+                    if not value:
+                        if not args:
+                            raise CppError("missing argument to '%s'" % opt)
+                        value = args.pop(0)
+                    break
+            else:
+                raise CppError("unsupported preprocessor option '%s'" % arg)
+            if opt == "-D":
+                self.cmdline.append((True, value))
+            elif opt == "-U":
+                self.cmdline.append((False, value))
+            else:
+                if len(value) > 1: value = value.rstrip("/")
+                {"-I": self.include_dirs,
+                 "-iquote": self.quote_dirs,
+                 "-isystem": self.system_dirs}[opt].append(value)
+
+    def _error(self, msg, line = None, col = None):
+        reader = self.readers[-1] if self.readers else None
+        if reader is None:
+            raise CppError("<command-line>: error: %s" % msg)
+        if line is None:
+            line = reader.line_start
+        if col is None:
+            raise CppError("%s:%d: error: %s" % (reader.name, line, msg))
+        raise CppError("%s:%d:%d: error: %s" % (reader.name, line, col, msg))
+
+    ##
+    ## Entry points
+    ##
+
+    def preprocess_file(self, filename):
+        with open(filename, "rU") as f:
+            text = f.read()
+        return self._run(filename, text)
+
+    def preprocess_str(self, text):
+        return self._run("<stdin>", text)
+
+    def _run(self, name, text):
+        p = self.printer
+        p.print_line(name, 0)
+        p.print_line("<built-in>", 0)
+        self.macros["__STDC__"] = _Macro("__STDC__", None, False,
+                                         [Token("number", "1")])
+        p.print_line("<command-line>", 0)
+        for define, value in self.cmdline:
+            if define:
+                if "=" in value:
+                    value = value.replace("=", " ", 1)
+                else:
+                    value += " 1"
+                self._do_define(tokenize(value))
+            else:
+                self._do_undef(tokenize(value))
+
+        main = _FileReader(name, text, 0, [])
+        self.readers.append(main)
+        if os.path.isfile(STDC_PREDEF):
+            with open(STDC_PREDEF, "rU") as f:
+                predef = f.read()
+            p.print_line(STDC_PREDEF, 1, " 1", 1)
+            self.readers.append(_FileReader(
+                STDC_PREDEF, predef, 1,
+                [("<command-line>", 0, " 2", 0), (name, 1, "", 0)]))
+        else:
+            p.print_line(name, 1)
+
+        self._scan()
+        if p.printed:
+            p.out.append("\n")
+        return p.text()
+
+    def _scan(self):
+        """
+        Port of scan_translation_unit() from gcc's c-ppoutput.c
+        """
+        p = self.printer
+        avoid_paste = False
+        while True:
+            token = self.get_token()
+            if token.type == "padding":
+                avoid_paste = True
+                if (p.source is None or
+                    (not (p.source.flags & PREV_WHITE) and
+                     token.source is None)):
+                    p.source = token.source
+                continue
+            if token.type == "eof":
+                break
+
+            if avoid_paste:
+                source = p.source
+                if source is None:
+                    source = token
+                if (source.flags & PREV_WHITE or
+                    (p.prev is not None and _avoid_paste(p.prev, token)) or
+                    (p.prev is None and token.is_op("#"))):
+                    p.out.append(" ")
+            elif token.flags & PREV_WHITE:
+                name, line, col, sysp = self.last_loc
+                if line != p.src_line:
+                    p.line_change(name, line, col, sysp)
+                p.out.append(" ")
+
+            avoid_paste = False
+            p.source = None
+            p.prev = token
+            p.out.append(token.value)
+            p.printed = True
+
+    ##
+    ## Token stream
+    ##
+
+    def _lex(self):
+        """
+        Returns the next token from the current file, handling directives
+        and the end of included files
+        """
+        while True:
+            reader = self.readers[-1]
+            if reader.lookahead:
+                token = reader.lookahead.pop()
+                if token.type == "eof": continue
+            else:
+                if reader.line is None or reader.tok_idx >= len(reader.line):
+                    if not reader.read_line():
+                        if self.parsing_args or len(self.readers) == 1:
+                            # do not pop the buffer while collecting macro
+                            # arguments: an invocation cannot span files
+                            eof = Token("eof", "")
+                            if len(self.readers) == 1:
+                                self._check_if_stack(reader)
+                            return eof
+                        self._leave_file()
+                        continue
+                    if not reader.line: continue
+                token = reader.line[reader.tok_idx]
+                reader.tok_idx += 1
+
+            if token.flags & BOL:
+                if token.is_op("#") and self.parsing_args != 1:
+                    self._handle_directive(reader)
+                    continue
+                if self.skipping:
+                    reader.tok_idx = len(reader.line)
+                    continue
+                reader.mi_valid = False
+                if not self.parsing_args:
+                    self.printer.line_change(reader.name, token.line,
+                                             token.col, reader.sysp)
+            return token
+
+    def _backup(self, token):
+        if self.contexts:
+            self.contexts[-1].index -= 1
+        else:
+            self.readers[-1].lookahead.append(token)
+
+    def get_token(self):
+        """
+        Port of cpp_get_token() from libcpp: returns the next token after
+        macro expansion, interleaved with padding tokens
+        """
+        while True:
+            if not self.contexts:
+                token = self._lex()
+                reader = self.readers[-1]
+                self.last_loc = (reader.name, token.line, token.col,
+                                 reader.sysp)
+            else:
+                context = self.contexts[-1]
+                if context.index < len(context.tokens):
+                    token = context.tokens[context.index]
+                    context.index += 1
+                    if token.flags & PASTE_LEFT and token.type != "padding":
+                        token = self._paste_all(token)
+                        if self.in_directive: continue
+                        return Padding(token)
+                else:
+                    self.contexts.pop()
+                    if context.macro is not None:
+                        context.macro.disabled = False
+                    if self.in_directive: continue
+                    return _AVOID_PASTE
+                self.last_loc = self.invocation
+
+            if token.type == "padding":
+                return token
+            token_loc = self.last_loc
+            if (token.type != "name" or token.flags & NO_EXPAND or
+                self.prevent_expansion):
+                return token
+
+            macro = self.macros.get(token.value)
+            if macro is None:
+                builtin = self._builtin(token)
+                if builtin is None:
+                    return token
+                self.contexts.append(_Context(None, [builtin]))
+                if self.in_directive: continue
+                return Padding(token)
+            if macro.disabled:
+                return token.copy(token.flags | NO_EXPAND)
+            if not self.contexts:
+                self.invocation = self.last_loc
+            if self._enter_macro_context(token, macro):
+                if self.in_directive: continue
+                return Padding(token)
+            self.last_loc = token_loc
+            return token
+
+    def _builtin(self, token):
+        if token.value == "__LINE__":
+            line = (self.invocation if self.contexts else self.last_loc)[1]
+            return Token("number", str(line))
+        if token.value == "__FILE__":
+            name = self.readers[-1].name
+            return Token("string", "\"%s\"" % _Printer._quote(name))
+        if token.value == "__COUNTER__":
+            self.counter += 1
+            return Token("number", str(self.counter - 1))
+        return None
+
+    ##
+    ## Macro expansion
+    ##
+
+    def _enter_macro_context(self, name_token, macro):
+        if macro.params is not None:
+            self.prevent_expansion += 1
+            self.parsing_args = 1
+            try:
+                args = self._funlike_invocation(name_token, macro)
+            finally:
+                self.parsing_args = 0
+                self.prevent_expansion -= 1
+            if args is None:
+                return False
+            if macro.params:
+                tokens = self._replace_args(macro, args)
+            else:
+                tokens = macro.body
+        else:
+            tokens = macro.body
+        macro.disabled = True
+        self.contexts.append(_Context(macro, tokens))
+        return True
+
+    def _funlike_invocation(self, name_token, macro):
+        padding = None
+        token = self.get_token()
+        while token.type == "padding":
+            if (padding is None or padding.source is None or
+                (not (padding.source.flags & PREV_WHITE) and
+                 token.source is None)):
+                padding = token
+            token = self.get_token()
+        if token.is_op("("):
+            self.parsing_args = 2
+            return self._collect_args(name_token, macro)
+        self._backup(token)
+        if padding is not None:
+            self.contexts.append(_Context(None, [padding]))
+        return None
+
+    def _collect_args(self, name_token, macro):
+        nparams = len(macro.params)
+        args = []
+        while True:
+            arg = []
+            depth = 0
+            while True:
+                token = self.get_token()
+                if token.type == "padding":
+                    if not arg: continue
+                elif token.is_op("("):
+                    depth += 1
+                elif token.is_op(")"):
+                    if depth == 0: break
+                    depth -= 1
+                elif token.is_op(","):
+                    if depth == 0 and not (macro.variadic and
+                                           len(args) + 1 == nparams):
+                        break
+                elif token.type == "eof":
+                    self._backup(token)
+                    self._error("unterminated argument list invoking macro "
+                                "\"%s\"" % macro.name,
+                                name_token.line, name_token.col)
+                arg.append(token)
+            while arg and arg[-1].type == "padding":
+                arg.pop()
+            args.append(arg)
+            if token.is_op(")"): break
+
+        if len(args) == 1 and nparams == 0 and not args[0]:
+            return []
+        if len(args) < nparams:
+            if macro.variadic and len(args) + 1 == nparams:
+                args.append([])
+            else:
+                self._error("macro \"%s\" requires %d arguments, but only %d "
+                            "given" % (macro.name, nparams, len(args)),
+                            name_token.line, name_token.col)
+        elif len(args) > nparams:
+            self._error("macro \"%s\" passed %d arguments, but takes just %d"
+                        % (macro.name, len(args), nparams),
+                        name_token.line, name_token.col)
+        return args
+
+    def _expand_arg(self, arg):
+        """
+        Fully macro-expand an argument before substitution
+        """
+        eof = Token("eof", "")
+        self.contexts.append(_Context(None, arg + [eof]))
+        depth = len(self.contexts)
+        expanded = []
+        while True:
+            token = self.get_token()
+            if token is eof: break
+            expanded.append(token)
+        assert len(self.contexts) == depth
+        self.contexts.pop()
+        return expanded
+
+    @staticmethod
+    def _stringify(arg):
+        out = []
+        source = None
+        for token in arg:
+            if token.type == "padding":
+                if (source is None or
+                    (not (source.flags & PREV_WHITE) and
+                     token.source is None)):
+                    source = token.source
+                continue
+            if out:
+                if source is None:
+                    source = token
+                if source.flags & PREV_WHITE:
+                    out.append(" ")
+            source = None
+            if token.type in ("string", "char"):
+                out.append(token.value.replace("\\", "\\\\")
+                           .replace("\"", "\\\""))
+            else:
+                out.append(token.value)
+        return Token("string", "\"%s\"" % "".join(out))
+
+    def _replace_args(self, macro, args):
+        expanded = [None] * len(args)
+        result = []
+        body = macro.body
+        for i, src in enumerate(body):
+            if src.arg_index is None:
+                result.append(src)
+                continue
+            arg = args[src.arg_index]
+            prev_paste = i > 0 and body[i - 1].flags & PASTE_LEFT
+            if src.flags & STRINGIFY_ARG:
+                tokens = [self._stringify(arg)]
+            elif src.flags & PASTE_LEFT or prev_paste:
+                tokens = arg
+            else:
+                if expanded[src.arg_index] is None:
+                    expanded[src.arg_index] = self._expand_arg(arg)
+                tokens = expanded[src.arg_index]
+
+            # GNU extension: ', ## __VA_ARGS__' swallows the comma when the
+            # variable arguments are empty
+            if (macro.variadic and src.arg_index == len(args) - 1 and
+                prev_paste and not arg and result and
+                result[-1].is_op(",")):
+                result.pop()
+                continue
+
+            if not self.in_directive and i > 0 and not prev_paste:
+                result.append(Padding(src))
+            if tokens:
+                result.extend(tokens)
+                if src.flags & PASTE_LEFT:
+                    result[-1] = result[-1].copy(result[-1].flags | PASTE_LEFT)
+            elif prev_paste and not (src.flags & PASTE_LEFT):
+                # the right hand side of ## is a placemarker
+                for j in xrange(len(result) - 1, -1, -1):
+                    if result[j].type != "padding":
+                        result[j] = result[j].copy(result[j].flags &
+                                                   ~PASTE_LEFT)
+                        break
+            if not self.in_directive and not (src.flags & PASTE_LEFT):
+                result.append(_AVOID_PASTE)
+        return result
+
+    def _paste_all(self, lhs):
+        """
+        Implements the ## operator, the pasted token is pushed in a context of
+        its own
+        """
+        context = self.contexts[-1]
+        first = lhs
+        value = lhs.value
+        while True:
+            if context.index >= len(context.tokens): break
+            rhs = context.tokens[context.index]
+            context.index += 1
+            if rhs.type == "padding":
+                continue
+            value += rhs.value
+            if not (rhs.flags & PASTE_LEFT): break
+        tokens = tokenize(value)
+        if len(tokens) != 1:
+            self._error("pasting \"%s\" does not give a valid preprocessing "
+                        "token" % value)
+        pasted = tokens[0]
+        pasted.flags = first.flags & PREV_WHITE
+        pasted.line, pasted.col = first.line, first.col
+        self.contexts.append(_Context(None, [pasted]))
+        return first
+
+    ##
+    ## Directives
+    ##
+
+    def _handle_directive(self, reader):
+        tokens = reader.line[reader.tok_idx:]
+        reader.tok_idx = len(reader.line)
+        hash_token = reader.line[reader.tok_idx - len(tokens) - 1]
+        if not tokens:
+            return
+        name_token = tokens[0]
+        name = name_token.value
+        args = tokens[1:]
+
+        if self.skipping and name not in _conditional_directives:
+            return
+
+        # any directive other than an opening conditional means that the
+        # file is not entirely wrapped in an include guard
+        if name not in ("if", "ifdef", "ifndef"):
+            reader.mi_valid = False
+
+        self.in_directive = True
+        try:
+            if name_token.type == "number":
+                # GNU line marker: '# 33 "file"'
+                self._do_line(reader, tokens)
+            elif name == "define":
+                self._do_define(args)
+            elif name == "undef":
+                self._do_undef(args)
+            elif name in ("include", "include_next"):
+                self._do_include(reader, hash_token, args)
+            elif name == "if":
+                self._push_if(reader, hash_token,
+                              lambda: self._eval(args),
+                              self._if_cmacro(args))
+            elif name == "ifdef":
+                self._push_if(reader, hash_token,
+                              lambda: self._ifdef(args, name))
+            elif name == "ifndef":
+                self._push_if(reader, hash_token,
+                              lambda: not self._ifdef(args, name),
+                              args[0].value if args else None)
+            elif name == "elif":
+                self._do_elif(reader, args)
+            elif name == "else":
+                self._do_else(reader)
+            elif name == "endif":
+                self._do_endif(reader)
+            elif name == "line":
+                self._do_line(reader, self._expand_directive(args))
+            elif name == "pragma":
+                self._do_pragma(reader, hash_token, args)
+            elif name == "error":
+                self._error("#error %s" % " ".join(t.value for t in args),
+                            hash_token.line, hash_token.col)
+            elif name in ("warning", "ident", "sccs", "assert", "unassert"):
+                pass
+            else:
+                self._error("invalid preprocessing directive #%s" % name,
+                            name_token.line, name_token.col)
+        finally:
+            self.in_directive = False
+
+    @staticmethod
+    def _if_cmacro(args):
+        """
+        Returns X if the condition is '!defined X' or '!defined(X)'
+        """
+        values = [t.value for t in args]
+        if len(values) == 3 and values[:2] == ["!", "defined"]:
+            return values[2]
+        if (len(values) == 5 and values[:3] == ["!", "defined", "("] and
+            values[4] == ")"):
+            return values[3]
+        return None
+
+    def _do_define(self, args):
+        if not args or args[0].type != "name":
+            self._error("macro names must be identifiers")
+        name = args[0].value
+        if name == "defined":
+            self._error("\"defined\" cannot be used as a macro name")
+        params = None
+        variadic = False
+        body = args[1:]
+        if body and body[0].is_op("(") and not (body[0].flags & PREV_WHITE):
+            params = []
+            i = 1
+            while True:
+                if i >= len(body):
+                    self._error("missing ')' in macro parameter list")
+                t = body[i]
+                i += 1
+                if t.is_op(")") and not params:
+                    break
+                if t.is_op("..."):
+                    params.append("__VA_ARGS__")
+                    variadic = True
+                elif t.type == "name":
+                    params.append(t.value)
+                    if i < len(body) and body[i].is_op("..."):
+                        variadic = True
+                        i += 1
+                else:
+                    self._error("expected parameter name, found \"%s\"" %
+                                t.value)
+                if i >= len(body):
+                    self._error("missing ')' in macro parameter list")
+                t = body[i]
+                i += 1
+                if t.is_op(")"):
+                    break
+                if not t.is_op(",") or variadic:
+                    self._error("expected ',' or ')', found \"%s\"" % t.value)
+            body = body[i:]
+
+        expansion = []
+        for t in body:
+            t = t.copy(t.flags & PREV_WHITE)
+            if params is not None and t.type == "name" and t.value in params:
+                t.arg_index = params.index(t.value)
+                if expansion and expansion[-1].is_op("#"):
+                    t.flags |= STRINGIFY_ARG | (expansion[-1].flags &
+                                                PREV_WHITE)
+                    expansion.pop()
+            elif (params is not None and expansion and
+                  expansion[-1].is_op("#") and
+                  expansion[-1].arg_index is None):
+                self._error("'#' is not followed by a macro parameter")
+            if t.is_op("##"):
+                if not expansion:
+                    self._error("'##' cannot appear at either end of a "
+                                "macro expansion")
+                expansion[-1].flags |= PASTE_LEFT
+                continue
+            expansion.append(t)
+        if expansion:
+            if expansion[-1].flags & PASTE_LEFT:
+                self._error("'##' cannot appear at either end of a macro "
+                            "expansion")
+            if params is not None and expansion[-1].is_op("#") and \
+               expansion[-1].arg_index is None:
+                self._error("'#' is not followed by a macro parameter")
+            expansion[0].flags &= ~PREV_WHITE
+        self.macros[name] = _Macro(name, params, variadic, expansion)
+
+    def _do_undef(self, args):
+        if not args or args[0].type != "name":
+            self._error("macro names must be identifiers")
+        self.macros.pop(args[0].value, None)
+
+    def _ifdef(self, args, name):
+        if not args or args[0].type != "name":
+            self._error("no macro name given in #%s directive" % name)
+        return (args[0].value in self.macros or
+                args[0].value in ("__FILE__", "__LINE__", "__COUNTER__"))
+
+    def _push_if(self, reader, hash_token, condition, cmacro = None):
+        was_skipping = self.skipping
+        taken = False
+        if not was_skipping:
+            taken = bool(condition())
+            self.skipping = not taken
+        state = _IfState(was_skipping, taken, hash_token.line)
+        if reader.mi_valid and reader.mi_cmacro is None:
+            state.mi_cmacro = cmacro
+        reader.mi_valid = False
+        reader.if_stack.append(state)
+
+    def _do_elif(self, reader, args):
+        if not reader.if_stack:
+            self._error("#elif without #if")
+        state = reader.if_stack[-1]
+        if state.seen_else:
+            self._error("#elif after #else")
+        state.mi_cmacro = None
+        if state.was_skipping:
+            return
+        if state.taken:
+            self.skipping = True
+        else:
+            self.skipping = False
+            state.taken = bool(self._eval(args))
+            self.skipping = not state.taken
+
+    def _do_else(self, reader):
+        if not reader.if_stack:
+            self._error("#else without #if")
+        state = reader.if_stack[-1]
+        if state.seen_else:
+            self._error("#else after #else")
+        state.seen_else = True
+        state.mi_cmacro = None
+        if not state.was_skipping:
+            self.skipping = state.taken
+            state.taken = True
+
+    def _do_endif(self, reader):
+        if not reader.if_stack:
+            self._error("#endif without #if")
+        state = reader.if_stack.pop()
+        self.skipping = state.was_skipping
+        if not reader.if_stack and state.mi_cmacro is not None:
+            # back outside of a potential include guard: any token or
+            # directive from now on invalidates it
+            reader.mi_valid = True
+            reader.mi_cmacro = state.mi_cmacro
+
+    def _check_if_stack(self, reader):
+        if reader.if_stack:
+            self._error("unterminated #if", reader.if_stack[-1].line)
+
+    def _do_line(self, reader, tokens):
+        if not tokens or tokens[0].type != "number" or \
+           not tokens[0].value.isdigit():
+            self._error("\"%s\" after #line is not a positive integer" %
+                        (tokens[0].value if tokens else ""))
+        new_line = int(tokens[0].value)
+        if len(tokens) > 1:
+            if tokens[1].type != "string" or not tokens[1].value.startswith('"'):
+                self._error("invalid filename \"%s\"" % tokens[1].value)
+            reader.name = tokens[1].value[1:-1].decode("string_escape")
+        # the line following the directive gets number 'new_line'
+        reader.line_offset = new_line - (reader.next_phys + 1)
+        self.printer.print_line(reader.name, new_line, "", reader.sysp)
+
+    def _do_pragma(self, reader, hash_token, args):
+        if args and args[0].value == "once":
+            self.once.add(reader.name)
+            return
+        p = self.printer
+        p.maybe_print_line(reader.name, hash_token.line, reader.sysp)
+        out = ["#pragma "]
+        for i, t in enumerate(args):
+            if i > 0 and t.flags & PREV_WHITE:
+                out.append(" ")
+            out.append(t.value)
+        p.out.append("".join(out) + "\n")
+        p.printed = False
+        p.src_line += 1
+
+    def _expand_directive(self, tokens):
+        """
+        Macro-expand the operands of a directive
+        """
+        eof = Token("eof", "")
+        self.contexts.append(_Context(None, list(tokens) + [eof]))
+        depth = len(self.contexts)
+        expanded = []
+        while True:
+            token = self.get_token()
+            if token is eof: break
+            if token.type != "padding":
+                expanded.append(token)
+        assert len(self.contexts) == depth
+        self.contexts.pop()
+        return expanded
+
+    def _find_include(self, reader, name, angled):
+        dirs = []
+        if not angled:
+            dirs.append(os.path.dirname(reader.name)
+                        if not reader.name.startswith("<") else "")
+            dirs += self.quote_dirs
+        dirs += self.include_dirs
+        for d in self.system_dirs:
+            dirs.append(d)
+        for d in dirs:
+            path = os.path.join(d, name) if d else name
+            if os.path.isfile(path):
+                return path, 1 if d in self.system_dirs else 0
+        return None, 0
+
+    def _do_include(self, reader, hash_token, args):
+        if args and args[0].type == "string" and args[0].value[0] == '"':
+            name = args[0].value[1:-1]
+            angled = False
+        elif args and args[0].is_op("<"):
+            name = self._angled_name(args)
+            angled = True
+        else:
+            expanded = self._expand_directive(args)
+            if expanded and expanded[0].type == "string" and \
+               expanded[0].value[0] == '"':
+                name = expanded[0].value[1:-1]
+                angled = False
+            elif expanded and expanded[0].is_op("<"):
+                name = self._angled_name(expanded)
+                angled = True
+            else:
+                self._error("#include expects \"FILENAME\" or <FILENAME>",
+                            hash_token.line, hash_token.col)
+        if not name:
+            self._error("empty filename in #include")
+        if len(self.readers) > 200:
+            self._error("#include nested depth 200 exceeds maximum of 200")
+
+        path, sysp = self._find_include(reader, name, angled)
+        if path is None:
+            self._error("%s: No such file or directory" % name,
+                        args[0].line, args[0].col)
+        if path in self.once:
+            return
+        guard = self.mi_guards.get(path)
+        if guard is not None and guard in self.macros:
+            return
+
+        with open(path, "rU") as f:
+            text = f.read()
+        sysp = sysp or reader.sysp
+        p = self.printer
+        p.maybe_print_line(reader.name, hash_token.line, reader.sysp)
+        p.print_line(path, 1, " 1", sysp)
+        self.readers.append(_FileReader(
+            path, text, sysp,
+            [(reader.name, hash_token.line + 1, " 2", reader.sysp)]))
+
+    @staticmethod
+    def _angled_name(tokens):
+        out = []
+        for t in tokens[1:]:
+            if t.is_op(">"):
+                return "".join(out)
+            if out and t.flags & PREV_WHITE:
+                out.append(" ")
+            out.append(t.value)
+        return "".join(out)
+
+    def _leave_file(self):
+        reader = self.readers.pop()
+        self._check_if_stack(reader)
+        if reader.mi_valid and reader.mi_cmacro is not None:
+            self.mi_guards[reader.name] = reader.mi_cmacro
+        for name, line, flags, sysp in reader.leave_markers:
+            self.printer.print_line(name, line, flags, sysp)
+
+    ##
+    ## #if expressions
+    ##
+
+    def _eval(self, args):
+        tokens = self._replace_defined(args)
+        tokens = self._replace_defined(self._expand_directive(tokens))
+        values = []
+        for t in tokens:
+            if t.type == "name":
+                # identifiers remaining after macro expansion are 0
+                values.append(0)
+            elif t.type == "number":
+                values.append(self._parse_number(t))
+            elif t.type == "char":
+                values.append(self._parse_char(t))
+            elif t.type == "punct":
+                values.append(t.value)
+            else:
+                self._error("token \"%s\" is not valid in preprocessor "
+                            "expressions" % t.value)
+        if not values:
+            self._error("#if with no expression")
+        parser = _ExprParser(values, self._error)
+        return parser.parse()
+
+    def _replace_defined(self, tokens):
+        result = []
+        i = 0
+        while i < len(tokens):
+            t = tokens[i]
+            if t.type == "name" and t.value == "defined":
+                paren = i + 1 < len(tokens) and tokens[i + 1].is_op("(")
+                j = i + 2 if paren else i + 1
+                if j >= len(tokens) or tokens[j].type != "name":
+                    self._error("operator \"defined\" requires an identifier")
+                value = tokens[j].value in self.macros or \
+                        tokens[j].value in ("__FILE__", "__LINE__",
+                                            "__COUNTER__")
+                if paren:
+                    j += 1
+                    if j >= len(tokens) or not tokens[j].is_op(")"):
+                        self._error("missing ')' after \"defined\"")
+                result.append(Token("number", "1" if value else "0"))
+                i = j + 1
+                continue
+            result.append(t)
+            i += 1
+        return result
+
+    def _parse_number(self, token):
+        v = token.value.lower().rstrip("ul")
+        try:
+            if v.startswith("0x"):
+                return int(v[2:], 16)
+            if v.startswith("0b"):
+                return int(v[2:], 2)
+            if v.startswith("0") and len(v) > 1:
+                return int(v[1:], 8)
+            return int(v)
+        except ValueError:
+            self._error("invalid integer constant \"%s\" in #if expression" %
+                        token.value)
+
+    def _parse_char(self, token):
+        v = token.value[token.value.index("'") + 1:-1]
+        try:
+            v = v.decode("string_escape")
+        except ValueError:
+            self._error("invalid character constant %s" % token.value)
+        if len(v) != 1:
+            self._error("invalid character constant %s" % token.value)
+        return ord(v)
+
+class _ExprParser(object):
+    """
+    Precedence climbing evaluator for #if expressions
+    """
+    binary_ops = {
+        "*": 10, "/": 10, "%": 10,
+        "+": 9, "-": 9,
+        "<<": 8, ">>": 8,
+        "<": 7, ">": 7, "<=": 7, ">=": 7,
+        "==": 6, "!=": 6,
+        "&": 5, "^": 4, "|": 3,
+        "&&": 2, "||": 1,
+    }
+
+    def __init__(self, values, error):
+        self.values = values
+        self.pos = 0
+        self.error = error
+
+    def peek(self):
+        if self.pos < len(self.values):
+            return self.values[self.pos]
+        return None
+
+    def next(self):
+        v = self.peek()
+        self.pos += 1
+        return v
+
+    def parse(self):
+        v = self.conditional()
+        while self.peek() == ",":
+            self.next()
+            v = self.conditional()
+        if self.pos < len(self.values):
+            self.error("missing binary operator before token \"%s\"" %
+                       self.peek())
+        return v
+
+    def conditional(self):
+        cond = self.binary(1)
+        if self.peek() != "?":
+            return cond
+        self.next()
+        a = self.parse_comma()
+        if self.next() != ":":
+            self.error("'?' without following ':'")
+        b = self.conditional()
+        return a if cond else b
+
+    def parse_comma(self):
+        v = self.conditional()
+        while self.peek() == ",":
+            self.next()
+            v = self.conditional()
+        return v
+
+    def binary(self, min_prec):
+        lhs = self.unary()
+        while True:
+            op = self.peek()
+            prec = self.binary_ops.get(op) if isinstance(op, str) else None
+            if prec is None or prec < min_prec:
+                return lhs
+            self.next()
+            rhs = self.binary(prec + 1)
+            lhs = self.apply(op, lhs, rhs)
+
+    def apply(self, op, a, b):
+        if op in ("/", "%") and b == 0:
+            self.error("division by zero in #if")
+        if op == "/":
+            q = abs(a) // abs(b)
+            return q if (a >= 0) == (b >= 0) else -q
+        if op == "%":
+            r = abs(a) % abs(b)
+            return r if a >= 0 else -r
+        return {
+            "*": lambda: a * b, "+": lambda: a + b, "-": lambda: a - b,
+            "<<": lambda: a << b, ">>": lambda: a >> b,
+            "<": lambda: int(a < b), ">": lambda: int(a > b),
+            "<=": lambda: int(a <= b), ">=": lambda: int(a >= b),
+            "==": lambda: int(a == b), "!=": lambda: int(a != b),
+            "&": lambda: a & b, "^": lambda: a ^ b, "|": lambda: a | b,
+            "&&": lambda: int(bool(a) and bool(b)),
+            "||": lambda: int(bool(a) or bool(b)),
+        }[op]()
+
+    def unary(self):
+        v = self.next()
+        if v is None:
+            self.error("#if with no expression")
+        if v == "(":
+            r = self.parse_comma()
+            if self.next() != ")":
+                self.error("missing ')' in expression")
+            return r
+        if v == "!": return int(not self.unary())
+        if v == "-": return -self.unary()
+        if v == "+": return self.unary()
+        if v == "~": return ~self.unary()
+        if isinstance(v, str):
+            self.error("token \"%s\" is not valid in preprocessor expressions"
+                       % v)
+        return v
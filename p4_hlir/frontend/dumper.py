@@ -219,7 +219,7 @@ def dump_to_p4_P4HeaderType(self, hlir):
                             self.name, layout = layout, attributes = attributes,
                             filename = self.filename, lineno = self.lineno,
                             length = length, max_length = max_length)
-    g_header._pragmas = self._pragmas.copy()
+    g_header._pragmas = set(self._pragmas)
                  
 
 def dump_to_p4_P4HeaderInstance(self, hlir):
@@ -242,7 +242,7 @@ def dump_to_p4_P4HeaderInstanceRegular(self, hlir):
             metadata = False, initializer = {},
             virtual = virtual
         )
-        g_header_instance._pragmas = self._pragmas.copy()
+        g_header_instance._pragmas = set(self._pragmas)
                           
 
 def dump_to_p4_P4HeaderInstanceMetadata(self, hlir):
@@ -258,7 +258,7 @@ def dump_to_p4_P4HeaderInstanceMetadata(self, hlir):
         metadata = True, initializer = initializer,
         virtual = False
     )
-    g_header_instance._pragmas = self._pragmas.copy()
+    g_header_instance._pragmas = set(self._pragmas)
 
 
 def dump_to_p4_P4FieldList(self, hlir):
@@ -270,7 +270,7 @@ def dump_to_p4_P4FieldList(self, hlir):
         self.name, fields = entries,
         filename = self.filename, lineno = self.lineno
     )
-    g_field_list._pragmas = self._pragmas.copy()
+    g_field_list._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4FieldListCalculation(self, hlir):
     input_list = []
@@ -288,7 +288,7 @@ def dump_to_p4_P4FieldListCalculation(self, hlir):
         filename = self.filename,
         lineno = self.lineno
     )
-    g_field_list_calculation._pragmas = self._pragmas.copy()
+    g_field_list_calculation._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4CalculatedField(self, hlir):
     update_verify_list = []
@@ -314,7 +314,7 @@ def dump_to_p4_P4ValueSet(self, hlir):
         self.name,
         filename = self.filename, lineno = self.lineno
     )
-    g_parse_value_set._pragmas = self._pragmas.copy()
+    g_parse_value_set._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4ParserFunction(self, hlir):
     call_sequence = []
@@ -328,7 +328,7 @@ def dump_to_p4_P4ParserFunction(self, hlir):
         filename = self.filename,
         lineno = self.lineno
     )
-    g_parse_state._pragmas = self._pragmas.copy()
+    g_parse_state._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4Counter(self, hlir):
     type_ = {
@@ -357,7 +357,7 @@ def dump_to_p4_P4Counter(self, hlir):
         min_width = min_width,
         saturating = saturating
     )
-    g_counter._pragmas = self._pragmas.copy()
+    g_counter._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4Meter(self, hlir):
     # TODO
@@ -380,7 +380,7 @@ def dump_to_p4_P4Meter(self, hlir):
         instance_count = instance_count,
         result = None if self.result is None else self.result.dump_to_p4(hlir)
     )
-    g_meter._pragmas = self._pragmas.copy()
+    g_meter._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4Register(self, hlir):
     if self.direct_or_static:
@@ -407,7 +407,7 @@ def dump_to_p4_P4Register(self, hlir):
         signed = signed,
         saturating = saturating
     )
-    g_register._pragmas = self._pragmas.copy()
+    g_register._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4PrimitiveAction(self, hlir):
     # primitive actions are not being dealt with here, but the info is read
@@ -425,7 +425,7 @@ def dump_to_p4_P4ActionFunction(self, hlir):
         signature = signature,
         call_sequence = call_sequence
     )
-    g_action._pragmas = self._pragmas.copy()
+    g_action._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4ActionCall(self, hlir):
     arg_list = [arg.dump_to_p4(hlir) for arg in self.arg_list]
@@ -470,7 +470,7 @@ def dump_to_p4_P4Table(self, hlir):
         action_profile = action_profile,
         **optional_attributes
     )
-    g_table._pragmas = self._pragmas.copy()
+    g_table._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4ActionProfile(self, hlir):
     optional_attributes = {}
@@ -487,7 +487,7 @@ def dump_to_p4_P4ActionProfile(self, hlir):
         actions = actions,
         **optional_attributes
     )
-    g_action_profile._pragmas = self._pragmas.copy()
+    g_action_profile._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4ActionSelector(self, hlir):
     optional_attributes = {}
@@ -504,7 +504,7 @@ def dump_to_p4_P4ActionSelector(self, hlir):
         selection_key = selection_key,
         **optional_attributes
     )
-    g_action_selector._pragmas = self._pragmas.copy()
+    g_action_selector._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4TableFieldMatch(self, hlir):
     match_types = {
@@ -543,7 +543,7 @@ def dump_to_p4_P4ControlFunction(self, hlir):
         lineno = self.lineno,
         call_sequence = call_sequence
     )
-    g_control_flow._pragmas = self._pragmas.copy()
+    g_control_flow._pragmas = set(self._pragmas)
 
 def dump_to_p4_P4ControlFunctionStatement(self, hlir):
     pass
@@ -701,7 +701,7 @@ def dump_to_p4_P4ParserException(self, hlir):
         set_statements = set_statements,
         return_or_drop = return_or_drop
     )
-    g_parser_exception._pragmas = self._pragmas.copy()
+    g_parser_exception._pragmas = set(self._pragmas)
         
 def dump_to_p4_P4ParserExceptionDrop(self, hlir):
     return P4_PARSER_DROP
@@ -0,0 +1,267 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import sys
+import hashlib
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+from cStringIO import StringIO
+
+from parser import p4_parser_pool
+from ast import P4TreeNode, NO_PRAGMAS
+
+# Same as P4Lexer.line_pattern: what follows a '#' in a line marker
+_line_pattern = re.compile(r'([ \t]*line\W)|([ \t]*\d+)')
+_line_marker = re.compile(r'#[ \t]*(?:line[ \t]+)?(\d+)[ \t]*'
+                          r'(?:("(?:[^"\\\n]|\\.)*")[ \t]*)?(?:\d+[ \t]*)*$')
+_decl_special = re.compile(r'[{};\n#@]')
+
+# File name given to what follows a span when it is parsed on its own
+_NEXT_FILE = "\x01next"
+
+class _Span:
+    def __init__(self, kind, text, filename, lineno, cacheable = True):
+        self.kind = kind # "decl" or "pragma"
+        self.text = text
+        self.filename = filename
+        self.lineno = lineno
+        # False if the span contains line markers, which make its line
+        # numbers absolute
+        self.cacheable = cacheable
+        # file of the first token after the span, see _parse_span()
+        self.next_filename = None
+
+class P4IncrementalParser(object):
+    """
+    Parses preprocessed P4 programs one top-level declaration at a time.
+
+    The text is split into the spans of the top-level declarations (and of
+    the @pragma lines between them). The AST of each declaration is cached,
+    keyed on the hash of its text, so when a program is parsed again after an
+    edit, only the declarations which changed are re-parsed; the nodes of the
+    other ones are taken from the cache, with their file names and line
+    numbers fixed up to their new location.
+
+    P4Parser takes the file name of a node from the lexer when the node is
+    reduced, which can be after the lexer read the first token of the next
+    declaration, possibly in another file. To reproduce this, each span is
+    parsed followed by a line marker to a placeholder file, and the nodes
+    which end up in that file get the file name of the token which follows
+    the span.
+
+    The result is the same as the one of P4Parser.parse(). Whenever the
+    program cannot be split with certainty, or one of the spans contains an
+    error, the whole program is parsed at once so that error messages are
+    exactly the ones of a full parse.
+    """
+    def __init__(self, max_entries = 65536):
+        self._lock = threading.Lock()
+        # span hash -> pickled list of P4Object instances
+        self._cache = OrderedDict()
+        self.max_entries = max_entries
+
+    def clear(self):
+        with self._lock:
+            self._cache = OrderedDict()
+
+    def parse(self, data, stats = None):
+        """
+        Returns (p4_objects, errors_cnt), like P4Parser.parse(). If 'stats'
+        is a dictionary, the number of re-used and re-parsed declarations is
+        added to it.
+        """
+        spans = self.split(data)
+        if spans is None:
+            return self._full_parse(data)
+
+        p4_objects = []
+        reused = parsed = 0
+        current_pragmas = set()
+        for span in spans:
+            if span.kind == "pragma":
+                current_pragmas.add(span.text)
+                continue
+            objects, from_cache = self._parse_span(span)
+            if objects is None or len(objects) != 1:
+                return self._full_parse(data)
+            if from_cache:
+                reused += 1
+            else:
+                parsed += 1
+            # see P4Parser.p_p4_declaration_or_pragma_1
+            objects[0]._pragmas = current_pragmas or NO_PRAGMAS
+            current_pragmas = set()
+            p4_objects += objects
+
+        if stats is not None:
+            stats["reused_declarations"] = \
+                stats.get("reused_declarations", 0) + reused
+            stats["parsed_declarations"] = \
+                stats.get("parsed_declarations", 0) + parsed
+        return p4_objects, 0
+
+    def _full_parse(self, data):
+        with p4_parser_pool.parser() as parser:
+            return parser.parse(data)
+
+    def _parse_span(self, span):
+        key = None
+        if span.cacheable:
+            key = hashlib.sha1(span.text).hexdigest()
+            with self._lock:
+                pickled = self._cache.pop(key, None)
+                if pickled is not None:
+                    self._cache[key] = pickled
+            if pickled is not None:
+                objects = pickle.loads(pickled)
+                self._relocate(objects, span, span.lineno - 1)
+                return objects, True
+            text = '%s\n# 1 "%s"\n' % (span.text, _NEXT_FILE)
+        else:
+            # the line markers give the lexer the right positions
+            text = '# %d "%s"\n%s\n# 1 "%s"\n' % (span.lineno, span.filename,
+                                                 span.text, span.next_filename)
+
+        # errors are reported by the full parse we fall back to
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            with p4_parser_pool.parser() as parser:
+                objects, errors_cnt = parser.parse(text)
+        finally:
+            sys.stdout = stdout
+        if errors_cnt > 0:
+            return None, False
+
+        if key is not None:
+            pickled = pickle.dumps(objects, pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                self._cache[key] = pickled
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last = False)
+            self._relocate(objects, span, span.lineno - 1)
+        return objects, False
+
+    @staticmethod
+    def _relocate(objects, span, line_offset):
+        # spans are cached as parsed from the beginning of an unnamed file
+        filenames = {'': intern(span.filename),
+                     _NEXT_FILE: intern(span.next_filename)}
+        visited = set()
+        stack = list(objects)
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, P4TreeNode):
+                if id(obj) in visited: continue
+                visited.add(id(obj))
+                obj.filename = filenames[obj.filename]
+                # 0 is used by nodes without a line number
+                if obj.lineno > 0:
+                    obj.lineno += line_offset
+                stack.extend(obj.__getstate__().values())
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                stack.extend(obj)
+            elif isinstance(obj, dict):
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+
+    @staticmethod
+    def split(data):
+        """
+        Splits preprocessed text into top-level declaration and @pragma spans,
+        tracking the position given by the line markers. Returns None if the
+        text does not look like a well-formed sequence of declarations.
+        """
+        spans = []
+        lineno = 1
+        filename = ''
+        pos = 0
+        n = len(data)
+        while pos < n:
+            c = data[pos]
+            if c in ' \t':
+                pos += 1
+            elif c == '\n':
+                lineno += 1
+                pos += 1
+            elif c == '#' and _line_pattern.match(data, pos + 1):
+                end = data.find('\n', pos)
+                if end < 0: return None
+                marker = _line_marker.match(data, pos, end)
+                if not marker: return None
+                lineno = int(marker.group(1))
+                if marker.group(2) is not None:
+                    filename = marker.group(2).lstrip('"').rstrip('"')
+                pos = end + 1
+            elif data.startswith('@pragma', pos):
+                end = data.find('\n', pos)
+                if end < 0: end = n
+                value = data[pos + len('@pragma'):end].lstrip(' \t')
+                if not value: return None
+                spans.append(_Span("pragma", value, filename, lineno))
+                pos = end
+            else:
+                start, start_lineno, start_filename = pos, lineno, filename
+                cacheable = True
+                depth = 0
+                while True:
+                    m = _decl_special.search(data, pos)
+                    if m is None: return None
+                    c = m.group()
+                    pos = m.end()
+                    if c == '\n':
+                        lineno += 1
+                    elif c == '{':
+                        depth += 1
+                    elif c == '}':
+                        depth -= 1
+                        if depth < 0: return None
+                        if depth == 0:
+                            # e.g. metadata instances end with '} ;'
+                            j = pos
+                            while j < n and data[j] in ' \t\n': j += 1
+                            if j < n and data[j] == ';':
+                                lineno += data.count('\n', pos, j)
+                                pos = j + 1
+                            break
+                    elif c == ';':
+                        if depth == 0: break
+                    elif c == '#':
+                        if _line_pattern.match(data, pos):
+                            end = data.find('\n', pos)
+                            if end < 0: return None
+                            marker = _line_marker.match(data, pos - 1, end)
+                            if not marker: return None
+                            lineno = int(marker.group(1))
+                            if marker.group(2) is not None:
+                                filename = marker.group(2).lstrip('"').rstrip('"')
+                            cacheable = False
+                            pos = end + 1
+                    elif c == '@':
+                        if data.startswith('pragma', pos):
+                            # the rest of the line is the pragma string
+                            end = data.find('\n', pos)
+                            pos = n if end < 0 else end
+                spans.append(_Span("decl", data[start:pos], start_filename,
+                                   start_lineno, cacheable))
+        for span, next_span in zip(spans, spans[1:]):
+            span.next_filename = next_span.filename
+        if spans:
+            spans[-1].next_filename = filename
+        return spans
+
+# process-wide incremental parser, its cache is shared by all builds
+p4_incremental_parser = P4IncrementalParser()
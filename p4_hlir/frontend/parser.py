@@ -15,22 +15,236 @@
 from ply import yacc
 from tokenizer import P4Lexer
 from ast import *
+from p4_hlir.util.cache import get_cache_dir, get_tmp_path, commit_tmp_path, \
+    evict_lru, touch
+from contextlib import contextmanager
+import cPickle as pickle
+import hashlib
+import os
+import threading
+
+# Bump this whenever the way parse tables are cached on disk changes
+PARSETAB_CACHE_VERSION = 1
+
+# Bump this whenever the format of the parse cache entries changes
+PARSE_CACHE_VERSION = 1
+
+_grammar_signature = None
+
+def get_grammar_signature():
+    """
+    Returns a hash of everything the LALR tables depend on: the grammar
+    productions (i.e. the docstrings of the p_* methods), the precedence
+    rules, the tokens, the start symbol and the PLY version. It is used to key
+    the on-disk parse table cache, so any change to the grammar automatically
+    invalidates the cached tables.
+    """
+    global _grammar_signature
+    if _grammar_signature is not None:
+        return _grammar_signature
+    sig = hashlib.sha1()
+    sig.update("%d %s %s\n" % (PARSETAB_CACHE_VERSION,
+                               yacc.__version__, yacc.__tabversion__))
+    sig.update(repr(P4Parser.start))
+    sig.update(repr(P4Parser.precedence))
+    sig.update(repr(P4Lexer.tokens))
+    for name in sorted(dir(P4Parser)):
+        if not name.startswith("p_"): continue
+        sig.update("%s:%s\n" % (name, getattr(P4Parser, name).__doc__))
+    _grammar_signature = sig.hexdigest()
+    return _grammar_signature
+
+def _get_ast_signature():
+    # the layout of every AST node class, pickled ASTs cannot be loaded if it
+    # changes
+    layout = []
+    classes = [P4TreeNode]
+    while classes:
+        cls = classes.pop()
+        layout.append((cls.__module__, cls.__name__, cls.get_slots()))
+        classes += cls.__subclasses__()
+    return repr(sorted(layout))
+
+class P4ParseCache(object):
+    """
+    On-disk cache for the output of P4Parser.parse().
+
+    Entries are keyed on the preprocessed text, the grammar signature and the
+    layout of the AST classes, and contain the pickled list of P4 objects. Only
+    successful parses are cached, so that a failed parse always prints its
+    error messages. The total size of the cache is bounded, least recently
+    used entries are evicted first. Entries are written to a temporary file
+    and renamed, so the cache can be shared by concurrent processes.
+    """
+    _signature = None
+
+    def __init__(self, use_cache = True, cache_dir = None,
+                 max_size = 256 * 1024 * 1024):
+        if use_cache and cache_dir is None:
+            cache_dir = get_cache_dir("parse")
+        self.cache_dir = cache_dir if use_cache else None
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def enabled(self):
+        return self.cache_dir is not None
+
+    def get_key(self, data):
+        if P4ParseCache._signature is None:
+            P4ParseCache._signature = hashlib.sha1(
+                "%d %s %s" % (PARSE_CACHE_VERSION, get_grammar_signature(),
+                              _get_ast_signature())
+            ).hexdigest()
+        key = hashlib.sha1(P4ParseCache._signature)
+        key.update(data)
+        return key.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".ast")
+
+    def lookup(self, key):
+        """
+        Returns the list of P4 objects stored for 'key', or None
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                version, p4_objects = pickle.load(f)
+        except Exception:
+            p4_objects = None
+            version = None
+        if version != PARSE_CACHE_VERSION:
+            self.misses += 1
+            return None
+        touch(path)
+        self.hits += 1
+        return p4_objects
+
+    def store(self, key, p4_objects):
+        path = self._entry_path(key)
+        tmp_path = get_tmp_path(path)
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((PARSE_CACHE_VERSION, p4_objects), f,
+                            pickle.HIGHEST_PROTOCOL)
+        except (IOError, pickle.PicklingError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        commit_tmp_path(tmp_path, path)
+        evict_lru(self.cache_dir, self.max_size, ".ast")
+
+    def parse(self, data, parse_function):
+        """
+        Returns (p4_objects, errors_cnt) for 'data', from the cache if
+        possible, by calling parse_function(data) otherwise.
+        """
+        if not self.enabled():
+            return parse_function(data)
+        key = self.get_key(data)
+        p4_objects = self.lookup(key)
+        if p4_objects is not None:
+            return p4_objects, 0
+        p4_objects, errors_cnt = parse_function(data)
+        if errors_cnt == 0:
+            self.store(key, p4_objects)
+        return p4_objects, errors_cnt
+
+class P4ParserPool(object):
+    """
+    Pool of reusable P4Parser instances. Building a parser (and its lexer) is
+    costly, so instead of creating a new one for every input, callers check
+    out an instance from the pool and return it when they are done. Each
+    checked out instance is owned exclusively by the caller, which makes the
+    pool safe to use from several threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free = []
+
+    def acquire(self):
+        with self._lock:
+            parser = self._free.pop() if self._free else None
+        if parser is None:
+            parser = P4Parser()
+        else:
+            parser.reset()
+        return parser
+
+    def release(self, parser):
+        with self._lock:
+            self._free.append(parser)
+
+    @contextmanager
+    def parser(self):
+        parser = self.acquire()
+        try:
+            yield parser
+        finally:
+            self.release(parser)
+
+    def clear(self):
+        with self._lock:
+            self._free = []
+
+# process-wide parser pool
+p4_parser_pool = P4ParserPool()
 
 class P4Parser:
+    start = 'p4_objects'
+
     def __init__(self):
         self.lexer = P4Lexer()
         self.lexer.build()
         self.tokens = self.lexer.tokens
 
-        self.parser = yacc.yacc(module = self,
-                                write_tables=0,
-                                debug=False,
-                                start = 'p4_objects')
+        self.parser = self._build_yacc()
 
         self.errors_cnt = 0
         self.current_pragmas = set()
         
         
+    def _build_yacc(self):
+        # Generating the LALR tables for the whole grammar is expensive, so we
+        # keep them in a pickle file in the user cache directory, keyed on the
+        # grammar signature. We fall back to building the tables in memory if
+        # the cache directory cannot be used.
+        yacc_args = dict(module = self, write_tables = 0, debug = False,
+                         start = self.start)
+        cache_dir = get_cache_dir("parsetab")
+        if cache_dir is None:
+            return yacc.yacc(**yacc_args)
+
+        path = os.path.join(cache_dir,
+                            "p4_parsetab_%s.pickle" % get_grammar_signature())
+        if os.path.isfile(path):
+            try:
+                return yacc.yacc(picklefile = path,
+                                 errorlog = yacc.NullLogger(),
+                                 **yacc_args)
+            except Exception:
+                # corrupted cache file, it is overwritten below
+                pass
+
+        # PLY writes the tables to the pickle file after generating them, we
+        # make it write to a temporary file which is then renamed, so that
+        # concurrent compiler runs never read a partially written file
+        tmp_path = get_tmp_path(path)
+        parser = yacc.yacc(picklefile = tmp_path, **yacc_args)
+        commit_tmp_path(tmp_path, path)
+        return parser
+
+    def reset(self):
+        """ Resets the parser (and its lexer) so that it can be reused to parse
+        a new input.
+        """
+        self.errors_cnt = 0
+        self.current_pragmas = set()
+        self.lexer.reset()
+
     def parse(self, data, filename = ''):
         # self.lexer.filename = filename
         self.lexer.reset_lineno()
@@ -115,7 +329,7 @@ class P4Parser:
         """
         p[0] = p[1]
         if p[0]:
-            p[0]._pragmas = self.current_pragmas
+            p[0]._pragmas = self.current_pragmas or NO_PRAGMAS
         self.current_pragmas = set()
 
     def p_p4_declaration_or_pragma_2(self, p):
@@ -16,15 +16,171 @@ import re
 from subprocess import Popen, PIPE, CalledProcessError
 import shutil
 import os
+import hashlib
+import cPickle as pickle
+from distutils.spawn import find_executable
+
+from p4_hlir.util.cache import get_cache_dir, get_tmp_path, commit_tmp_path, \
+    evict_lru, touch
 
 class PreprocessorException(Exception):
     def __init__(self, message):
         super(PreprocessorException, self).__init__(message)
 
+# Bump this whenever the format of the preprocessor cache entries changes
+PREPROCESS_CACHE_VERSION = 1
+
+class PreprocessorCache(object):
+    """
+    Content-addressed, on-disk cache for the output of the preprocessor.
+
+    Entries are keyed on the preprocessor backend and its version, the
+    preprocessor command line, the environment variables which change the
+    include path, the working directory, the name of the source and its
+    contents. Each entry also records the
+    content hash of every file the preprocessor reported (through the '# line'
+    markers) as having been included; a lookup only hits if none of these
+    files has changed. The total size of the cache is bounded, least recently
+    used entries are evicted first.
+    """
+    line_marker = re.compile(r'^#\s+\d+\s+"((?:[^"\\]|\\.)*)"', re.MULTILINE)
+
+    def __init__(self, cache_dir = None, max_size = 64 * 1024 * 1024):
+        if cache_dir is None:
+            cache_dir = get_cache_dir("preprocess")
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def enabled(self):
+        return self.cache_dir is not None
+
+    @staticmethod
+    def _hash_file(path):
+        try:
+            with open(path, "rb") as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        except IOError:
+            return None
+
+    def get_key(self, backend, version, argv, filename, input_text):
+        key = hashlib.sha1()
+        environment = [(name, os.environ.get(name))
+                       for name in INCLUDE_PATH_VARIABLES]
+        key.update(repr((PREPROCESS_CACHE_VERSION, backend, version, argv,
+                         environment, os.getcwd(), filename)))
+        if len(filename) > 0:
+            with open(filename, "rb") as f:
+                key.update(f.read())
+        key.update(input_text)
+        return key.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".pickle")
+
+    def lookup(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                version, deps, text = pickle.load(f)
+        except Exception:
+            return None
+        if version != PREPROCESS_CACHE_VERSION:
+            return None
+        for dep_path, dep_hash in deps:
+            if self._hash_file(dep_path) != dep_hash:
+                return None
+        touch(path)
+        return text
+
+    @classmethod
+    def get_included_files(cls, text):
+        """
+        The files which the preprocessor reported as having been included
+        """
+        paths = set()
+        for dep_path in set(cls.line_marker.findall(text)):
+            # ignore '<stdin>', '<built-in>', '<command-line>'...
+            if dep_path.startswith("<"): continue
+            paths.add(dep_path.decode("string_escape"))
+        return paths
+
+    def store(self, key, text):
+        deps = []
+        for dep_path in self.get_included_files(text):
+            dep_hash = self._hash_file(dep_path)
+            if dep_hash is None:
+                # cannot validate this entry later, do not cache it
+                return
+            deps.append((dep_path, dep_hash))
+
+        path = self._entry_path(key)
+        tmp_path = get_tmp_path(path)
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((PREPROCESS_CACHE_VERSION, deps, text), f,
+                            pickle.HIGHEST_PROTOCOL)
+        except IOError:
+            return
+        commit_tmp_path(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        evict_lru(self.cache_dir, self.max_size, ".pickle")
+
+# Preprocessor backends: "gcc" runs 'gcc -E' in a subprocess, "python" uses
+# the built-in pure Python implementation (see cpp.py), which produces the same
+# output but only understands the -D, -U and -I options
+PREPROCESSOR_BACKENDS = ["gcc", "python"]
+
+# Environment variables which gcc adds to the include path
+INCLUDE_PATH_VARIABLES = ["CPATH", "C_INCLUDE_PATH", "CPLUS_INCLUDE_PATH"]
+
+_backend_versions = {}
+
+def get_backend_version(backend, executable_path):
+    """
+    Identifies the version of a preprocessor backend: the output of
+    'gcc --version', or the hash of the built-in preprocessor. Computed once
+    per process.
+    """
+    key = (backend, executable_path)
+    if key not in _backend_versions:
+        if backend == "python":
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "cpp.py")
+            version = PreprocessorCache._hash_file(path)
+        else:
+            try:
+                pipe = Popen([executable_path, "--version"],
+                             stdout = PIPE, stderr = PIPE)
+                version, _ = pipe.communicate()
+            except OSError:
+                # let the preprocessor report the error
+                version = None
+        _backend_versions[key] = version
+    return _backend_versions[key]
+
+def default_backend():
+    """
+    gcc if it can be found in the PATH, the built-in preprocessor otherwise
+    """
+    return "gcc" if find_executable("gcc") else "python"
+
 class Preprocessor(object):
-    def __init__(self):
+    def __init__(self, use_cache = True, backend = None):
+        if backend is None:
+            backend = default_backend()
+        if backend not in PREPROCESSOR_BACKENDS:
+            raise PreprocessorException("Unknown preprocessor backend '%s'" %
+                                        backend)
+        self.backend = backend
         self.executable_path = "gcc"
         self.args = ["-E", "-x", "c", "-w"]
+        self.cache = PreprocessorCache() if use_cache else None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # absolute paths of all the files read to preprocess the sources
+        self.dependencies = set()
 
     def preprocess_file(self, filename, dest=None):
         return self._preprocess(filename, "", dest)
@@ -33,7 +189,49 @@ class Preprocessor(object):
         return self._preprocess("", input_text, dest)
 
     def _preprocess(self, filename, input_text, dest):
-        path_list = [self.executable_path] + self.args
+        if self.backend == "python":
+            path_list = ["<python>"] + self.args
+        else:
+            path_list = [self.executable_path] + self.args
+
+        key = None
+        if self.cache and self.cache.enabled():
+            try:
+                version = get_backend_version(self.backend,
+                                              self.executable_path)
+                key = self.cache.get_key(self.backend, version, path_list,
+                                         filename, input_text)
+            except IOError:
+                # let the preprocessor report the error
+                pass
+
+        text = None
+        if key is not None:
+            text = self.cache.lookup(key)
+            if text is None:
+                self.cache_misses += 1
+            else:
+                self.cache_hits += 1
+
+        if text is None:
+            if self.backend == "python":
+                text = self._run_python(filename, input_text)
+            else:
+                text = self._run(path_list, filename, input_text)
+            if key is not None:
+                self.cache.store(key, text)
+
+        for dep_path in PreprocessorCache.get_included_files(text):
+            self.dependencies.add(os.path.abspath(dep_path))
+
+        if dest != None:
+            with open(dest, "w") as destFile:
+                destFile.write(text)
+
+        return text
+
+    def _run(self, path_list, filename, input_text):
+        path_list = list(path_list)
 
         if len(filename) > 0:
             path_list.append(filename)
@@ -51,10 +249,22 @@ class Preprocessor(object):
             src_name = filename if len(filename) > 0 else "stdin"
             raise PreprocessorException("Preprocessor error on "+src_name+": \n"+err)
 
-        if dest != None:
-            with open(dest, "w") as destFile:
-                destFile.write(text)
-
         return text
 
+    def _run_python(self, filename, input_text):
+        # imported here, the built-in preprocessor is rarely used
+        from cpp import CPreprocessor, CppError
 
+        # the options implied by 'gcc -E -x c -w' are not relevant here
+        args = self.args[:]
+        for arg in ["-E", "-x", "c", "-w"]:
+            args.remove(arg)
+
+        try:
+            cpp = CPreprocessor(args)
+            if len(filename) > 0:
+                return cpp.preprocess_file(filename)
+            return cpp.preprocess_str(input_text)
+        except (CppError, IOError) as e:
+            src_name = filename if len(filename) > 0 else "stdin"
+            raise PreprocessorException("Preprocessor error on "+src_name+": \n"+str(e))
@@ -0,0 +1,70 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Process-wide registry of the standard primitive actions, described in
+primitives.json.
+"""
+
+import json
+import threading
+
+from p4_hlir.util.startup import read_resource
+
+_std_primitives = None
+# (name, description) pairs of the standard primitives, in file order
+_std_primitive_items = None
+_std_primitives_lock = threading.Lock()
+
+def _load_std_primitives():
+    global _std_primitives, _std_primitive_items
+    with _std_primitives_lock:
+        if _std_primitives is None:
+            items = []
+            def make_dict(pairs):
+                # the top-level object is decoded last
+                items[:] = pairs
+                return dict(pairs)
+            _std_primitives = json.loads(
+                read_resource("p4_hlir.frontend", "primitives.json"),
+                object_pairs_hook = make_dict
+            )
+            _std_primitive_items = tuple(items)
+
+def get_std_primitives():
+    """
+    Returns the standard primitives, parsed from primitives.json on the first
+    call only. The returned dictionary is shared and must not be modified, use
+    a PrimitivesView to add primitives.
+    """
+    _load_std_primitives()
+    return _std_primitives
+
+class PrimitivesView(dict):
+    """
+    Dictionary of primitives, initialized with the standard ones by default.
+    Only the dictionary is copied: the primitive descriptions are shared with
+    the process-wide registry and must not be modified in place.
+    """
+    def __init__(self, primitives = None):
+        if primitives is None:
+            # inserted one by one in file order, like json.loads() does, so
+            # that the iteration order is the one of the parsed dictionary
+            _load_std_primitives()
+            primitives = _std_primitive_items
+        super(PrimitivesView, self).__init__(primitives)
+
+    def copy(self):
+        return PrimitivesView(self)
@@ -13,61 +13,270 @@
 # limitations under the License.
 
 from ast import *
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from cStringIO import StringIO
 import json
 import os
+import time
 import unused_removal
+from p4_hlir.util.build_context import current_context
 
 class ObjectTable:
+    """
+    Named objects of the program, indexed on their name and on each class they
+    are an instance of, so that get_object() takes two dictionary lookups. If
+    several objects match, the first one added is returned.
+    """
     def __init__(self):
-        self.objs = defaultdict(list)
-        
+        # name -> {class -> object}
+        self.objs = {}
+
     def add_object(self, name, ast_node):
-        self.objs[name].append(ast_node)
+        by_class = self.objs.get(name)
+        if by_class is None:
+            by_class = {}
+            self.objs[name] = by_class
+        for cls in type(ast_node).__mro__:
+            if cls is object: break
+            by_class.setdefault(cls, ast_node)
 
     def get_object(self, name, ast_type):
-        if name not in self.objs: return None
-        objects = self.objs[name]
-        for obj in objects:
-            if isinstance(obj, ast_type): return obj
-        return None
+        by_class = self.objs.get(name)
+        if by_class is None: return None
+        return by_class.get(ast_type)
 
 class SymbolTable:
+    """
+    Maps names to the set of types of the objects they refer to, with nested
+    scopes (dictionaries from name to type set). The innermost definition of
+    every name is indexed, so lookups do not search the scopes. Each scope
+    records the definitions it shadows, which are restored when it is left:
+    entering and leaving a scope only touches the names it defines, scopes
+    are never copied.
+
+    get_types() returns the type set of the innermost definition itself, as
+    before.
+    """
     def __init__(self):
         self.scopes = []
+        # for each scope, name -> definition it shadows
+        self.shadowed = []
+        # name -> type set of its innermost definition
+        self.bindings = {}
 
     def enterscope(self):
-        self.scopes.append(defaultdict(set))
+        self.scopes.append({})
+        self.shadowed.append({})
 
     def exitscope(self):
-        self.scopes.pop()
+        self.popscope()
 
     def popscope(self):
-        return self.scopes.pop()
+        scope = self.scopes.pop()
+        shadowed = self.shadowed.pop()
+        for name in scope:
+            if name in shadowed:
+                self.bindings[name] = shadowed[name]
+            else:
+                del self.bindings[name]
+        return scope
 
     def pushscope(self, scope):
+        shadowed = {}
+        for name, types in scope.items():
+            if name in self.bindings:
+                shadowed[name] = self.bindings[name]
+            self.bindings[name] = types
         self.scopes.append(scope)
+        self.shadowed.append(shadowed)
 
     def add_type(self, name, type_):
         assert(len(self.scopes) > 0)
         scope = self.scopes[-1]
-        scope[name].add(type_)
+        types = scope.get(name)
+        if types is None:
+            types = set()
+            scope[name] = types
+            if name in self.bindings:
+                self.shadowed[-1][name] = self.bindings[name]
+            self.bindings[name] = types
+        types.add(type_)
 
     def has_type(self, name, type_):
+        types = self.bindings.get(name)
+        if types is None: return False
+        if type_ in types: return True
+        # the name may also be defined with this type in an outer scope
         for scope in reversed(self.scopes):
             if name in scope:
                 if type_ in scope[name]: return True
         return False
 
     def get_types(self, name):
-        for scope in reversed(self.scopes):
-            if name in scope:
-                return scope[name]
-        return None
+        return self.bindings.get(name)
+
+class SemanticCheckContext:
+    """
+    State shared by the semantic passes run on a P4 program
+    """
+    def __init__(self, program, symbols, header_fields, objects):
+        self.program = program
+        self.symbols = symbols
+        self.header_fields = header_fields
+        self.objects = objects
+        # table name -> names of the actions it can execute
+        self.table_actions = {}
+
+class SemanticPass:
+    """
+    One analysis of the semantic checker.
+
+    A pass either traverses the top-level objects of the program, in which
+    case 'visit' is called for each of them (between the optional 'begin' and
+    'end' callbacks), or does its own work in 'run'. Every callback receives
+    the SemanticCheckContext. If 'node_types' is given, 'visit' is only called
+    for the objects of these exact classes.
+
+    'requires' lists the passes whose results this pass uses, they must have
+    completed before it starts. A 'gated' pass only runs if no error has been
+    reported by the passes before it. Traversal passes are 'fusable' if they do
+    not modify the AST and can run even when the passes before them in the
+    same traversal report errors: several such passes share a single
+    traversal of the program (see schedule_semantic_passes()).
+    """
+    def __init__(self, name, requires = (), begin = None, visit = None,
+                 node_types = None, end = None, run = None, gated = True,
+                 fusable = True):
+        self.name = name
+        self.requires = tuple(requires)
+        self.begin = begin
+        self.visit = visit
+        self.node_types = node_types
+        self.end = end
+        self.run = run
+        self.gated = gated
+        self.fusable = fusable and run is None
+
+def schedule_semantic_passes(passes):
+    """
+    Splits a list of passes into the groups which are run in a single
+    traversal of the program. Passes keep their relative order, which must be
+    compatible with their dependencies. A pass joins the current group if it
+    and the group are fusable and it does not depend on a pass of the group.
+    """
+    groups = []
+    done = set()
+    for pass_ in passes:
+        for required in pass_.requires:
+            if required not in done:
+                raise ValueError("semantic pass '%s' requires '%s', which"
+                                 " is not scheduled before it"
+                                 % (pass_.name, required))
+        group = groups[-1] if groups else None
+        if group and pass_.fusable and group[0].fusable and \
+           not (set(pass_.requires) & set(p.name for p in group)):
+            group.append(pass_)
+        else:
+            groups.append([pass_])
+        done.add(pass_.name)
+    return groups
+
+class _PassRun:
+    # Output, diagnostic counts and time spent for one pass of a group. When
+    # passes share a traversal, their output is buffered so that it can be
+    # emitted in pass order.
+    def __init__(self, pass_, buffered):
+        self.pass_ = pass_
+        self.output = StringIO() if buffered else None
+        self.errors_cnt = 0
+        self.warnings_cnt = 0
+        self.time = 0.0
+
+    def call(self, function, *args):
+        if function is None: return
+        context = current_context()
+        errors_cnt = context.errors_cnt
+        warnings_cnt = context.warnings_cnt
+        if self.output is not None:
+            output = context.output
+            context.output = self.output
+        start = time.time()
+        try:
+            function(*args)
+        finally:
+            self.time += time.time() - start
+            if self.output is not None:
+                context.output = output
+            self.errors_cnt += context.errors_cnt - errors_cnt
+            self.warnings_cnt += context.warnings_cnt - warnings_cnt
+
+def _visit_objects(pass_, ctx):
+    visit = pass_.visit
+    node_types = pass_.node_types
+    for obj in ctx.program.objects:
+        if node_types is None or type(obj) in node_types:
+            visit(ctx, obj)
+
+def run_semantic_passes(passes, ctx, pass_times = None):
+    """
+    Runs the passes in as few traversals of ctx.program as possible. The
+    diagnostics are the same, and printed in the same order, as if each pass
+    was run on its own. If 'pass_times' is a dictionary, the time spent in
+    each pass is recorded in it.
+    """
+    context = current_context()
+    for group in schedule_semantic_passes(passes):
+        errors_cnt = context.errors_cnt
+        warnings_cnt = context.warnings_cnt
+        runs = [_PassRun(p, len(group) > 1) for p in group
+                if not (p.gated and errors_cnt > 0)]
+        if not runs: continue
+
+        if runs[0].pass_.run:
+            runs[0].call(runs[0].pass_.run, ctx)
+        else:
+            for run in runs:
+                run.call(run.pass_.begin, ctx)
+            visiting = [run for run in runs if run.pass_.visit]
+            if len(visiting) == 1:
+                visiting[0].call(_visit_objects, visiting[0].pass_, ctx)
+            elif visiting:
+                # the passes interested in each class of object
+                dispatch = {}
+                for obj in ctx.program.objects:
+                    obj_type = type(obj)
+                    obj_runs = dispatch.get(obj_type)
+                    if obj_runs is None:
+                        obj_runs = [run for run in visiting
+                                    if run.pass_.node_types is None or
+                                    obj_type in run.pass_.node_types]
+                        dispatch[obj_type] = obj_runs
+                    for run in obj_runs:
+                        run.call(run.pass_.visit, ctx, obj)
+            for run in runs:
+                run.call(run.pass_.end, ctx)
+
+        if len(group) > 1:
+            # emit the diagnostics in pass order, dropping the ones of gated
+            # passes which would not have run
+            context.errors_cnt = errors_cnt
+            context.warnings_cnt = warnings_cnt
+            for run in runs:
+                if run.pass_.gated and context.errors_cnt > 0: continue
+                context.get_output().write(run.output.getvalue())
+                context.errors_cnt += run.errors_cnt
+                context.warnings_cnt += run.warnings_cnt
+
+        if pass_times is not None:
+            for run in runs:
+                pass_times[run.pass_.name] = \
+                    pass_times.get(run.pass_.name, 0.0) + run.time
 
 class P4SemanticChecker:
     def __init__(self):
         self._bind()
+        # pass name -> time spent in it (in seconds) by the last check
+        self.pass_times = OrderedDict()
 
     def _bind(self):
         P4Program.check = check_P4Program
@@ -206,7 +415,9 @@ class P4SemanticChecker:
         self._add_std_metadata(p4_program)
 
         P4TreeNode.reset_errors_cnt()
-        p4_program.check(symbols, header_fields, objects)
+        self.pass_times = OrderedDict()
+        p4_program.check(symbols, header_fields, objects,
+                         pass_times = self.pass_times)
         return P4TreeNode.get_errors_cnt()
 
     def _add_std_metadata(self, p4_program):
@@ -648,32 +859,72 @@ def check_stateful_refs_P4RefExpression(self, symbols, objects, table = None):
         P4TreeNode.print_error(error_msg)
         return
 
-def check_P4Program(self, symbols, header_fields, objects, types = None):
-    import_header_fields(self.objects, header_fields)
-    check_header_types(self.objects, header_fields)
+def _begin_check(ctx):
+    import_header_fields(ctx.program.objects, ctx.header_fields)
+    check_header_types(ctx.program.objects, ctx.header_fields)
+    import_objects(ctx.program.objects, ctx.symbols, ctx.objects)
+
+def _visit_check(ctx, obj):
+    obj.check(ctx.symbols, ctx.header_fields, ctx.objects)
+
+def _visit_action_typing(ctx, obj):
+    obj.check_action_typing(ctx.symbols, ctx.objects)
+
+def _visit_table_actions(ctx, obj):
+    obj.import_table_actions(ctx.objects, ctx.table_actions)
+
+def _run_unused_args(ctx):
+    while True:
+        removed = defaultdict(set)
+        ctx.program.find_unused_args(removed)
+        if not removed: break
+        ctx.program.remove_unused_args(removed)
+
+def _visit_stateful_refs(ctx, obj):
+    obj.check_stateful_refs(ctx.symbols, ctx.objects)
+
+def _visit_apply_action_cases(ctx, obj):
+    obj.check_apply_action_cases(ctx.table_actions)
+
+def _end_start_state(ctx):
+    check_has_start_parse_state(ctx.symbols)
+
+def _run_remove_unused(ctx):
+    ctx.program.remove_unused(ctx.objects)
+
+# The passes run by P4Program.check(), in order. Removing unused action
+# parameters changes the arguments of action calls, which are then checked
+# for references to stateful objects.
+SEMANTIC_PASSES = [
+    SemanticPass("check", begin = _begin_check, visit = _visit_check,
+                 gated = False, fusable = False),
+    SemanticPass("action_typing", requires = ["check"],
+                 visit = _visit_action_typing, node_types = {P4Table}),
+    SemanticPass("table_actions", requires = ["check"],
+                 visit = _visit_table_actions, node_types = {P4Table}),
+    SemanticPass("unused_args", requires = ["action_typing"],
+                 run = _run_unused_args),
+    SemanticPass("stateful_refs", requires = ["unused_args"],
+                 visit = _visit_stateful_refs, node_types = {P4Table}),
+    SemanticPass("apply_action_cases", requires = ["table_actions"],
+                 visit = _visit_apply_action_cases,
+                 node_types = {P4ControlFunction}),
+    SemanticPass("start_state", requires = ["check"],
+                 end = _end_start_state, gated = False),
+    SemanticPass("remove_unused",
+                 requires = ["unused_args", "stateful_refs",
+                             "apply_action_cases"],
+                 run = _run_remove_unused),
+]
+
+def check_P4Program(self, symbols, header_fields, objects, types = None,
+                    pass_times = None):
+    ctx = SemanticCheckContext(self, symbols, header_fields, objects)
     symbols.enterscope()
-    import_objects(self.objects, symbols, objects)
-    for obj in self.objects:
-        obj.check(symbols, header_fields, objects)
-    if self.get_errors_cnt() == 0:
-        self.check_action_typing(symbols, objects)
-    if self.get_errors_cnt() == 0:
-        while True:
-            removed = defaultdict(set)
-            self.find_unused_args(removed)
-            if not removed: break
-            self.remove_unused_args(removed)
-    if self.get_errors_cnt() == 0:
-        self.check_stateful_refs(symbols, objects)
-    if self.get_errors_cnt() == 0:
-        table_actions = {}
-        self.import_table_actions(objects, table_actions)
-        self.check_apply_action_cases(table_actions)
-    check_has_start_parse_state(symbols)
-    symbols.exitscope()
-
-    if self.get_errors_cnt() == 0:
-        self.remove_unused(objects)
+    try:
+        run_semantic_passes(SEMANTIC_PASSES, ctx, pass_times)
+    finally:
+        symbols.exitscope()
 
 def check_P4HeaderType(self, symbols, header_fields, objects, types = None):
     visited = set()
@@ -1106,11 +1357,9 @@ def check_P4RefExpression(self, symbols, header_fields, objects, types = None):
         #     return False
     return True
 
-last_extracted = None
-
 def check_P4FieldRefExpression(self, symbols, header_fields, objects, types = None):
     # TODO
-    global last_extracted
+    last_extracted = current_context().last_extracted
     assert (Types.field in types)
     if type(self.header_ref) is str:
         assert(self.header_ref == "latest")
@@ -1181,17 +1430,15 @@ def check_P4Bool(self, symbols, header_fields, objects, types = None):
     pass
 
 def check_P4ParserFunction(self, symbols, header_fields, objects, types = None):
-    global last_extracted
-    last_extracted = None
+    current_context().last_extracted = None
     for statement in self.extract_and_set_statements:
         statement.check(symbols, header_fields, objects)
     self.return_statement.check(symbols, header_fields, objects)
 
 def check_P4ParserExtract(self, symbols, header_fields, objects, types = None):
-    global last_extracted
     self.header_ref.check(symbols, header_fields, objects,
                           {Types.header_instance})
-    last_extracted = self.header_ref.name
+    current_context().last_extracted = self.header_ref.name
 
 def check_P4ParserSetMetadata(self, symbols, header_fields, objects, types = None):
     self.field_ref.check(symbols, header_fields, objects, {Types.field})
@@ -30,6 +30,17 @@ class P4Lexer:
         """
         self.lexer.lineno = 1
 
+    def reset(self):
+        """ Resets the lexer so that it can be reused for a new input.
+        """
+        self.filename = ''
+        self.last_token = None
+        self.errors_cnt = 0
+        self.pp_line = self.pp_filename = None
+        self.lexer.begin('INITIAL')
+        self.lexer.lexstatestack = []
+        self.reset_lineno()
+
     def get_lineno(self):
         return self.lexer.lineno
 
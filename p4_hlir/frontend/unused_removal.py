@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from ast import *
+from p4_hlir.util.build_context import current_context
 
 
 def mark_used_P4Program(self, objects, types = None):
@@ -51,7 +52,7 @@ def add_direct_object(self, objects):
     table_name = self.direct_or_static[1].name
     table = objects.get_object(table_name, P4Table)
     assert(table is not None)
-    P4TreeNode.direct_objects.append( (self, table) )
+    current_context().direct_objects.append( (self, table) )
 
 P4Counter.add_direct_object = add_direct_object
 P4Meter.add_direct_object = add_direct_object
@@ -174,10 +175,8 @@ def mark_used_P4RefExpression(self, objects, types = None):
             obj.mark()
             return
 
-last_extracted = None
-
 def mark_used_P4FieldRefExpression(self, objects, types = None):
-    global last_extracted
+    last_extracted = current_context().last_extracted
     if type(self.header_ref) is str:
         assert(self.header_ref == "latest")
         header = last_extracted
@@ -200,16 +199,14 @@ def mark_used_P4Bool(self, objects, types = None):
     pass
 
 def mark_used_P4ParserFunction(self, objects, types = None):
-    global last_extracted
-    last_extracted = None
+    current_context().last_extracted = None
     for statement in self.extract_and_set_statements:
         statement.mark_used(objects)
     self.return_statement.mark_used(objects)
 
 def mark_used_P4ParserExtract(self, objects, types = None):
-    global last_extracted
     self.header_ref.mark_used(objects, {P4HeaderInstance})
-    last_extracted = self.header_ref.name
+    current_context().last_extracted = self.header_ref.name
 
 def mark_used_P4ParserSetMetadata(self, objects, types = None):
     self.field_ref.mark_used(objects)
@@ -331,12 +328,13 @@ P4ParserExceptionDrop.mark_used = mark_used_P4ParserExceptionDrop
 P4ParserExceptionReturn.mark_used = mark_used_P4ParserExceptionReturn
 
 def remove_unused_P4Program(self, objects):
+    context = current_context()
     removed = True
     while removed:
-        P4TreeNode.direct_objects = []
+        context.direct_objects = []
         removed = False
         self.mark_used(objects)
-        for obj, table in P4TreeNode.direct_objects:
+        for obj, table in context.direct_objects:
             if table.is_marked():
                 obj.mark()
         new_objects = []
@@ -13,10 +13,11 @@
 # limitations under the License.
 
 import p4
+from p4_hlir.util.build_context import current_context
 
-_include_valid = False
+# The caches and the include_valid flag used by these functions are kept in the
+# context of the current build (see p4_hlir.util.build_context)
 
-valid_pseudo_fields = {}
 class p4_pseudo_field(object):
     def __init__(self, instance):
         self.instance = instance
@@ -26,6 +27,7 @@ class p4_pseudo_field(object):
         return self.name
 
 def get_pseudo_valid_field(header):
+    valid_pseudo_fields = current_context().valid_pseudo_fields
     if header not in valid_pseudo_fields:
         valid_pseudo_fields[header] = p4_pseudo_field(header)
     return valid_pseudo_fields[header]
@@ -38,6 +40,38 @@ def get_header(header_or_field):
     except:
         return header_or_field
 
+# Sets of fields are represented as bitmasks (arbitrary-precision ints) of the
+# ids of the fields, so that unions, intersections and emptiness tests are word
+# operations. The ids are dense and kept in the context of the current build:
+# assign_field_ids() numbers all the fields of a program, validity pseudo fields
+# and fields created afterwards get an id when they are first used.
+
+def get_field_id(field):
+    context = current_context()
+    field_ids = context.field_ids
+    field_id = field_ids.get(field)
+    if field_id is None:
+        field_id = len(context.fields_by_id)
+        field_ids[field] = field_id
+        context.fields_by_id.append(field)
+    return field_id
+
+def assign_field_ids(hlir):
+    for field in hlir.p4_fields.values():
+        get_field_id(field)
+
+def fields_from_mask(mask):
+    """
+    Returns the set of fields in the bitmask
+    """
+    fields_by_id = current_context().fields_by_id
+    fields = set()
+    while mask:
+        low_bit = mask & -mask
+        fields.add(fields_by_id[low_bit.bit_length() - 1])
+        mask ^= low_bit
+    return fields
+
 # places all fields of a header instance in field_set
 def get_all_subfields(field, field_set):
     if isinstance(field, p4.p4_field):
@@ -55,16 +89,45 @@ def get_all_subfields(field, field_set):
     else:
         assert(False)
 
+# same as get_all_subfields(), but returns a bitmask
+def get_subfields_mask(field):
+    if isinstance(field, p4.p4_field):
+        return 1 << get_field_id(field)
+    elif isinstance(field, p4.p4_header_instance):
+        instance_field_masks = current_context().instance_field_masks
+        mask = instance_field_masks.get(field)
+        if mask is None:
+            mask = 0
+            for subfield in field.fields:
+                mask |= 1 << get_field_id(subfield)
+            instance_field_masks[field] = mask
+        return mask
+    elif isinstance(field, p4.p4_field_list):
+        mask = 0
+        for subfield in field.fields:
+            mask |= get_subfields_mask(subfield)
+        return mask
+    elif isinstance(field, p4.p4_sized_integer):
+        return 0
+    elif isinstance(field, int):
+        return 0
+    else:
+        assert(False)
+
+def get_pseudo_valid_field_mask(header):
+    return 1 << get_field_id(get_pseudo_valid_field(header))
+
 # Retrieve all the fields touched by an action. Returns a tuple (fields_read,
-# fields_write, fields_all) of 3 sets. Use a cache (dictionary indexed by
+# fields_write, fields_all) of 3 bitmasks. Use a cache (dictionary indexed by
 # action) for better performance
-action_fields_cache = {}
-def retrieve_from_one_action(action):
+def retrieve_masks_from_one_action(action):
+    context = current_context()
+    action_fields_cache = context.action_fields_cache
     if action in action_fields_cache:
         return action_fields_cache[action]
-    action_fields_write = set()
-    action_fields_read = set()
-    action_fields = set()
+    include_valid = context.include_valid
+    action_fields_write = 0
+    action_fields_read = 0
     for call in action.flat_call_sequence:
         primitive = call[0]
         args = call[1]
@@ -77,13 +140,13 @@ def retrieve_from_one_action(action):
                 access = p4.P4_WRITE if "access" not in flags \
                          else flags["access"]
                 if access == p4.P4_WRITE:
-                    get_all_subfields(arg, action_fields_write)
-                    if _include_valid and isinstance(arg, p4.p4_header_instance):
-                        action_fields_write.add(get_pseudo_valid_field(arg))
+                    action_fields_write |= get_subfields_mask(arg)
+                    if include_valid and isinstance(arg, p4.p4_header_instance):
+                        action_fields_write |= get_pseudo_valid_field_mask(arg)
                 elif access == p4.P4_READ:
-                    get_all_subfields(arg, action_fields_read)
-                    if _include_valid and isinstance(arg, p4.p4_header_instance):
-                        action_fields_read.add(get_pseudo_valid_field(arg))
+                    action_fields_read |= get_subfields_mask(arg)
+                    if include_valid and isinstance(arg, p4.p4_header_instance):
+                        action_fields_read |= get_pseudo_valid_field_mask(arg)
                 else:
                     assert(False)
             elif isinstance(arg, int):
@@ -91,22 +154,18 @@ def retrieve_from_one_action(action):
             elif isinstance(arg, p4.p4_field_list_calculation):
                 for field_list in arg.input:
                     assert(type(field_list) is p4.p4_field_list)
-                    for field in field_list.fields:
-                        get_all_subfields(field, action_fields_read)
+                    action_fields_read |= get_subfields_mask(field_list)
             elif isinstance(arg, p4.p4_field_list):
                 sig_arg_name = primitive.signature[index]
                 flags = primitive.signature_flags[sig_arg_name]
                 access = p4.P4_WRITE if "access" not in flags \
                          else flags["access"]
-                for field in arg.fields:
-                    if isinstance(field, p4.p4_sized_integer):
-                        continue
-                    if access == p4.P4_WRITE:
-                        get_all_subfields(field, action_fields_write)
-                    elif access == p4.P4_READ:
-                        get_all_subfields(field, action_fields_read)
-                    else:
-                        assert(False)
+                if access == p4.P4_WRITE:
+                    action_fields_write |= get_subfields_mask(arg)
+                elif access == p4.P4_READ:
+                    action_fields_read |= get_subfields_mask(arg)
+                else:
+                    assert(False)
             elif isinstance(arg, p4.p4_counter):
                 # something needs to be done with the count() primitive?
                 continue
@@ -124,74 +183,88 @@ def retrieve_from_one_action(action):
                 print type(arg), arg
                 assert(False)
 
-    action_fields.update(action_fields_read)
-    action_fields.update(action_fields_write)
     action_fields_cache[action] = (action_fields_read,
                                    action_fields_write,
-                                   action_fields)
+                                   action_fields_read | action_fields_write)
     return action_fields_cache[action]
 
-def _retrieve_match_fields_p4_conditional_node(self):
-    def condition_get_fields(condition, field_set):
+# Retrieve all the fields touched by an action, as a tuple (fields_read,
+# fields_write, fields_all) of 3 sets
+def retrieve_from_one_action(action):
+    return tuple(fields_from_mask(mask)
+                 for mask in retrieve_masks_from_one_action(action))
+
+def _retrieve_match_mask_p4_conditional_node(self):
+    def condition_get_mask(condition):
         if condition is None:
-            return
+            return 0
         if isinstance(condition, p4.p4_headers.p4_field):
-            get_all_subfields(condition, field_set)
-            return
+            return get_subfields_mask(condition)
         if not isinstance(condition, p4.p4_expression):
-            return
-        if _include_valid and condition.op == "valid":
-            field_set.add(get_pseudo_valid_field(get_header(condition.right)))
-            return
-        condition_get_fields(condition.left, field_set)
-        condition_get_fields(condition.right, field_set)
-
-    result = set()
-    condition_get_fields(self.condition, result)
-    return result
+            return 0
+        if include_valid and condition.op == "valid":
+            return get_pseudo_valid_field_mask(get_header(condition.right))
+        return condition_get_mask(condition.left) | \
+            condition_get_mask(condition.right)
+
+    include_valid = current_context().include_valid
+    return condition_get_mask(self.condition)
 
-p4.p4_conditional_node.retrieve_match_fields = _retrieve_match_fields_p4_conditional_node
+p4.p4_conditional_node.retrieve_match_mask = _retrieve_match_mask_p4_conditional_node
 
-def _retrieve_match_fields_p4_table(self):
+def _retrieve_match_mask_p4_table(self):
     def retrieve_from_action_profile(action_profile):
-        ap_fields = set()
         selector = action_profile.selector
-        if selector is None: return ap_fields
+        if selector is None: return 0
+        ap_mask = 0
         field_lists_input = selector.selection_key.input
         for field_list in field_lists_input:
-            get_all_subfields(field_list, ap_fields)
-        return ap_fields
+            ap_mask |= get_subfields_mask(field_list)
+        return ap_mask
 
-    result = set()
+    include_valid = current_context().include_valid
+    result = 0
     for field in self.match_fields:
-        if _include_valid and field[1] == p4.p4_match_type.P4_MATCH_VALID:
-            result.add(get_pseudo_valid_field(get_header(field[0])))
+        if include_valid and field[1] == p4.p4_match_type.P4_MATCH_VALID:
+            result |= get_pseudo_valid_field_mask(get_header(field[0]))
         else:
-            get_all_subfields(field[0], result)
+            result |= get_subfields_mask(field[0])
     if self.action_profile is not None:
-        ap_r = retrieve_from_action_profile(self.action_profile)
-        result.update(ap_r)
+        result |= retrieve_from_action_profile(self.action_profile)
     return result
 
-p4.p4_table.retrieve_match_fields = _retrieve_match_fields_p4_table
+p4.p4_table.retrieve_match_mask = _retrieve_match_mask_p4_table
+
+def _retrieve_match_fields(self):
+    return fields_from_mask(self.retrieve_match_mask())
 
-def _retrieve_action_fields_p4_conditional_node(self):
-    return set(), set()
+p4.p4_conditional_node.retrieve_match_fields = _retrieve_match_fields
+p4.p4_table.retrieve_match_fields = _retrieve_match_fields
 
-p4.p4_conditional_node.retrieve_action_fields =_retrieve_action_fields_p4_conditional_node
+def _retrieve_action_masks_p4_conditional_node(self):
+    return 0, 0
 
-def _retrieve_action_fields_p4_table(self, include_valid = False):
-    fields_read = set()
-    fields_write = set()
+p4.p4_conditional_node.retrieve_action_masks = _retrieve_action_masks_p4_conditional_node
+
+def _retrieve_action_masks_p4_table(self):
+    fields_read = 0
+    fields_write = 0
     for action in self.actions:
-        r, w, _ = retrieve_from_one_action(action)
-        fields_read.update(r)
-        fields_write.update(w)
+        r, w, _ = retrieve_masks_from_one_action(action)
+        fields_read |= r
+        fields_write |= w
     return fields_read, fields_write
 
-p4.p4_table.retrieve_action_fields = _retrieve_action_fields_p4_table
+p4.p4_table.retrieve_action_masks = _retrieve_action_masks_p4_table
+
+def _retrieve_action_fields(self, include_valid = False):
+    fields_read, fields_write = self.retrieve_action_masks()
+    return fields_from_mask(fields_read), fields_from_mask(fields_write)
+
+p4.p4_conditional_node.retrieve_action_fields = _retrieve_action_fields
+p4.p4_table.retrieve_action_fields = _retrieve_action_fields
 
 def reset_state(include_valid = False):
-    action_fields_cache.clear()
-    global _include_valid
-    _include_valid = include_valid
+    context = current_context()
+    context.action_fields_cache = {}
+    context.include_valid = include_valid
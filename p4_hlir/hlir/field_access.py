@@ -13,49 +13,63 @@
 # limitations under the License.
 
 import p4
-from analysis_utils import retrieve_from_one_action
+from analysis_utils import assign_field_ids, fields_from_mask, reset_state
 
 """
 This module annotates the HLIR p4_field objects with access information
 """
 
-def _get_fields_accessed_pipeline(root_p4_table,
-                                  fields_read,
-                                  fields_write,
-                                  visited = set()):
-    if not root_p4_table: return
-    if root_p4_table in visited: return
+# returns the fields read and written by the tables reachable from
+# root_p4_table, as 2 bitmasks (see analysis_utils)
+def _get_fields_accessed_pipeline(root_p4_table, visited):
+    if not root_p4_table: return 0, 0
+    if root_p4_table in visited: return 0, 0
     visited.add(root_p4_table)
 
-    match_fields = root_p4_table.retrieve_match_fields()
-    action_fields_read, action_fields_write = root_p4_table.retrieve_action_fields()
+    match_fields = root_p4_table.retrieve_match_mask()
+    action_fields_read, action_fields_write = root_p4_table.retrieve_action_masks()
     
-    fields_read.update(match_fields)
-    fields_read.update(action_fields_read)
-    fields_write.update(action_fields_write)
+    fields_read = match_fields | action_fields_read
+    fields_write = action_fields_write
 
     next_tables = set(root_p4_table.next_.values())
     for nt in next_tables:
         if not nt: continue
-        _get_fields_accessed_pipeline(nt, fields_read, fields_write, visited)
+        r, w = _get_fields_accessed_pipeline(nt, visited)
+        fields_read |= r
+        fields_write |= w
+    return fields_read, fields_write
 
-def annotate_hlir(hlir):
-    fields_read_ingress, fields_write_ingress = set(), set()
-    for ingress_entry in hlir.p4_ingress_ptr.keys():
-        _get_fields_accessed_pipeline(ingress_entry,
-                                      fields_read_ingress, fields_write_ingress)
-    for field in fields_read_ingress:
-        field.ingress_read = True
-    for field in fields_write_ingress:
-        field.ingress_write = True
-
-    if hlir.p4_egress_ptr is not None:
-        fields_read_egress, fields_write_egress = set(), set()
-        egress_entry = hlir.p4_egress_ptr
-        _get_fields_accessed_pipeline(egress_entry,
-                                      fields_read_egress, fields_write_egress)
-        
-        for field in fields_read_egress:
+def annotate_pipeline(hlir, pipeline):
+    """
+    Sets the access flags of the fields (ingress_read and ingress_write, or
+    egress_read and egress_write) for the 'ingress' or 'egress' pipeline
+    """
+    # the validity pseudo fields are not annotated
+    reset_state(include_valid = False)
+    assign_field_ids(hlir)
+
+    if pipeline == "ingress":
+        fields_read, fields_write = 0, 0
+        visited = set()
+        for ingress_entry in hlir.p4_ingress_ptr.keys():
+            r, w = _get_fields_accessed_pipeline(ingress_entry, visited)
+            fields_read |= r
+            fields_write |= w
+        for field in fields_from_mask(fields_read):
+            field.ingress_read = True
+        for field in fields_from_mask(fields_write):
+            field.ingress_write = True
+
+    elif hlir.p4_egress_ptr is not None:
+        fields_read, fields_write = _get_fields_accessed_pipeline(
+            hlir.p4_egress_ptr, set()
+        )
+        for field in fields_from_mask(fields_read):
             field.egress_read = True
-        for field in fields_write_egress:
+        for field in fields_from_mask(fields_write):
             field.egress_write = True
+
+def annotate_hlir(hlir):
+    annotate_pipeline(hlir, "ingress")
+    annotate_pipeline(hlir, "egress")
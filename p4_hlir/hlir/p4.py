@@ -16,6 +16,7 @@ import os
 import ast
 import inspect
 import logging
+import time
 
 from p4_core import *
 from p4_headers import *
@@ -31,6 +32,9 @@ import re
 
 import table_dependency as dep
 import field_access
+import analysis_utils
+
+from p4_hlir.util.build_context import context_of
 
 # def get_control_entry_points(hlir):
 #     control_entry_points = {}
@@ -42,19 +46,94 @@ import field_access
 #             pass
 #     return control_entry_points
 
-control_entry_points = {}
 def get_control_entry_point(hlir, control_flow):
+    control_entry_points = context_of(hlir).control_entry_points
     if control_flow in control_entry_points:
         return control_entry_points[control_flow]
 
     control_entry_points[control_flow], _ = p4_control_flow_to_table_graph(hlir, control_flow)
     return control_entry_points[control_flow]
 
-def parse_pragmas(object_collection):
+# pragma strings are split in whitespace-delimited tokens
+_pragma_split_re = re.compile(r"\s+")
+
+def split_pragma(pragma_str):
+    return _pragma_split_re.split(pragma_str)
+
+class p4_pragma_index(object):
+    """
+    Maps the token prefixes of the pragmas of all the HLIR objects to the
+    objects carrying them, so that backends can find the objects with a given
+    pragma without scanning the HLIR. Built by p4_validate() as
+    hlir.p4_pragma_index, the nodes removed when the table graph is optimized
+    are removed from it.
+
+    Eg, with
+    @pragma stage 3
+    on table t1 and
+    @pragma stage 4 ingress
+    on table t2,
+    find("stage", p4_table) is [t1, t2], find("stage 3") is [t1] and
+    find_values("stage", p4_table) is {t1: [("3",)], t2: [("4", "ingress")]}
+    """
+    def __init__(self):
+        # (object type or None, prefix tuple) -> object -> list of the
+        # remaining tokens of the pragmas starting with the prefix
+        self._index = {}
+
+    def add(self, p4_object, pragma_tokens):
+        pragma_tokens = tuple(pragma_tokens)
+        for object_type in (None, type(p4_object)):
+            for i in range(1, len(pragma_tokens) + 1):
+                key = (object_type, pragma_tokens[:i])
+                objects = self._index.get(key)
+                if objects is None:
+                    objects = self._index[key] = OrderedDict()
+                objects.setdefault(p4_object, []).append(pragma_tokens[i:])
+
+    def remove(self, p4_object):
+        """
+        Removes an object from the index, e.g. when it is removed from the HLIR
+        """
+        for pragma_str in getattr(p4_object, "_pragmas", ()):
+            pragma_tokens = tuple(split_pragma(pragma_str))
+            for object_type in (None, type(p4_object)):
+                for i in range(1, len(pragma_tokens) + 1):
+                    key = (object_type, pragma_tokens[:i])
+                    objects = self._index.get(key)
+                    if objects is None: continue
+                    objects.pop(p4_object, None)
+                    if not objects:
+                        del self._index[key]
+
+    def _get(self, prefix, object_type):
+        if isinstance(prefix, basestring):
+            prefix = split_pragma(prefix)
+        return self._index.get((object_type, tuple(prefix)), {})
+
+    def find(self, prefix, object_type = None):
+        """
+        The objects (of type object_type if not None) with a pragma starting
+        with prefix, a string or a sequence of tokens
+        """
+        return self._get(prefix, object_type).keys()
+
+    def find_values(self, prefix, object_type = None):
+        """
+        Same as find(), but returns a dictionary which maps every object to the
+        list of the tokens following prefix in its pragmas
+        """
+        return OrderedDict(
+            (p4_object, list(values))
+            for p4_object, values in self._get(prefix, object_type).items()
+        )
+
+def parse_pragmas(object_collection, pragma_index = None):
     """
     Add attribute '_parsed_pragmas' to every pragma-capable HLIR object that
     replaces the flat set of strings in '_pragmas' with nested dictionaries
-    of whitespace-delimited tokens from the string.
+    of whitespace-delimited tokens from the string. The pragmas are also added
+    to pragma_index (a p4_pragma_index) if not None.
 
     Eg,
     @pragma a b c d
@@ -75,12 +154,14 @@ def parse_pragmas(object_collection):
     for p4_object in object_collection.values():
         p4_object._parsed_pragmas = OrderedDict()
         for pragma_str in p4_object._pragmas:
-            pragma_tokens = re.split("\s+", pragma_str)
+            pragma_tokens = split_pragma(pragma_str)
             last_dict = p4_object._parsed_pragmas
             for token in pragma_tokens:
                 next_dict = last_dict.get(token, OrderedDict())
                 last_dict[token] = next_dict
                 last_dict = next_dict
+            if pragma_index is not None:
+                pragma_index.add(p4_object, pragma_tokens)
 
 def p4_validate(hlir):
     """
@@ -116,8 +197,9 @@ def p4_validate(hlir):
         hlir.p4_parse_states,
         hlir.p4_parser_exceptions,
     ]
+    hlir.p4_pragma_index = p4_pragma_index()
     for hlir_dict in p4_types:
-        parse_pragmas(hlir_dict)
+        parse_pragmas(hlir_dict, hlir.p4_pragma_index)
         for _, p4_object in hlir_dict.items():
             p4_object.build(hlir)
 
@@ -133,6 +215,7 @@ def p4_validate(hlir):
 
     # Convert control functions into table graph
     # control_entry_points = get_control_entry_points(hlir)
+    control_entry_points = context_of(hlir).control_entry_points
     visited_parse_states = set()
     parse_states_to_visit = [hlir.p4_parse_states["start"]]
     # TODO: warn on missing states:
@@ -176,8 +259,144 @@ def p4_validate(hlir):
 
 
 def p4_dependencies(hlir):
-    dep.annotate_hlir(hlir)
+    with context_of(hlir).activate():
+        dep.annotate_hlir(hlir)
 
 def p4_field_access(hlir):
-    field_access.annotate_hlir(hlir)
+    with context_of(hlir).activate():
+        field_access.annotate_hlir(hlir)
+
+class p4_analyses(object):
+    """
+    Runs the analyses which annotate the HLIR on demand: the dependencies of a
+    node (dependencies_for, dependencies_to) are computed the first time they
+    are read, for the pipeline(s) the node belongs to, and the access flags of
+    the fields (ingress_read, egress_write...) the first time one of the flags
+    of the pipeline is read. Every analysis runs at most once per pipeline,
+    until invalidate() is called. The time taken by the analyses which ran is
+    recorded in hlir.build_stats["analysis_times"].
+
+    Created by HLIR.build() as hlir.p4_analyses, unless analyze is False.
+    """
+    _annotate_functions = {
+        "dependencies": dep.annotate_pipeline,
+        "field_access": field_access.annotate_pipeline,
+    }
+
+    def __init__(self, hlir):
+        self.hlir = hlir
+        # (analysis, pipeline) pairs which have run
+        self.done = set()
+        # pipeline -> the nodes reachable from its entry points
+        self._pipeline_nodes = None
+        self._running = False
+
+    def _get_pipeline_nodes(self):
+        if self._pipeline_nodes is None:
+            self._pipeline_nodes = {
+                "ingress": _reachable_nodes(self.hlir.p4_ingress_ptr.keys()),
+                "egress": _reachable_nodes([self.hlir.p4_egress_ptr]),
+            }
+        return self._pipeline_nodes
+
+    def require(self, analysis, pipeline):
+        """
+        Runs 'analysis' ("dependencies" or "field_access") on 'pipeline'
+        ("ingress" or "egress") if it has not run yet
+        """
+        # the analyses read the annotations they write
+        if self._running or (analysis, pipeline) in self.done:
+            return
+        self.done.add( (analysis, pipeline) )
+        self._run(analysis, pipeline)
+
+    def _run(self, analysis, pipeline, *args):
+        self._running = True
+        start = time.time()
+        try:
+            with context_of(self.hlir).activate():
+                self._annotate_functions[analysis](self.hlir, pipeline, *args)
+        finally:
+            self._running = False
+        analysis_times = self.hlir.build_stats.setdefault("analysis_times",
+                                                          OrderedDict())
+        analysis_times[analysis + "." + pipeline] = time.time() - start
+
+    def require_dependencies(self, node):
+        if self._running:
+            return
+        for pipeline, nodes in self._get_pipeline_nodes().items():
+            if node in nodes:
+                self.require("dependencies", pipeline)
+
+    def require_all(self):
+        for analysis in ["dependencies", "field_access"]:
+            for pipeline in ["ingress", "egress"]:
+                self.require(analysis, pipeline)
+
+    def invalidate(self):
+        """
+        Discards the annotations and the caches of the analyses, so that they
+        are computed again when they are next read (e.g. after the table graph
+        was modified)
+        """
+        self.done = set()
+        self._pipeline_nodes = None
+        with context_of(self.hlir).activate():
+            analysis_utils.reset_state()
+        for node in self.hlir.p4_nodes.values():
+            node._dependencies_for = {}
+            node._dependencies_to = {}
+        self._reset_field_access()
+
+    def _reset_field_access(self):
+        for field in self.hlir.p4_fields.values():
+            field._ingress_read = False
+            field._ingress_write = False
+            field._egress_read = False
+            field._egress_write = False
+
+    def update(self, changed_nodes):
+        """
+        Brings the annotations up to date after the fields matched or
+        modified by 'changed_nodes' changed, without any change to the table
+        graph (see HLIR.rebuild()): in the pipelines whose dependencies were
+        computed, only the dependencies from and to these nodes are computed
+        again, and the access flags of the fields are computed again when they
+        are next read
+        """
+        changed_nodes = set(changed_nodes)
+        if not changed_nodes:
+            return
+        if self.hlir.analysis_args.get('do_transitive_reduction', False):
+            # the reduction of a dependency depends on all the other ones
+            self.invalidate()
+            return
+
+        for node in changed_nodes:
+            for other in node._dependencies_for:
+                other._dependencies_to.pop(node, None)
+            for other in node._dependencies_to:
+                other._dependencies_for.pop(node, None)
+            node._dependencies_for = {}
+            node._dependencies_to = {}
+        for pipeline, nodes in self._get_pipeline_nodes().items():
+            if ("dependencies", pipeline) not in self.done:
+                continue
+            if changed_nodes & nodes:
+                self._run("dependencies", pipeline, changed_nodes & nodes)
+
+        self.done.discard( ("field_access", "ingress") )
+        self.done.discard( ("field_access", "egress") )
+        self._reset_field_access()
+
+def _reachable_nodes(entry_points):
+    visited = set()
+    to_visit = [node for node in entry_points if node]
+    while to_visit:
+        node = to_visit.pop()
+        if node in visited: continue
+        visited.add(node)
+        to_visit.extend(n for n in node.next_.values() if n)
+    return visited
 
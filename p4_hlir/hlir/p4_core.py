@@ -16,6 +16,8 @@ import inspect
 import logging
 import os
 
+from p4_hlir.util.build_context import current_context, _default_context
+
 #############################################################################
 ## Compiler pragmas/global flag system
 
@@ -47,18 +49,24 @@ def p4_pragma_basic_flag (pragma_name, _, value):
 class p4_compiler_msg(Exception):
     """
     Internal class to store compiler messages (warnings, errors, info)
-    """
-    messages = []
-    message_count = {}
 
+    Messages are recorded in the context of the current build (see
+    p4_hlir.util.build_context), use p4_compiler_msg_list() to get them.
+    They are kept in HLIR.context.messages and HLIR.context.message_count;
+    'messages' and 'message_count' only hold those of the last finished
+    build.
+    """
+    messages = _default_context.messages
+    message_count = _default_context.message_count
     def __init__(self, message, filename = None, lineno = None, level=logging.ERROR, context=None):
         self.message = message
         self.level = level
         self.filename = filename
         self.lineno = lineno
 
-        self.__class__.messages.append(self)    
-        self.__class__.message_count[self.level] = p4_compiler_msg_count(level) + 1
+        build_context = current_context()
+        build_context.messages.append(self)
+        build_context.message_count[self.level] = p4_compiler_msg_count(level) + 1
 
     def __repr__ (self):
         return self.__str__ ()
@@ -71,15 +79,22 @@ class p4_compiler_msg(Exception):
                 line_str += " line "+str(self.lineno)
         return "%s%s: %s" % (logging.getLevelName(self.level), line_str, self.message)
 
+def p4_compiler_msg_list():
+    return current_context().messages
+
 def p4_compiler_msg_count(level):
-    if level in p4_compiler_msg.message_count:
-        return p4_compiler_msg.message_count[level]
+    message_count = current_context().message_count
+    if level in message_count:
+        return message_count[level]
     else:
         return 0
 
 def p4_compiler_msg_reset():
-    p4_compiler_msg.messages = []
-    p4_compiler_msg.message_count = {}
+    # cleared in place, p4_compiler_msg.messages and message_count refer to
+    # the lists of the default context, which mirror the last build
+    build_context = current_context()
+    del build_context.messages[:]
+    build_context.message_count.clear()
 
 
 class p4_enum (object):
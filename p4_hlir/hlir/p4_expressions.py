@@ -63,7 +63,10 @@ class p4_expression(object):
 
     def resolve_names(self, hlir, local_vars={}):
         if self.op=="valid":
-            self.right = hlir.p4_header_instances[self.right]
+            # the expressions of the flat call sequences of actions are shared
+            # with the ones of the actions they call, and resolved once
+            if type(self.right) is str:
+                self.right = hlir.p4_header_instances[self.right]
         else:
             if type(self.left) is p4_expression:
                 self.left.resolve_names(hlir, local_vars)
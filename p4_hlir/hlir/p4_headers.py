@@ -39,27 +39,63 @@ P4_PAYLOAD = p4_header_keywords.payload
 P4_SIGNED = p4_header_keywords.signed
 P4_SATURATING = p4_header_keywords.saturating
 
+# shared by all the fields which are not calculated, see
+# validate_calculated_fields()
+NO_CALCULATION = ()
+
 class p4_field (object):
     """
     TODO
     """
+    # programs can have a very large number of fields (header stacks,
+    # metadata), which are much smaller without a __dict__. The fields of all
+    # the instances of a header type share its field names and attribute sets.
+    __slots__ = ("instance", "name", "width", "attributes", "offset",
+                 "default", "calculation",
+                 "_ingress_read", "_ingress_write", "_egress_read",
+                 "_egress_write")
 
     def __init__ (self, hlir, instance, name, width, attributes, offset, default):
         self.instance = instance
-        self.name = name
+        self.name = intern(name)
         self.width = width
         self.attributes = attributes
         self.offset = offset
         self.default = default
-        self.calculation = []
+        self.calculation = NO_CALCULATION
 
-        self.ingress_read = False
-        self.ingress_write = False
-        self.egress_read = False
-        self.egress_write = False
+        # computed on demand by the field access analysis, see the
+        # ingress_read, ingress_write, egress_read and egress_write properties
+        self._ingress_read = False
+        self._ingress_write = False
+        self._egress_read = False
+        self._egress_write = False
 
         hlir.p4_fields[str(self)] = self
 
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in p4_field.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(p4_field.__slots__, state):
+            setattr(self, name, value)
+
+    def _access_flag(slot, pipeline):
+        def get_flag(self):
+            analyses = self.instance._analyses
+            if analyses is not None:
+                analyses.require("field_access", pipeline)
+            return getattr(self, slot)
+        def set_flag(self, value):
+            setattr(self, slot, value)
+        return property(get_flag, set_flag)
+
+    ingress_read = _access_flag("_ingress_read", "ingress")
+    ingress_write = _access_flag("_ingress_write", "ingress")
+    egress_read = _access_flag("_egress_read", "egress")
+    egress_write = _access_flag("_egress_write", "egress")
+    del _access_flag
+
     @staticmethod
     def get_from_hlir(hlir, name):
         return hlir.p4_fields[name]
@@ -84,6 +120,8 @@ def validate_calculated_fields(hlir):
             if if_cond:
                 if_cond.resolve_names(hlir)
 
+            if field.calculation is NO_CALCULATION:
+                field.calculation = []
             field.calculation.append( (op, calc, if_cond) )
 
 class p4_field_list_calculation (p4_object):
@@ -192,6 +230,9 @@ class p4_header_instance (p4_object):
             self.virtual = False
 
         self.fields = []
+        self.fields_by_name = {}
+        # the field access analysis of the fields, see p4_field
+        self._analyses = hlir.p4_analyses
 
         hlir.p4_header_instances[self.name] = self
 
@@ -237,8 +278,19 @@ class p4_header_instance (p4_object):
                 else:
                     break
 
+        for field in self.fields:
+            self.fields_by_name[field.name] = field
+
         delattr(self, "initializer")
 
+    def get_field (self, field_name):
+        field = self.fields_by_name.get(field_name)
+        if field is None:
+            raise p4_compiler_msg (
+                "Reference to invalid field '"+field_name+"' in header instance '"+self.name+"'"
+            )
+        return field
+
     def __str__ (self):
         return self.name
 
@@ -266,25 +318,31 @@ class p4_header (p4_object):
     def build(self, hlir):
         pass
 
-def p4_field_reference (hlir, str_ref):
+def p4_field_reference (hlir, str_ref, latest = None):
+    """
+    Resolves a field reference of the form 'instance.field' (the instance can
+    be an element of a header stack, e.g. 'tag[next].field'). In a parse
+    state, 'latest.field' refers to a field of the header instance given as
+    latest.
+    """
     # TODO: this function is made obsolete by p4_field.collection, try to
     #       remove it
-    tokens = str_ref.split(".")
-    if len(tokens) != 2:
+    field = hlir.p4_fields.get(str_ref)
+    if field is not None:
+        return field
+
+    instance_name, _, field_name = str_ref.partition(".")
+    if not field_name or "." in field_name:
         raise p4_compiler_msg (
             "Invalid field reference '"+str_ref+"' (must be of the form 'instance.field')"
         )
 
-    if tokens[0] not in hlir.p4_header_instances:
+    if instance_name == "latest" and latest is not None:
+        return latest.get_field(field_name)
+
+    if instance_name not in hlir.p4_header_instances:
         raise p4_compiler_msg (
-            "Reference to undeclared header instance '"+tokens[0]+"'"
+            "Reference to undeclared header instance '"+instance_name+"'"
         )
 
-    inst = hlir.p4_header_instances[tokens[0]]
-    for field in inst.fields:
-        if field.name == tokens[1]:
-            return field
-
-    raise p4_compiler_msg (
-        "Reference to invalid field '"+tokens[1]+"' in header instance '"+tokens[0]+"'"
-    )
+    return hlir.p4_header_instances[instance_name].get_field(field_name)
@@ -53,6 +53,73 @@ class p4_signature_ref(object):
     def __repr__(self):
         return "sig("+str(self.idx)+")"
 
+def _bind_arg(arg, args):
+    """
+    Replaces the references to parameters in an argument of a call with the
+    arguments in 'args'. The argument, or the subexpressions of it, which do
+    not change are returned as is.
+    """
+    if isinstance(arg, p4_signature_ref):
+        bound_arg = args[arg.idx]
+        if isinstance(bound_arg, p4_signature_ref) and \
+           bound_arg.idx == arg.idx:
+            # e.g. a parameter passed down to the same position
+            return arg
+        return bound_arg
+    elif isinstance(arg, p4_expression):
+        left = _bind_arg(arg.left, args)
+        right = _bind_arg(arg.right, args)
+        if left is arg.left and right is arg.right:
+            return arg
+        return p4_expression(left, arg.op, right)
+    else:
+        return arg
+
+def _populate_arg(hlir, param_types, arg):
+    """
+    The value of an argument of a primitive call, resolved to one of the
+    allowed types of the parameter, or None if it has none of them
+    """
+    populated_arg = None
+    for param_type in param_types:
+        if type(arg) is param_type:
+            populated_arg = arg
+        elif param_type == p4_table_entry_data:
+            if arg == p4_table_entry_data:
+                populated_arg = arg
+                break
+        elif type(arg) is p4_expression:
+            if param_type in {int, long}:
+                populated_arg = arg
+        else:
+            try:
+                populated_arg = param_type.get_from_hlir(hlir, arg)
+            except Exception:
+                pass
+    return populated_arg
+
+def _canonical_binding(arg):
+    # the name of the table which passes table entry data only appears in
+    # the error messages
+    binding_action, binding_call, binding_arg, value = arg
+    if binding_call is None:
+        binding_action = None
+    return (binding_action, binding_call, binding_arg, type(value), value)
+
+class _validation_cache(object):
+    """
+    The results of the type validations of the actions validated together
+    (see p4_action_validate_types()), so that an action used by many tables
+    is only validated once for each binding of its arguments
+    """
+    def __init__ (self):
+        # (action, canonical binding, None or calling table) -> (actions
+        # called, warnings emitted, whether the calling table was used)
+        self.validated = {}
+        # (primitive, parameter) -> {(type of the argument, argument) ->
+        # resolved argument}, see _populate_arg()
+        self.populated_args = {}
+
 class p4_action (p4_object):
     """
     TODO
@@ -121,87 +188,159 @@ class p4_action (p4_object):
                 list(arg_list)
             )
 
-    def flatten (self, hlir):
+    def flatten (self, hlir, expansions = None):
+        """
+        Computes flat_call_sequence, in which the calls to compound actions
+        are replaced with the primitive calls they make. 'expansions' caches
+        the bound call sequences (see bind_call_sequence()) of the actions
+        which are flattened together, e.g. all the actions of the program.
+        """
         if self.flat_call_sequence == None:
+            if expansions is None:
+                expansions = {}
             self.flat_call_sequence = []
             for call_idx, call in enumerate(self.call_sequence):
                 call_target = call[0]
                 call_args = call[1]
 
-                call_target.flatten(hlir)
+                call_target.flatten(hlir, expansions)
                 if len(call_target.flat_call_sequence) > 0:
-                    for subcall in call_target.flat_call_sequence:
-                        new_call = (subcall[0], subcall[1][:], subcall[2]+[(self,call_idx)])
-                        for idx, subcall_arg in enumerate(new_call[1]):
-
-                            def resolve_expression(arg):
-                                if isinstance(arg, p4_expression):
-                                    expr = p4_expression(op=arg.op)
-                                    expr.left = resolve_expression(arg.left)
-                                    expr.right = resolve_expression(arg.right)
-                                    return expr
-                                elif isinstance(arg, p4_signature_ref):
-                                    return call_args[arg.idx]
-                                else:
-                                    return arg
-
-                            if isinstance(subcall_arg, p4_signature_ref) or\
-                               isinstance(subcall_arg, p4_expression):
-                                new_call[1][idx] = resolve_expression(subcall_arg)
-
-                        self.flat_call_sequence.append(new_call)
+                    for primitive, args, history in \
+                        call_target.bind_call_sequence(call_args, expansions):
+                        self.flat_call_sequence.append(
+                            (primitive, args,
+                             history + [(self, call_idx)])
+                        )
                 else:
-                    self.flat_call_sequence.append((call[0], call[1], [(self,call_idx)]))
+                    self.flat_call_sequence.append(
+                        (call[0], call[1], [(self, call_idx)])
+                    )
 
             for call in self.flat_call_sequence:
-                def resolve_expression(arg, arg_idx):
-                    allowable_types = call[0].signature_flags[call[0].signature[arg_idx]]["type"]
-                    if isinstance(arg, p4_expression):
-                        resolve_expression(arg.left, arg_idx)
-                        resolve_expression(arg.right, arg_idx)
-                    elif isinstance(arg, p4_signature_ref) and p4_table_entry_data in allowable_types:
-                        data_width = call[0].signature_flags[call[0].signature[arg_idx]]["data_width"]
-                        
-                        if type(data_width) is str:
-                            if "." in data_width:
-                                if data_width in hlir.p4_fields:
-                                    data_width = hlir.p4_fields[data_width].width
-                                else:
-                                    raise p4_compiler_msg("Primitive action '"+call[0].name+"' infers width of argument '"+arg+"' from field '"+data_width+"', but field is not defined in the current P4 program.")
-                            else:
-                                inferring_arg = call[1][call[0].signature.index(data_width)]
-                                if type(inferring_arg) is p4_headers.p4_field:
-                                    data_width = inferring_arg.width
-                                elif type(inferring_arg) is p4_stateful.p4_register:
-                                    data_width = inferring_arg.width
-                                else:
-                                    raise p4_compiler_msg("Could not infer width from primitive action '%s' argument in action '%s'" % (call[0].name, call[2][0][0].name))
-                        
-                        if self.signature_widths[arg.idx] == None:
-                            self.signature_widths[arg.idx] = data_width
-                        elif self.signature_widths[arg.idx] != data_width:
-                            p4_compiler_msg (
-                                "Inferred conflicting widths for argument '"+
-                                self.signature[arg.idx]+"' ("+str(data_width)+
-                                " and "+str(self.signature_widths[arg.idx])+
-                                "), using larger width",
-                                self.filename, self.lineno,
-                                level=logging.WARNING
-                            )
-                            self.signature_widths[arg.idx] = max(
-                                data_width,
-                                self.signature_widths[arg.idx]
-                            )
-
                 for arg_idx, arg in enumerate(call[1]):
-                    resolve_expression(arg, arg_idx)
+                    if isinstance(arg, (p4_expression, p4_signature_ref)):
+                        self._infer_signature_widths(hlir, call, arg, arg_idx)
+
+    def _infer_signature_widths (self, hlir, call, arg, arg_idx):
+        # the widths of the parameters of this action which are passed as
+        # table entry data to the primitive of a call of the flat call
+        # sequence are inferred from the primitive
+        allowable_types = call[0].signature_flags[call[0].signature[arg_idx]]["type"]
+        if isinstance(arg, p4_expression):
+            self._infer_signature_widths(hlir, call, arg.left, arg_idx)
+            self._infer_signature_widths(hlir, call, arg.right, arg_idx)
+        elif isinstance(arg, p4_signature_ref) and p4_table_entry_data in allowable_types:
+            data_width = call[0].signature_flags[call[0].signature[arg_idx]]["data_width"]
+
+            if type(data_width) is str:
+                if "." in data_width:
+                    if data_width in hlir.p4_fields:
+                        data_width = hlir.p4_fields[data_width].width
+                    else:
+                        raise p4_compiler_msg("Primitive action '"+call[0].name+"' infers width of argument '"+arg+"' from field '"+data_width+"', but field is not defined in the current P4 program.")
+                else:
+                    inferring_arg = call[1][call[0].signature.index(data_width)]
+                    if type(inferring_arg) is p4_headers.p4_field:
+                        data_width = inferring_arg.width
+                    elif type(inferring_arg) is p4_stateful.p4_register:
+                        data_width = inferring_arg.width
+                    else:
+                        raise p4_compiler_msg("Could not infer width from primitive action '%s' argument in action '%s'" % (call[0].name, call[2][0][0].name))
+
+            if self.signature_widths[arg.idx] == None:
+                self.signature_widths[arg.idx] = data_width
+            elif self.signature_widths[arg.idx] != data_width:
+                p4_compiler_msg (
+                    "Inferred conflicting widths for argument '"+
+                    self.signature[arg.idx]+"' ("+str(data_width)+
+                    " and "+str(self.signature_widths[arg.idx])+
+                    "), using larger width",
+                    self.filename, self.lineno,
+                    level=logging.WARNING
+                )
+                self.signature_widths[arg.idx] = max(
+                    data_width,
+                    self.signature_widths[arg.idx]
+                )
+
+    def bind_call_sequence (self, args, expansions):
+        """
+        The flat call sequence of this (flattened) action, with the references
+        to its parameters replaced with 'args'. The argument lists and the
+        expressions which do not change are shared with the flat call
+        sequence, and the result is memoized in 'expansions' by action and
+        arguments.
+        """
+        try:
+            key = (self, tuple((type(arg), arg.idx)
+                               if isinstance(arg, p4_signature_ref)
+                               else (type(arg), arg) for arg in args))
+            expansion = expansions.get(key)
+        except TypeError:
+            # unhashable argument
+            key = expansion = None
+        if expansion is None:
+            expansion = []
+            for primitive, call_args, history in self.flat_call_sequence:
+                bound_args = [_bind_arg(arg, args) for arg in call_args]
+                for arg, bound_arg in zip(call_args, bound_args):
+                    if arg is not bound_arg:
+                        break
+                else:
+                    bound_args = call_args
+                expansion.append( (primitive, bound_args, history) )
+            if key is not None:
+                expansions[key] = expansion
+        return expansion
+
+    def validate_types (self, hlir, calling_table, args, called_actions,
+                        cache = None):
+        """
+        Checks the types of the arguments of the primitive calls made by this
+        action, bound to 'args' by 'calling_table', and replaces the
+        arguments with the objects they name. The validations which succeed
+        are memoized in 'cache' (a _validation_cache) by action and binding,
+        along with the warnings they emit, which are emitted again. Returns
+        True if the result depends on 'calling_table'.
+        """
+        if cache is None:
+            return self._validate_types(hlir, calling_table, args,
+                                        called_actions, None)
+        try:
+            binding = tuple(_canonical_binding(arg) for arg in args)
+            result = cache.validated.get( (self, binding, None) )
+            if result is None:
+                result = cache.validated.get( (self, binding, calling_table) )
+        except TypeError:
+            # unhashable argument
+            return self._validate_types(hlir, calling_table, args,
+                                        called_actions, cache)
+
+        if result is None:
+            messages = current_context().messages
+            first_message = len(messages)
+            subtree_actions = set()
+            uses_table = self._validate_types(hlir, calling_table, args,
+                                              subtree_actions, cache)
+            warnings = [(msg.message, msg.filename, msg.lineno, msg.level)
+                        for msg in messages[first_message:]]
+            result = (subtree_actions, warnings, uses_table)
+            key = (self, binding, calling_table if uses_table else None)
+            cache.validated[key] = result
+        else:
+            for message, filename, lineno, level in result[1]:
+                p4_compiler_msg(message, filename, lineno, level)
+        called_actions.update(result[0])
+        return result[2]
 
-    def validate_types (self, hlir, calling_table, args, called_actions):
+    def _validate_types (self, hlir, calling_table, args, called_actions,
+                         cache):
         # TODO: call sequence needs to replace strings with id'fiers
         #       change arg_history to point directly to occurence of arg
         #       and replace value at arg[0]
         args_used = set()
         called_actions.add(self)
+        uses_table = False
 
         if len(self.call_sequence) == 0:
             # Primitive action
@@ -218,22 +357,20 @@ class p4_action (p4_object):
                     lineno = self.lineno
                 param = self.signature[idx]
                 param_types = self.signature_flags[param]["type"]
-                populated_arg = None
-                for param_type in param_types:
-                    if type(arg) is param_type:
-                        populated_arg = arg
-                    elif param_type == p4_table_entry_data:
-                        if arg == p4_table_entry_data:
-                            populated_arg = arg
-                            break
-                    elif type(arg) is p4_expression:
-                        if param_type in {int, long}:
-                            populated_arg = arg
-                    else:
-                        try:
-                            populated_arg = param_type.get_from_hlir(hlir, arg)
-                        except Exception:
-                            pass
+                if cache is None:
+                    populated_arg = _populate_arg(hlir, param_types, arg)
+                else:
+                    resolved = cache.populated_args.get( (self, param) )
+                    if resolved is None:
+                        resolved = cache.populated_args[(self, param)] = {}
+                    try:
+                        populated_arg = resolved[(type(arg), arg)]
+                    except KeyError:
+                        populated_arg = _populate_arg(hlir, param_types, arg)
+                        resolved[(type(arg), arg)] = populated_arg
+                    except TypeError:
+                        # unhashable argument
+                        populated_arg = _populate_arg(hlir, param_types, arg)
 
                 if populated_arg == None:
                     if arg == p4_table_entry_data:
@@ -260,11 +397,13 @@ class p4_action (p4_object):
                                     "Illegal reference to direct-mapped counter array '"+counter.name+"' in action '"+binding_action+"'",
                                     filename, lineno
                                 )
-                            elif counter.binding[0] == p4_stateful.P4_STATIC and counter.binding[1] != calling_table:
-                                raise p4_compiler_msg (
-                                    "Illegal reference to counter array '"+counter.name+"' in action '"+binding_action+"' called by table '"+calling_table.name+"' (counter is statically mapped to table '"+counter.binding[1].name+"')",
-                                    filename, lineno
-                                )
+                            elif counter.binding[0] == p4_stateful.P4_STATIC:
+                                uses_table = True
+                                if counter.binding[1] != calling_table:
+                                    raise p4_compiler_msg (
+                                        "Illegal reference to counter array '"+counter.name+"' in action '"+binding_action+"' called by table '"+calling_table.name+"' (counter is statically mapped to table '"+counter.binding[1].name+"')",
+                                        filename, lineno
+                                    )
 
                     # Replace the original argument value with the resolved
                     # object reference
@@ -286,7 +425,10 @@ class p4_action (p4_object):
                             populated_args.append(args[arg.idx])
                         else:
                             populated_args.append((self.name,idx,arg_idx,arg))
-                    call_target.validate_types(hlir, calling_table, populated_args, called_actions)
+                    if call_target.validate_types(hlir, calling_table,
+                                                  populated_args,
+                                                  called_actions, cache):
+                        uses_table = True
                 else:
                     if call_target.required_params == len(call_target.signature):
                         req_param_str = str(call_target.required_params)
@@ -300,23 +442,41 @@ class p4_action (p4_object):
         if len(self.call_sequence) > 0 and len(args_used) != len(self.signature):
             p4_compiler_msg(
                 "Unused arguments in '"+self.name+"'", self.filename, self.lineno, logging.WARNING)
+        return uses_table
+
+def p4_action_validate_types(hlir, actions = None):
+    """
+    Validates the types of the arguments of the actions used by the tables,
+    flattens the actions and resolves the names in their expressions. If
+    'actions' is given, only these actions are processed.
+    """
+    if actions is not None:
+        actions = set(actions)
 
-def p4_action_validate_types(hlir):
     called_actions = set()
+    cache = _validation_cache()
     for table_name in hlir.p4_tables:
         table = hlir.p4_tables[table_name]
         for action in table.actions:
+            if actions is not None and action not in actions: continue
             action.validate_types(
                 hlir,
                 table,
                 [(table.name, None, None, p4_table_entry_data)]*len(action.signature),
-                called_actions
+                called_actions,
+                cache
             )
 
-    for action in hlir.p4_actions.values():
-        action.flatten(hlir)
+    if actions is None:
+        actions = hlir.p4_actions.values()
+    else:
+        actions = [action for action in hlir.p4_actions.values()
+                   if action in actions]
+    expansions = {}
+    for action in actions:
+        action.flatten(hlir, expansions)
 
-    for action in hlir.p4_actions.values():
+    for action in actions:
         params = {}
         for idx, a in enumerate(action.signature):
             params[a] = p4_signature_ref(idx)
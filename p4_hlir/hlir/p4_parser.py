@@ -59,14 +59,7 @@ class p4_parser_exception (p4_object):
             elif type(metadata_value) is tuple:
                 metadata_value = (metadata_value[1], metadata_value[2])
             elif type(metadata_value) is str:
-                hdr, field = metadata_value.split(".")
-                if hdr == "latest":
-                    metadata_value = p4_field_reference(
-                        hlir, 
-                        self.latest_extraction.name + "." + field
-                    )
-                else:
-                    metadata_value = p4_field_reference(hlir, metadata_value)
+                metadata_value = p4_field_reference(hlir, metadata_value)
             else:
                 assert(False)
 
@@ -158,14 +151,9 @@ class p4_parse_state (p4_object):
                 elif type(metadata_value) is tuple:
                     metadata_value = (metadata_value[0], metadata_value[1])
                 elif type(metadata_value) is str:
-                    hdr, field = metadata_value.split(".")
-                    if hdr == "latest":
-                        metadata_value = p4_field_reference(
-                            hlir, 
-                            self.latest_extraction.name + "." + field
-                        )
-                    else:
-                        metadata_value = p4_field_reference(hlir, metadata_value)
+                    metadata_value = p4_field_reference(
+                        hlir, metadata_value, self.latest_extraction
+                    )
                 elif type(metadata_value) is p4_expression:
                     metadata_value = metadata_value
                     metadata_value.resolve_names(hlir)
@@ -191,13 +179,10 @@ class p4_parse_state (p4_object):
             for field_ref in select_exp:
                 if type(field_ref) is tuple: # current
                     field_ref = (field_ref[0], field_ref[1])
-                elif field_ref[:6] == "latest":
+                elif "." in field_ref:
                     field_ref = p4_field_reference(
-                        hlir,
-                        self.latest_extraction.name + "." + field_ref[7:]
+                        hlir, field_ref, self.latest_extraction
                     )
-                elif "." in field_ref:
-                    field_ref = p4_field_reference(hlir, field_ref)
 
                 self.branch_on.append(field_ref)
             
@@ -48,8 +48,11 @@ class p4_node(p4_object):
 
         self.conditional_barrier = None
 
-        self.dependencies_to = {} # tables to which this table have a dependency
-        self.dependencies_for = {} # tables for which this table is a dependency
+        # computed on demand, see the dependencies_to and dependencies_for
+        # properties
+        self._dependencies_to = {}
+        self._dependencies_for = {}
+        self._analyses = hlir.p4_analyses
 
         # the "default default" next node, according to the original P4 control
         # flow; if a table has not runtime-configured (or compile-time
@@ -62,6 +65,24 @@ class p4_node(p4_object):
 
         hlir.p4_nodes[name] = self
 
+    @property
+    def dependencies_to(self):
+        """
+        tables to which this table have a dependency
+        """
+        if self._analyses is not None:
+            self._analyses.require_dependencies(self)
+        return self._dependencies_to
+
+    @property
+    def dependencies_for(self):
+        """
+        tables for which this table is a dependency
+        """
+        if self._analyses is not None:
+            self._analyses.require_dependencies(self)
+        return self._dependencies_for
+
     def depends_on_step(self, node, visited):
         assert isinstance(node, p4_node)
         visited.add(self)
@@ -130,7 +151,7 @@ class p4_table (p4_node):
             match_field, match_type, match_mask = match
 
             if "." in match_field:
-                match_field = hlir.p4_fields[match_field]
+                match_field = p4_headers.p4_field_reference(hlir, match_field)
             else:
                 match_field = hlir.p4_header_instances[match_field]
 
@@ -423,6 +444,26 @@ def _get_all_conditions(node, conditions):
         pass
     return _get_all_conditions(cb[0], conditions)
 
+def _get_accumulated_conditions(node, cache):
+    """
+    Same as _get_all_conditions(node, []), memoized in 'cache' for the node
+    and for the nodes of its chain of conditional barriers. The lists are
+    shared and must not be modified.
+    """
+    chain = []
+    while node and node.conditional_barrier and node not in cache:
+        chain.append(node)
+        node = node.conditional_barrier[0]
+    conditions = cache.get(node, [])
+    for node in reversed(chain):
+        cb = node.conditional_barrier
+        try:
+            conditions = [(cb[0].condition, cb[1])] + conditions
+        except AttributeError:
+            pass
+        cache[node] = conditions
+    return conditions
+
 def _set_modified_hdrs(hlir, entry_point, modified_hdrs):
     if not entry_point: return
     try:
@@ -452,7 +493,9 @@ def _find_unused_nodes_step(entry_point):
 
 def _find_conditional_barrier(entry_point, node, visited):
     def sorted_tuple_from_set(s):
-        return tuple(sorted(list(s)))
+        # sorted by name (the actions), not by address, so that the result
+        # is the same for every build
+        return tuple(sorted(list(s), key = str))
 
     if entry_point in visited: return visited[entry_point]
     if entry_point == node:
@@ -592,6 +635,8 @@ def _purge_unused_nodes(hlir):
             print node, "is unused, removing it"
             name = node.name
             del hlir.p4_nodes[name]
+            if hlir.p4_pragma_index is not None:
+                hlir.p4_pragma_index.remove(node)
             try:
                 del hlir.p4_tables[name]
             except KeyError:
@@ -611,25 +656,39 @@ def optimize_table_graph(hlir):
 
     xconds = exclusive_conditions.Solver(hlir)
 
-    change = True
-    # I am being lazy, and this is all tentative anyway
-    while change:
-        change = False
-        for _, p4_node in hlir.p4_nodes.items():
-
-            for a, nt in p4_node.next_.items():
-                conditions = _get_all_conditions(p4_node, [])
-                if a in {True, False}:
-                    conditions += [(p4_node.condition, a)]
-                if isinstance(nt, p4_conditional_node):
-                    cond_value = xconds.evaluate_condition(
-                        nt._modified_hdrs,
-                        nt.condition,
-                        conditions
-                    )
-                    if cond_value is not None:
-                        p4_node.next_[a] = nt.next_[cond_value]
-                        change = True
+    # The conditional nodes whose value is known from the conditions under
+    # which they are reached are bypassed. The edges are examined in sweeps,
+    # in the order of the nodes and of their edges, until none of them is
+    # rewritten. The conditions of an edge only depend on its source, so an
+    # edge which was examined without being rewritten does not change
+    # anymore: every sweep only examines the edges rewritten by the previous
+    # one, which gives the same result as examining all of them.
+    node_conditions = {}
+    edges = [(p4_node, a) for p4_node in hlir.p4_nodes.values()
+             for a in p4_node.next_]
+    iterations = 0
+    rewrites = 0
+    while edges:
+        iterations += 1
+        rewritten = []
+        for p4_node, a in edges:
+            nt = p4_node.next_[a]
+            if not isinstance(nt, p4_conditional_node): continue
+            conditions = _get_accumulated_conditions(p4_node, node_conditions)
+            if a in {True, False}:
+                conditions = conditions + [(p4_node.condition, a)]
+            cond_value = xconds.evaluate_condition(
+                nt._modified_hdrs,
+                nt.condition,
+                conditions
+            )
+            if cond_value is not None:
+                p4_node.next_[a] = nt.next_[cond_value]
+                rewritten.append( (p4_node, a) )
+        rewrites += len(rewritten)
+        edges = rewritten
+    hlir.build_stats["table_graph_iterations"] = iterations
+    hlir.build_stats["table_graph_rewrites"] = rewrites
 
     for _, p4_node in hlir.p4_nodes.items():
         del p4_node._modified_hdrs
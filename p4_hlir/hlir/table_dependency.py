@@ -18,8 +18,10 @@ import time
 from collections import defaultdict
 from dependencies import *
 import itertools
-from analysis_utils import retrieve_from_one_action, reset_state
+from analysis_utils import retrieve_masks_from_one_action, reset_state, \
+    assign_field_ids, get_field_id, get_subfields_mask, fields_from_mask
 import logging
+from p4_hlir.util.build_context import context_of
 
 """
 This module uses the control flow graph exposed by the HLIR and produces a table
@@ -67,12 +69,12 @@ class rmt_table(object):
         self.p4_table = p4_table
 
         # to figure out the dependencies, we will need the match fields and the
-        # action fields
-        self.match_fields = set()
+        # action fields, as bitmasks (see analysis_utils)
+        self.match_fields = 0
         # action fields only for p4 tables ?
-        self.action_fields = set()
-        self.action_fields_read = set()
-        self.action_fields_write = set()
+        self.action_fields = 0
+        self.action_fields_read = 0
+        self.action_fields_write = 0
 
         # makes sure that a table cannot escape from its conditional block, used
         # to establish SUCCESSOR dependencies
@@ -80,7 +82,7 @@ class rmt_table(object):
         self.conditional_barrier = conditional_barrier
 
     def get_special_fields(self):
-        return set(), set(), set()
+        return 0, 0, 0
 
 # places all fields of a header instance in field_set
 def get_all_subfields(field, field_set):
@@ -103,7 +105,7 @@ class rmt_conditional_table(rmt_table):
 
         self.condition = p4_table.condition
 
-        self.match_fields = self.p4_table.retrieve_match_fields()
+        self.match_fields = self.p4_table.retrieve_match_mask()
 
 class rmt_p4_table(rmt_table):
     def __init__(self, p4_table, conditional_barrier = None):
@@ -114,32 +116,32 @@ class rmt_p4_table(rmt_table):
         self.min_size = p4_table.min_size
         self.max_size = p4_table.max_size
 
-        self.match_fields = self.p4_table.retrieve_match_fields()
+        self.match_fields = self.p4_table.retrieve_match_mask()
 
         self._retrieve_action_fields()
 
         r, w, a = self.get_special_fields()
-        self.action_fields_read.update(r)
-        self.action_fields_write.update(w)
-        self.action_fields.update(a)
+        self.action_fields_read |= r
+        self.action_fields_write |= w
+        self.action_fields |= a
 
     # not really needed any more
     def _retrieve_action_fields(self):
         for action in self.p4_table.actions:
-            r, w, a = retrieve_from_one_action(action)
-            self.action_fields_read.update(r)
-            self.action_fields_write.update(w)
-            self.action_fields.update(a)
+            r, w, a = retrieve_masks_from_one_action(action)
+            self.action_fields_read |= r
+            self.action_fields_write |= w
+            self.action_fields |= a
 
     def get_action_fields(self):
         return self.action_fields_read, self.action_fields_write, self.action_fields
 
     def get_special_fields(self):
-        r, w, a = set(), set(), set()
+        r, w, a = 0, 0, 0
         for p4_meter in self.p4_table.attached_meters:
             if p4_meter.binding and (p4_meter.binding[0] == p4.P4_DIRECT):
-                w.add(p4_meter.result)
-                a.add(p4_meter.result)
+                w |= get_subfields_mask(p4_meter.result)
+                a |= get_subfields_mask(p4_meter.result)
         return r, w, a
 
 
@@ -156,9 +158,9 @@ class rmt_table_dependency():
         # associated with a table (parent table, i.e. from), but with the
         # dependency (or edge) itself.
         self.action_set = action_set
-        self.action_fields_read = set()
-        self.action_fields_write = set()
-        self.action_fields = set()
+        self.action_fields_read = 0
+        self.action_fields_write = 0
+        self.action_fields = 0
         # special "hit" "miss" case
         if action_set and ("hit" in action_set or "miss" in action_set):            
             (self.action_fields_read,
@@ -166,18 +168,18 @@ class rmt_table_dependency():
              self.action_fields) = self.from_.get_action_fields()
         elif action_set:
             for action in action_set:
-                r, w, a = retrieve_from_one_action(action)
-                self.action_fields_read.update(r)
-                self.action_fields_write.update(w)
-                self.action_fields.update(a)
+                r, w, a = retrieve_masks_from_one_action(action)
+                self.action_fields_read |= r
+                self.action_fields_write |= w
+                self.action_fields |= a
 
         r, w, a = self.from_.get_special_fields()
-        self.action_fields_read.update(r)
-        self.action_fields_write.update(w)
-        self.action_fields.update(a)
+        self.action_fields_read |= r
+        self.action_fields_write |= w
+        self.action_fields |= a
 
-        # fields that induce the dependency
-        self.fields = {}
+        # fields that induce the dependency, as a bitmask
+        self.fields = 0
 
         # for conditional dependencies
         self.cond = None
@@ -192,25 +194,25 @@ class rmt_table_dependency():
         if self.type_ == Dependency.MATCH:
             return MatchDep(self.from_.p4_table,
                             self.to.p4_table,
-                            self.fields)
+                            fields_from_mask(self.fields))
         elif self.type_ == Dependency.ACTION:
             return ActionDep(self.from_.p4_table,
                              self.to.p4_table,
-                             self.fields)
+                             fields_from_mask(self.fields))
         elif self.type_ == Dependency.SUCCESSOR:
             return SuccessorDep(self.from_.p4_table,
                                 self.to.p4_table,
-                                self.fields,
+                                fields_from_mask(self.fields),
                                 self.cond)
         elif self.type_ == Dependency.PREDICATION:
             return SuccessorDep(self.from_.p4_table,
                                 self.to.p4_table,
-                                self.fields,
+                                fields_from_mask(self.fields),
                                 self.cond)
         elif self.type_ == Dependency.REVERSE_READ:
             return ReverseReadDep(self.from_.p4_table,
                                   self.to.p4_table,
-                                  self.fields)
+                                  fields_from_mask(self.fields))
         else:
             return None
 
@@ -305,10 +307,11 @@ class rmt_table_graph():
             self.root = table_rmt
 
     def field_used(self, field, root, exclude_set = set()):
+        field_mask = 1 << get_field_id(field)
         for next_control_table in root.next_tables_control:
             if next_control_table in exclude_set: continue
-            if field in next_control_table.match_fields or\
-               field in next_control_table.action_fields:
+            if (next_control_table.match_fields |
+                next_control_table.action_fields) & field_mask:
                 return True
             if self.field_used(field, next_control_table): return True
         return False
@@ -456,8 +459,9 @@ class rmt_table_graph():
         assert( self.validate() )
             
 
-    # called after building the graph to resolve dependencies
-    def resolve_dependencies(self):
+    # called after building the graph to resolve dependencies; if changed_nodes
+    # is given, only the dependencies from and to these p4 nodes are resolved
+    def resolve_dependencies(self, changed_nodes = None):
         assert( self.validate() )
 
         # We start by resolving the dependencies we have (CONTROL_FLOW) then we
@@ -474,17 +478,25 @@ class rmt_table_graph():
         def resolve_rec(root_table, table, visited, action_set = None):
             if table in visited: return
             visited.add(table)
-            new_dependency = rmt_table_dependency(root_table, table,
-                                                  action_set = action_set)
-            type_ = new_dependency.resolve_type()
-            if type_ != Dependency.NOP:
-                root_table.next_tables[table] = new_dependency
-                table.incoming[root_table] = new_dependency
+            if changed_nodes is None or\
+               root_table.p4_table in changed_nodes or\
+               table.p4_table in changed_nodes:
+                new_dependency = rmt_table_dependency(root_table, table,
+                                                      action_set = action_set)
+                type_ = new_dependency.resolve_type()
+                if type_ != Dependency.NOP:
+                    root_table.next_tables[table] = new_dependency
+                    table.incoming[root_table] = new_dependency
             for next_table in table.next_tables_control:
                 resolve_rec(root_table, next_table, visited, action_set)
 
+        # when a table is reachable through several of the edges of a root
+        # table, the dependency found through the last one is kept: the edges
+        # are visited in a fixed order (not in the order of the addresses of
+        # the tables), so that the result is the same for every build
         for table in self._nodes.values():
-            for dependency in table.next_tables.values():
+            for dependency in sorted(table.next_tables.values(),
+                                     key = lambda d: d.to.name):
                 next_table = dependency.to
                 visited = set()
                 resolve_rec(table, next_table, visited, dependency.action_set)
@@ -539,9 +551,13 @@ class rmt_table_graph():
                           " " + edge_label + "]" + ";\n")
         out.write("}\n")
 
-    def annotate_hlir(self):
+    def annotate_hlir(self, changed_nodes = None):
         for table in self._nodes.values():
             for dependency in table.next_tables.values():
+                if changed_nodes is not None and\
+                   dependency.from_.p4_table not in changed_nodes and\
+                   dependency.to.p4_table not in changed_nodes:
+                    continue
                 dep = dependency.get_p4_dep()
                 if not dep: continue # control flow...
                 dep.from_.dependencies_for[dep.to] = dep
@@ -597,23 +613,27 @@ def parse_p4_table_graph(table_graph, p4_node,
         print type(p4_node)
         assert(False)
 
-def rmt_build_table_graph(name, entry):
+def rmt_build_table_graph(name, entry, changed_nodes = None):
     table_graph = rmt_table_graph()
     dummy_table = table_graph.add_dummy_table(name)
     parse_p4_table_graph(table_graph, entry,
                          parent = dummy_table)
     table_graph.resolve_cbs()
     assert( table_graph.validate() )
-    table_graph.resolve_dependencies()
+    table_graph.resolve_dependencies(changed_nodes)
     return table_graph
 
 # returns a rmt_table_graph object for ingress
-def rmt_build_table_graph_ingress(hlir):
-    return rmt_build_table_graph("ingress", hlir.p4_ingress_ptr.keys()[0])
+def rmt_build_table_graph_ingress(hlir, changed_nodes = None):
+    with context_of(hlir).activate():
+        return rmt_build_table_graph("ingress", hlir.p4_ingress_ptr.keys()[0],
+                                     changed_nodes)
 
 # returns a rmt_table_graph object for egress
-def rmt_build_table_graph_egress(hlir):
-    return rmt_build_table_graph("egress", hlir.p4_egress_ptr)
+def rmt_build_table_graph_egress(hlir, changed_nodes = None):
+    with context_of(hlir).activate():
+        return rmt_build_table_graph("egress", hlir.p4_egress_ptr,
+                                     changed_nodes)
 
 def rmt_gen_dot_table_graph_ingress(out):
     table_graph = rmt_build_table_graph_ingress()
@@ -629,32 +649,41 @@ def rmt_gen_dot_table_graph_egress(out):
                                  with_condition_str = True,
                                  debug = True)
 
-def annotate_hlir(hlir):
+def annotate_pipeline(hlir, pipeline, changed_nodes = None):
+    """
+    Annotates the nodes of the 'ingress' or 'egress' pipeline with their
+    dependencies. If 'changed_nodes' is given, only the dependencies from and
+    to these nodes are computed (and added), the other ones are left as they
+    are.
+    """
+    if pipeline == "egress" and hlir.p4_egress_ptr is None:
+        return
+
     reset_state(include_valid = True)
+    assign_field_ids(hlir)
 
-    for ingress_ptr in hlir.p4_ingress_ptr:
-        ingress_graph = rmt_build_table_graph_ingress(hlir)
-        if hlir.analysis_args.get('do_transitive_reduction', False):
-            time1 = time.time()
-            ingress_graph.transitive_reduction()
-            time2 = time.time()
-            print('transitive reduction on ingress dependency graph'
-                  ' took %.1f sec' % (time2 - time1))
-        else:
-            print('skipping transitive reduction on ingress dependency graph')
-        ingress_graph.annotate_hlir()
+    if pipeline == "ingress":
+        num_graphs = len(hlir.p4_ingress_ptr)
+        build_graph = rmt_build_table_graph_ingress
+    else:
+        num_graphs = 1
+        build_graph = rmt_build_table_graph_egress
 
-    if hlir.p4_egress_ptr is not None:
-        egress_graph = rmt_build_table_graph_egress(hlir)
+    for _ in range(num_graphs):
+        graph = build_graph(hlir, changed_nodes)
         if hlir.analysis_args.get('do_transitive_reduction', False):
             time1 = time.time()
-            egress_graph.transitive_reduction()
+            graph.transitive_reduction()
             time2 = time.time()
-            print('transitive reduction on egress dependency graph'
-                  ' took %.1f sec' % (time2 - time1))
+            print('transitive reduction on %s dependency graph'
+                  ' took %.1f sec' % (pipeline, time2 - time1))
         else:
-            print('skipping transitive reduction on egress dependency graph')
-        egress_graph.annotate_hlir()
+            print('skipping transitive reduction on %s dependency graph' %
+                  pipeline)
+        graph.annotate_hlir(changed_nodes)
 
     reset_state(include_valid = False)
 
+def annotate_hlir(hlir):
+    annotate_pipeline(hlir, "ingress")
+    annotate_pipeline(hlir, "egress")
@@ -0,0 +1,504 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Streaming JSON export of a built HLIR, for backends written in other languages
+(see 'p4-validate --emit-json').
+
+The export is written to a file object one record at a time, it is never built
+in memory. Two formats are available:
+
+  - a JSON document (the default):
+      {"schema_version": 1, "program": {...},
+       "headers": [...], "header_instances": [...], "fields": [...], ...}
+    with one key per section, in the order of SECTIONS below;
+  - JSON Lines: one record per line, the "program" record first, then the
+    records of each section in the same order.
+
+Every record has a "type" (the section name in the singular, e.g. "field")
+and, except for the "program" record, an "id": an integer which is unique in
+the export. Ids are assigned in the order in which the records are written,
+which only depends on the program, so they are stable from one export of the
+same program to the next. Records refer to each other by id: attributes which
+always hold a reference (e.g. the "instance" of a field) are plain ids, and
+values which may or may not be references (action arguments, expression
+operands, parser branch cases...) are encoded as follows:
+
+  - None, booleans, integers and strings as themselves;
+  - a reference to an object as {"ref": id};
+  - an action parameter as {"param": index};
+  - an expression as {"op": operator, "left": value, "right": value};
+  - the "current(offset, width)" parser construct as {"current": [o, w]};
+  - a list or a tuple as a list of values;
+  - enumerated constants (match types, P4_DEFAULT...) as their name.
+
+The records (attributes not described are copied from the HLIR objects):
+
+  program: schema_version, ingress_entry_points ([[node id, [parse state
+      ids]], ...]), egress_entry_point (node id or null)
+  header: name, layout ([[field name, width], ...]), attributes ({field name:
+      [attribute, ...]}), length, max_length, flex_width, pragmas
+  header_instance: name, base_name, header_type, metadata, index, max_index,
+      virtual, fields, pragmas
+  field: name, instance, width, offset, default, attributes, ingress_read,
+      ingress_write, egress_read, egress_write, calculation ([[op, field list
+      calculation id, condition], ...])
+  field_list: name, fields (values)
+  field_list_calculation: name, input (field list ids), algorithm,
+      output_width
+  parse_value_set: name, max_size
+  parser_exception: name, set_statements, return_or_drop
+  parse_state: name, call_sequence ([["extract", instance], ["set", field,
+      value], ...]), branch_on, branch_to ([[case, target], ...]), pragmas
+  counter, meter, register: name, binding ([type, table id] or null) and the
+      other attributes of the declaration
+  action: name, signature, signature_widths, call_sequence ([[action id,
+      [argument, ...]], ...]), flat_call_sequence ([[primitive action id,
+      [argument, ...], [[action id, call index], ...]], ...]), pragmas
+  action_profile: name, actions, size, selector
+  action_selector: name, selection_key, selection_mode, selection_type
+  control_flow: name
+  conditional_node: name, condition, next_ ([[true or false, node id or
+      null], ...]), conditional_barrier ([node id, value] or null),
+      base_default_next, control_flow_parent
+  table: name, match_fields ([[field or instance, match type, mask], ...]),
+      actions, next_ ([[action ref or "hit" or "miss", node id or null],
+      ...]),
+      default_action, action_default_only, min_size, max_size, size,
+      support_timeout, action_profile, attached_counters, attached_meters,
+      attached_registers, conditional_barrier, base_default_next,
+      control_flow_parent, pragmas
+  dependency: from, to (node ids), dependency_type ("REVERSE_READ",
+      "SUCCESSOR", "ACTION" or "MATCH"), fields (field ids, and
+      "<instance>._valid" for the validity of a header when the analyses take
+      it into account), value (for SUCCESSOR dependencies)
+"""
+
+import json
+
+from p4_hlir.util.startup import lazy_import
+
+p4 = lazy_import("p4_hlir.hlir.p4")
+_dependencies = lazy_import("p4_hlir.hlir.dependencies")
+
+# Bump this whenever records or attributes are removed or change meaning
+JSON_SCHEMA_VERSION = 1
+
+# (section, HLIR attribute), in the order in which ids are assigned and
+# sections are written; the fields and the dependencies are special cases
+SECTIONS = [
+    ("headers", "p4_headers"),
+    ("header_instances", "p4_header_instances"),
+    ("fields", None),
+    ("field_lists", "p4_field_lists"),
+    ("field_list_calculations", "p4_field_list_calculations"),
+    ("parse_value_sets", "p4_parse_value_sets"),
+    ("parser_exceptions", "p4_parser_exceptions"),
+    ("parse_states", "p4_parse_states"),
+    ("counters", "p4_counters"),
+    ("meters", "p4_meters"),
+    ("registers", "p4_registers"),
+    ("actions", "p4_actions"),
+    ("action_profiles", "p4_action_profiles"),
+    ("action_selectors", "p4_action_selectors"),
+    ("control_flows", "p4_control_flows"),
+    ("conditional_nodes", "p4_conditional_nodes"),
+    ("tables", "p4_tables"),
+    ("dependencies", None),
+]
+
+_DEPENDENCY_TYPES = {}
+
+def _dependency_type_name(dependency_type):
+    if not _DEPENDENCY_TYPES:
+        Dep = _dependencies.Dep
+        _DEPENDENCY_TYPES.update({Dep.REVERSE_READ: "REVERSE_READ",
+                                  Dep.SUCCESSOR: "SUCCESSOR",
+                                  Dep.ACTION: "ACTION",
+                                  Dep.MATCH: "MATCH"})
+    return _DEPENDENCY_TYPES[dependency_type]
+
+class P4JsonExporter(object):
+    """
+    Writes the JSON export of a built HLIR to a file object, see the
+    documentation of this module for the format
+    """
+    def __init__(self, hlir, f, lines = False):
+        self.hlir = hlir
+        self.f = f
+        self.lines = lines
+        # id(object) -> id in the export, for every object but the fields
+        # and the dependencies
+        self.ids = {}
+        # id(header instance) -> id of its first field
+        self.first_field_ids = {}
+        # id(field) -> id in the export, the fields of an instance have
+        # consecutive ids
+        self.field_ids = {}
+        self.num_ids = 0
+        self._assign_ids()
+        self._section_started = False
+        self._first_record = True
+        # json.dumps() would create an encoder for every record (sorting the
+        # keys would prevent the use of the C encoder)
+        self._encode = json.JSONEncoder().encode
+
+    def _assign_ids(self):
+        for section, attr in SECTIONS:
+            if section == "fields":
+                for instance in self.hlir.p4_header_instances.values():
+                    self.first_field_ids[id(instance)] = self.num_ids
+                    for field in instance.fields:
+                        self.field_ids[id(field)] = self.num_ids
+                        self.num_ids += 1
+            elif attr is not None:
+                for obj in getattr(self.hlir, attr).values():
+                    self.ids[id(obj)] = self.num_ids
+                    self.num_ids += 1
+
+    def get_id(self, obj):
+        """
+        The id of an HLIR object in the export, None if it is not exported
+        """
+        if type(obj) is p4.p4_field:
+            return self.field_ids.get(id(obj))
+        return self.ids.get(id(obj))
+
+    def _ref(self, obj):
+        return None if obj is None else self.get_id(obj)
+
+    def value(self, value):
+        """
+        Encodes a value which may be a reference, see the documentation of
+        this module
+        """
+        if value is None or type(value) is bool:
+            return value
+        if isinstance(value, (int, long)):
+            return int(value) if type(value) is not long else value
+        if isinstance(value, basestring):
+            return value
+        if isinstance(value, p4.p4_enum):
+            return str(value)
+        if isinstance(value, p4.p4_signature_ref):
+            return {"param": value.idx}
+        if isinstance(value, p4.p4_expression):
+            return {"op": value.op, "left": self.value(value.left),
+                    "right": self.value(value.right)}
+        if isinstance(value, (list, tuple)):
+            return [self.value(v) for v in value]
+        if isinstance(value, (set, frozenset)):
+            return sorted(self.value(v) for v in value)
+        obj_id = self.get_id(value)
+        if obj_id is not None:
+            return {"ref": obj_id}
+        return str(value)
+
+    def _write_record(self, section, record):
+        if self.lines:
+            self.f.write(self._encode(record))
+            self.f.write("\n")
+            return
+        if not self._section_started:
+            self.f.write(', "%s": [\n' % section)
+            self._section_started = True
+            self._first_record = True
+        if not self._first_record:
+            self.f.write(",\n")
+        self._first_record = False
+        self.f.write(self._encode(record))
+
+    def _end_section(self, section):
+        if self.lines:
+            return
+        if not self._section_started:
+            self.f.write(', "%s": []' % section)
+        else:
+            self.f.write("\n]")
+        self._section_started = False
+
+    def export(self):
+        program = self.program_record()
+        if self.lines:
+            self._write_record("program", program)
+        else:
+            self.f.write('{"schema_version": %d, "program": %s'
+                         % (JSON_SCHEMA_VERSION,
+                            self._encode(program)))
+        for section, attr in SECTIONS:
+            for record in getattr(self, "_records_" + section)():
+                self._write_record(section, record)
+            self._end_section(section)
+        if not self.lines:
+            self.f.write("}\n")
+
+    def program_record(self):
+        hlir = self.hlir
+        ingress = [[self.get_id(node),
+                    sorted(self.get_id(state) for state in states)]
+                   for node, states in hlir.p4_ingress_ptr.items()]
+        ingress.sort()
+        return {"type": "program",
+                "schema_version": JSON_SCHEMA_VERSION,
+                "ingress_entry_points": ingress,
+                "egress_entry_point": self._ref(hlir.p4_egress_ptr)}
+
+    def _object_record(self, record_type, obj, pragmas = False):
+        record = {"type": record_type, "id": self.get_id(obj),
+                  "name": obj.name}
+        if pragmas:
+            record["pragmas"] = sorted(getattr(obj, "_pragmas", ()))
+        return record
+
+    def _records_headers(self):
+        for header in self.hlir.p4_headers.values():
+            record = self._object_record("header", header, pragmas = True)
+            record["layout"] = [[name, self.value(width)]
+                                for name, width in header.layout.items()]
+            record["attributes"] = dict(
+                (name, sorted(str(a) for a in attrs))
+                for name, attrs in header.attributes.items()
+            )
+            record["length"] = self.value(getattr(header, "length", None))
+            record["max_length"] = self.value(getattr(header, "max_length",
+                                                      None))
+            record["flex_width"] = header.flex_width
+            yield record
+
+    def _records_header_instances(self):
+        for instance in self.hlir.p4_header_instances.values():
+            record = self._object_record("header_instance", instance,
+                                         pragmas = True)
+            first_id = self.first_field_ids[id(instance)]
+            record.update({
+                "base_name": instance.base_name,
+                "header_type": self._ref(instance.header_type),
+                "metadata": instance.metadata,
+                "index": self.value(instance.index),
+                "max_index": instance.max_index,
+                "virtual": instance.virtual,
+                "fields": range(first_id, first_id + len(instance.fields)),
+            })
+            yield record
+
+    def _records_fields(self):
+        for instance in self.hlir.p4_header_instances.values():
+            instance_id = self.get_id(instance)
+            field_id = self.first_field_ids[id(instance)]
+            for field in instance.fields:
+                yield {
+                    "type": "field", "id": field_id, "name": field.name,
+                    "instance": instance_id,
+                    "width": self.value(field.width),
+                    "offset": self.value(field.offset),
+                    "default": self.value(field.default),
+                    "attributes": sorted(str(a) for a in field.attributes),
+                    "ingress_read": field.ingress_read,
+                    "ingress_write": field.ingress_write,
+                    "egress_read": field.egress_read,
+                    "egress_write": field.egress_write,
+                    "calculation": [[op, self._ref(calc), self.value(cond)]
+                                    for op, calc, cond in field.calculation],
+                }
+                field_id += 1
+
+    def _records_field_lists(self):
+        for field_list in self.hlir.p4_field_lists.values():
+            record = self._object_record("field_list", field_list)
+            record["fields"] = self.value(field_list.fields)
+            yield record
+
+    def _records_field_list_calculations(self):
+        for calc in self.hlir.p4_field_list_calculations.values():
+            record = self._object_record("field_list_calculation", calc)
+            record["input"] = [self._ref(l) for l in calc.input]
+            record["algorithm"] = calc.algorithm
+            record["output_width"] = calc.output_width
+            yield record
+
+    def _records_parse_value_sets(self):
+        for value_set in self.hlir.p4_parse_value_sets.values():
+            record = self._object_record("parse_value_set", value_set)
+            record["max_size"] = value_set.max_size
+            yield record
+
+    def _records_parser_exceptions(self):
+        for exception in self.hlir.p4_parser_exceptions.values():
+            record = self._object_record("parser_exception", exception)
+            record["set_statements"] = self.value(exception.set_statements)
+            record["return_or_drop"] = self.value(exception.return_or_drop)
+            yield record
+
+    def _parser_value(self, value):
+        # (offset, width) tuples stand for current(offset, width)
+        if type(value) is tuple:
+            return {"current": list(value)}
+        return self.value(value)
+
+    def _records_parse_states(self):
+        for state in self.hlir.p4_parse_states.values():
+            record = self._object_record("parse_state", state, pragmas = True)
+            call_sequence = []
+            for call in state.call_sequence:
+                call_sequence.append(
+                    [str(call[0])] + [self._parser_value(v) for v in call[1:]]
+                )
+            record["call_sequence"] = call_sequence
+            record["branch_on"] = [self._parser_value(v)
+                                   for v in state.branch_on]
+            record["branch_to"] = [[self.value(case), self.value(target)]
+                                   for case, target in state.branch_to.items()]
+            yield record
+
+    def _stateful_record(self, record_type, obj, attrs):
+        record = self._object_record(record_type, obj)
+        binding = obj.binding
+        if binding is not None:
+            binding = [str(binding[0]), self._ref(binding[1])]
+        record["binding"] = binding
+        for attr in attrs:
+            record[attr] = self.value(getattr(obj, attr, None))
+        return record
+
+    def _records_counters(self):
+        for counter in self.hlir.p4_counters.values():
+            yield self._stateful_record(
+                "counter", counter,
+                ["type", "instance_count", "min_width", "saturating"]
+            )
+
+    def _records_meters(self):
+        for meter in self.hlir.p4_meters.values():
+            yield self._stateful_record(
+                "meter", meter, ["type", "instance_count", "result"]
+            )
+
+    def _records_registers(self):
+        for register in self.hlir.p4_registers.values():
+            record = self._stateful_record(
+                "register", register,
+                ["width", "instance_count", "signed", "saturating"]
+            )
+            record["layout"] = self._ref(register.layout)
+            yield record
+
+    def _records_actions(self):
+        for action in self.hlir.p4_actions.values():
+            record = self._object_record("action", action, pragmas = True)
+            record["signature"] = list(action.signature)
+            record["signature_widths"] = list(action.signature_widths)
+            record["call_sequence"] = [
+                [self._ref(call[0]), self.value(call[1])]
+                for call in action.call_sequence
+            ]
+            record["flat_call_sequence"] = [
+                [self._ref(call[0]), self.value(call[1]),
+                 [[self._ref(a), idx] for a, idx in call[2]]]
+                for call in action.flat_call_sequence or []
+            ]
+            yield record
+
+    def _records_action_profiles(self):
+        for profile in self.hlir.p4_action_profiles.values():
+            record = self._object_record("action_profile", profile)
+            record["actions"] = [self._ref(a) for a in profile.actions]
+            record["size"] = profile.size
+            record["selector"] = self._ref(profile.selector)
+            yield record
+
+    def _records_action_selectors(self):
+        for selector in self.hlir.p4_action_selectors.values():
+            record = self._object_record("action_selector", selector)
+            record["selection_key"] = self._ref(selector.selection_key)
+            for attr in ["selection_mode", "selection_type"]:
+                record[attr] = self.value(getattr(selector, attr, None))
+            yield record
+
+    def _records_control_flows(self):
+        for control_flow in self.hlir.p4_control_flows.values():
+            yield self._object_record("control_flow", control_flow)
+
+    def _node_record(self, record_type, node):
+        record = self._object_record(record_type, node, pragmas = True)
+        record["next_"] = [[self.value(key), self._ref(next_node)]
+                           for key, next_node in node.next_.items()]
+        barrier = node.conditional_barrier
+        if barrier is not None:
+            barrier = [self._ref(barrier[0]), self.value(barrier[1])]
+        record["conditional_barrier"] = barrier
+        record["base_default_next"] = self._ref(node.base_default_next)
+        record["control_flow_parent"] = node.control_flow_parent
+        return record
+
+    def _records_conditional_nodes(self):
+        for node in self.hlir.p4_conditional_nodes.values():
+            record = self._node_record("conditional_node", node)
+            record["condition"] = self.value(node.condition)
+            yield record
+
+    def _records_tables(self):
+        for table in self.hlir.p4_tables.values():
+            record = self._node_record("table", table)
+            record["match_fields"] = [
+                [self._ref(field), str(match_type), self.value(mask)]
+                for field, match_type, mask in table.match_fields
+            ]
+            record["actions"] = [self._ref(a) for a in table.actions]
+            default_action = table.default_action
+            if default_action is not None:
+                default_action = [self._ref(default_action[0]),
+                                  self.value(default_action[1])]
+            record["default_action"] = default_action
+            record["action_profile"] = self._ref(table.action_profile)
+            for attr in ["min_size", "max_size", "size"]:
+                record[attr] = getattr(table, attr, None)
+            record["support_timeout"] = table.support_timeout
+            record["action_default_only"] = table.action_default_only
+            for attr in ["attached_counters", "attached_meters",
+                         "attached_registers"]:
+                record[attr] = [self._ref(o) for o in getattr(table, attr)]
+            yield record
+
+    def _dependency_field(self, field):
+        field_id = self.get_id(field)
+        # validity pseudo fields are not exported
+        return field_id if field_id is not None else str(field)
+
+    def _records_dependencies(self):
+        dep_id = self.num_ids
+        for node in self.hlir.p4_nodes.values():
+            from_id = self.get_id(node)
+            # dependencies_for is keyed by node, sort it for stable ids
+            deps = sorted((self.get_id(to), dep)
+                          for to, dep in node.dependencies_for.items())
+            for to_id, dep in deps:
+                record = {
+                    "type": "dependency", "id": dep_id,
+                    "from": from_id, "to": to_id,
+                    "dependency_type":
+                        _dependency_type_name(dep.dependency_type),
+                    "fields": sorted(self._dependency_field(f)
+                                     for f in dep.fields),
+                }
+                if hasattr(dep, "value"):
+                    record["value"] = self.value(dep.value)
+                yield record
+                dep_id += 1
+
+def export(hlir, f, lines = False):
+    """
+    Writes the JSON export of 'hlir', which must have been built, to the file
+    object 'f': a JSON document, or JSON Lines if 'lines' is True
+    """
+    P4JsonExporter(hlir, f, lines).export()
@@ -13,22 +13,50 @@
 # limitations under the License.
 
 import os
-from frontend.tokenizer import *
-from frontend.parser import *
-from frontend.preprocessor import Preprocessor, PreprocessorException
-from frontend.semantic_check import P4SemanticChecker
-from frontend.dumper import P4HlirDumper
-from frontend.ast import P4Program
 from collections import OrderedDict
-import hlir.p4 as p4
 import itertools
 import logging
-import json
-import pkg_resources
+import sys
+from cStringIO import StringIO
+
+from p4_hlir.util.startup import lazy_import
+from p4_hlir.util.build_context import P4BuildContext, \
+    show_last_build_messages
+from frontend.primitives import PrimitivesView
+
+# The frontend and the HLIR modules are only imported when a program is built,
+# so that importing this module (e.g. to run 'p4-validate --help') is fast
+_preprocessor = lazy_import("p4_hlir.frontend.preprocessor")
+_parser = lazy_import("p4_hlir.frontend.parser")
+_incremental_parser = lazy_import("p4_hlir.frontend.incremental_parser")
+_semantic_check = lazy_import("p4_hlir.frontend.semantic_check")
+_dumper = lazy_import("p4_hlir.frontend.dumper")
+_ast = lazy_import("p4_hlir.frontend.ast")
+p4 = lazy_import("p4_hlir.hlir.p4")
+_rebuild = lazy_import("p4_hlir.rebuild")
+multiprocessing = lazy_import("multiprocessing")
 
 logger = logging.getLogger(__name__)
 
-class HLIR():
+class P4VariantResult(object):
+    """
+    Outcome of the build of one variant, see HLIR.build_variants()
+    """
+    def __init__(self, preprocessor_args):
+        self.preprocessor_args = preprocessor_args
+        self.success = False
+        # what the build printed, i.e. its diagnostics
+        self.output = ""
+        self.build_stats = OrderedDict()
+        # index of the variant whose build is shared by this one, because
+        # their preprocessed sources are identical
+        self.same_as = None
+
+    def __repr__(self):
+        return "P4VariantResult(%r, success=%r)" % (self.preprocessor_args,
+                                                   self.success)
+
+class HLIR(object):
     def __init__(self, *args):
         self.source_files = [] + list(args)
         self.source_txt = []
@@ -36,6 +64,29 @@ class HLIR():
         self.analysis_args = {}
         self.primitives = []
 
+        self._init_objects()
+
+        # absolute paths of the files the program was built from, including
+        # the ones it includes
+        self.source_dependencies = []
+
+        # statistics about the last call to build()
+        self.build_stats = OrderedDict()
+
+        # state of the last call to build(): diagnostics and analysis caches
+        self.context = P4BuildContext()
+
+        # parsed only once per process, each HLIR gets a shallow copy
+        self.primitives = PrimitivesView()
+
+        # fingerprints of the declarations of the last call to rebuild(), see
+        # p4_hlir.rebuild
+        self._declarations = None
+
+    def _init_objects(self):
+        """
+        Creates the (empty) collections of HLIR objects
+        """
         self.p4_objects = []
 
         self.p4_actions = OrderedDict()
@@ -62,10 +113,15 @@ class HLIR():
         self.p4_ingress_ptr = {}
         self.p4_egress_ptr = None
 
-        self.primitives = json.loads(pkg_resources.resource_string('p4_hlir.frontend', 'primitives.json'))
+        # pragma token prefix -> objects, see p4.p4_pragma_index
+        self.p4_pragma_index = None
+
+        # runs the analyses on demand, see p4.p4_analyses
+        self.p4_analyses = None
 
 
     def version(self):
+        import pkg_resources
         return pkg_resources.require("p4-hlir")[0].version
         
     def add_src_files(self, *args):
@@ -83,64 +139,107 @@ class HLIR():
     def add_primitives (self, primitives_dict):
         self.primitives.update(primitives_dict)
 
-    def build(self, optimize=True, analyze=True, dump_preprocessed=False):
-        if len(self.source_files) == 0:
-            print "no source file to process"
-            return False
-
-        # Preprocess all program text
-        preprocessed_sources = []
+    def build(self, optimize=True, analyze=True, dump_preprocessed=False,
+              preprocess_cache=True, preprocessor_backend=None, jobs=1,
+              incremental_parse=False, parse_cache=True):
+        self.build_stats = OrderedDict()
+        self._declarations = None
+        # a new context for every build, so that nothing is left from (and
+        # nothing leaks from) a previous build
+        self.context = P4BuildContext()
         try:
-            preprocessor = Preprocessor()
-            preprocessor.args += self.preprocessor_args
+            with self.context.activate():
+                return self._build(optimize, analyze, dump_preprocessed,
+                                   preprocess_cache, preprocessor_backend,
+                                   jobs, incremental_parse, parse_cache)
+        finally:
+            show_last_build_messages(self.context)
 
-            for p4_source in self.source_files:
-                absolute_source = os.path.join(os.getcwd(), p4_source)
-
-                if not self._check_source_path(absolute_source):
-                    print "Source file '" + p4_source + "' could not be opened or does not exist."
-                    return False
+    def rebuild(self, optimize=True, analyze=True, preprocess_cache=True,
+                preprocessor_backend=None, parse_cache=True):
+        """
+        Builds the program again after its sources were edited, and returns
+        True if the build was successful, like build(). The declarations are
+        parsed with the incremental parser and compared with the ones of the
+        previous call to rebuild(): when only the bodies of actions and the
+        'reads' of tables changed, only these objects and the ones which
+        depend on them are built again, and the dependencies are computed
+        again only for the tables whose fields changed. Otherwise (and the
+        first time), the program is built from scratch. The resulting objects
+        are the same in both cases.
 
-                preprocessed_sources.append(preprocessor.preprocess_file(
-                    absolute_source,
-                    dest='%s.i'%p4_source if dump_preprocessed else None
-                ))
+        If the program has syntax or semantic errors, the objects of the
+        previous build are left untouched.
+        """
+        return _rebuild.rebuild(self, optimize, analyze, preprocess_cache,
+                                preprocessor_backend, parse_cache)
 
-            for p4_txt in self.source_txt:
-                preprocessed_sources.append(preprocessor.preprocess_str(
-                    p4_txt,
-                    dest=None
-                ))
+    def _build(self, optimize, analyze, dump_preprocessed, preprocess_cache,
+               preprocessor_backend, jobs, incremental_parse, parse_cache):
+        if len(self.source_files) == 0:
+            print "no source file to process"
+            return False
 
-        except PreprocessorException as e:
-            print str(e)
+        if jobs is None or jobs <= 0:
+            jobs = multiprocessing.cpu_count()
+        num_sources = len(self.source_files) + len(self.source_txt)
+        if jobs > 1 and num_sources > 1:
+            # the incremental parser cache lives in this process, so it cannot
+            # be used by the worker processes
+            all_p4_objects = self._preprocess_and_parse_parallel(
+                min(jobs, num_sources), dump_preprocessed, preprocess_cache,
+                preprocessor_backend, parse_cache
+            )
+        else:
+            all_p4_objects = self._preprocess_and_parse(
+                dump_preprocessed, preprocess_cache, preprocessor_backend,
+                incremental_parse, parse_cache
+            )
+        if all_p4_objects is None:
             return False
+        return self._build_from_ast(all_p4_objects, optimize, analyze)
 
-        # Parse preprocessed text
-        all_p4_objects = []
-        for preprocessed_source in preprocessed_sources:
-            p4_objects, errors_cnt = P4Parser().parse(preprocessed_source)
-            if errors_cnt > 0:
-                print errors_cnt, "errors during parsing"
-                print "Interrupting compilation"
-                return False
-            all_p4_objects += p4_objects
+    def _build_from_ast(self, all_p4_objects, optimize, analyze):
+        """
+        The steps of build() which follow parsing
+        """
+        p4_program = self._check_ast(all_p4_objects)
+        if p4_program is None:
+            return False
+        return self._build_from_program(p4_program, optimize, analyze)
 
+    def _check_ast(self, all_p4_objects):
+        """
+        Returns the program made of the parsed objects, once semantically
+        checked, or None if it has errors
+        """
         print "parsing successful"
-        p4_program = P4Program("", -1, all_p4_objects)
+        p4_program = _ast.P4Program("", -1, all_p4_objects)
 
         # Semantic checking, round 1
-        sc = P4SemanticChecker()
+        sc = _semantic_check.P4SemanticChecker()
         errors_cnt = sc.semantic_check(p4_program, self.primitives)
+        self.build_stats["semantic_pass_times"] = sc.pass_times
+        for pass_name, pass_time in sc.pass_times.items():
+            logger.debug("semantic pass %s: %.3fs", pass_name, pass_time)
         if errors_cnt > 0:
             print errors_cnt, "errors during semantic checking"
             print "Interrupting compilation"
-            return False
+            return None
         else:
             print "semantic checking successful"
+        return p4_program
+
+    def _build_from_program(self, p4_program, optimize, analyze):
+        """
+        Creates the HLIR objects of a semantically checked program
+        """
+        # The analyses annotate the HLIR objects on demand (see
+        # p4.p4_analyses), the nodes and fields keep a reference to it
+        self.p4_analyses = p4.p4_analyses(self) if analyze else None
 
         # Dump AST to HLIR objects
-        d = P4HlirDumper()
+        d = _dumper.P4HlirDumper()
         d.dump_to_p4(self, p4_program, self.primitives)
 
         # Semantic checking, round 2
@@ -156,16 +255,377 @@ class HLIR():
         if optimize:
             p4.optimize_table_graph(self)
 
-        # Analyze program and annotate objects with derived information
+        # Objects are annotated with derived information by the analyses when
+        # it is first read
         if analyze:
-            p4.p4_dependencies(self)
-            p4.p4_field_access(self)
+            self.build_stats["analysis_times"] = OrderedDict()
 
         return True
 
+    def analyze(self):
+        """
+        Runs all the analyses which have not run yet, instead of waiting for
+        their annotations to be read
+        """
+        if self.p4_analyses is not None:
+            self.p4_analyses.require_all()
+
+    def invalidate_analyses(self):
+        """
+        Discards the annotations of the analyses, e.g. after modifying the
+        table graph, so that they are computed again when they are next read
+        """
+        if self.p4_analyses is not None:
+            self.p4_analyses.invalidate()
+
+    def build_variants(self, variants, optimize=True, analyze=True,
+                       preprocess_cache=True, preprocessor_backend=None,
+                       jobs=1, parse_cache=True):
+        """
+        Builds the program once for each set of preprocessor arguments in
+        'variants' (e.g. [["-DSKU_A"], ["-DSKU_B", "-DPORTS=64"]]), used in
+        addition to the ones given to add_preprocessor_args(). Returns a list
+        of P4VariantResult, in the same order. The HLIR objects of the builds
+        are not kept, only build_stats is updated.
+
+        Variants whose preprocessed sources are identical are built once. The
+        other ones are parsed with the incremental parser, so that the
+        declarations they have in common are only parsed once, and their
+        builds are run in 'jobs' worker processes (0: one per CPU).
+        """
+        self.build_stats = OrderedDict()
+        results = [P4VariantResult(list(args)) for args in variants]
+
+        if len(self.source_files) == 0:
+            for result in results:
+                result.output = "no source file to process\n"
+            return results
+
+        if jobs is None or jobs <= 0:
+            jobs = multiprocessing.cpu_count()
+        jobs = min(jobs, len(variants))
+        pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+        map_function = pool.map if pool is not None else map
+        try:
+            preprocessed = map_function(_preprocess_variant_worker, [
+                (self.source_files, self.source_txt,
+                 self.preprocessor_args + result.preprocessor_args,
+                 preprocess_cache, preprocessor_backend)
+                for result in results
+            ])
+
+            # preprocessed sources -> index of the first variant with them
+            programs = {}
+            tasks = []
+            for idx, (sources, output, stats) in enumerate(preprocessed):
+                result = results[idx]
+                result.output = output
+                result.build_stats.update(stats)
+                if sources is None:
+                    continue
+                sources = tuple(sources)
+                if sources in programs:
+                    result.same_as = programs[sources]
+                    continue
+                programs[sources] = idx
+
+                # parsed here, where the cache of the incremental parser is
+                h = HLIR()
+                stdout = sys.stdout
+                sys.stdout = StringIO()
+                try:
+                    p4_objects = h._parse_sources(sources, True, parse_cache)
+                    result.output += sys.stdout.getvalue()
+                finally:
+                    sys.stdout = stdout
+                result.build_stats.update(h.build_stats)
+                if p4_objects is None:
+                    continue
+                tasks.append((idx, (dict(self.primitives), self.analysis_args,
+                                    p4_objects, optimize, analyze)))
+
+            built = map_function(_build_variant_worker,
+                                 [task for _, task in tasks])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        for (idx, _), (success, output, stats) in zip(tasks, built):
+            result = results[idx]
+            result.success = success
+            result.output += output
+            result.build_stats.update(stats)
+
+        for result in results:
+            if result.same_as is None:
+                continue
+            shared = results[result.same_as]
+            result.success = shared.success
+            result.output = shared.output
+            # the preprocessing statistics are the ones of this variant
+            stats = OrderedDict(shared.build_stats)
+            stats.update(result.build_stats)
+            result.build_stats = stats
+
+        self.build_stats["variants"] = len(results)
+        self.build_stats["distinct_programs"] = len(programs)
+        for name in ["reused_declarations", "parsed_declarations"]:
+            self.build_stats[name] = sum(
+                result.build_stats.get(name, 0) for result in results
+                if result.same_as is None
+            )
+        return results
+
+    def save(self, path):
+        """
+        Writes a snapshot of this HLIR, once built, to 'path', so that tools
+        can start from it with HLIR.load() instead of building the program
+        again. The analyses which have not run yet are run first.
+        """
+        from p4_hlir.snapshot import save
+        self.analyze()
+        save(self, path)
+
+    @classmethod
+    def load(cls, path, check_sources=True):
+        """
+        Returns the HLIR saved in a snapshot by HLIR.save(). Raises
+        P4SnapshotError if the snapshot was written by a different version of
+        p4-hlir or, unless check_sources is False, if one of the files the
+        program was built from has changed since.
+        """
+        from p4_hlir.snapshot import load
+        h = cls()
+        load(h, path, check_sources)
+        return h
+
+    def _preprocess_and_parse(self, dump_preprocessed, preprocess_cache,
+                              preprocessor_backend, incremental_parse,
+                              parse_cache):
+        preprocessed_sources = self._preprocess_sources(
+            dump_preprocessed, preprocess_cache, preprocessor_backend
+        )
+        if preprocessed_sources is None:
+            return None
+        return self._parse_sources(preprocessed_sources, incremental_parse,
+                                   parse_cache)
+
+    def _preprocess_sources(self, dump_preprocessed, preprocess_cache,
+                            preprocessor_backend):
+        # Preprocess all program text
+        preprocessed_sources = []
+        # preprocessor_backend is "gcc", "python" or None to pick gcc if it
+        # is installed and the built-in preprocessor otherwise
+        preprocessor = _preprocessor.Preprocessor(
+            use_cache = preprocess_cache, backend = preprocessor_backend
+        )
+        preprocessor.args += self.preprocessor_args
+        try:
+
+            for p4_source in self.source_files:
+                absolute_source = os.path.join(os.getcwd(), p4_source)
+
+                if not self._check_source_path(absolute_source):
+                    print "Source file '" + p4_source + "' could not be opened or does not exist."
+                    return None
+
+                preprocessed_sources.append(preprocessor.preprocess_file(
+                    absolute_source,
+                    dest='%s.i'%p4_source if dump_preprocessed else None
+                ))
+
+            for p4_txt in self.source_txt:
+                preprocessed_sources.append(preprocessor.preprocess_str(
+                    p4_txt,
+                    dest=None
+                ))
+
+        except _preprocessor.PreprocessorException as e:
+            print str(e)
+            return None
+        finally:
+            self.source_dependencies = sorted(preprocessor.dependencies)
+            self.build_stats["preprocess_cache_hits"] = preprocessor.cache_hits
+            self.build_stats["preprocess_cache_misses"] = preprocessor.cache_misses
+            logger.debug("preprocessor cache: %d hits, %d misses",
+                         preprocessor.cache_hits, preprocessor.cache_misses)
+
+        return preprocessed_sources
+
+    def _parse_sources(self, preprocessed_sources, incremental_parse,
+                       parse_cache):
+        # Parse preprocessed text, unless the AST for the same text is found
+        # in the parse cache
+        if incremental_parse:
+            # only re-parse the declarations which changed since the last build
+            def parse_function(data):
+                return _incremental_parser.p4_incremental_parser.parse(
+                    data, stats = self.build_stats
+                )
+        else:
+            parse_function = _parse
+        cache = _parser.P4ParseCache(use_cache = parse_cache)
+        all_p4_objects = []
+        try:
+            for preprocessed_source in preprocessed_sources:
+                p4_objects, errors_cnt = cache.parse(preprocessed_source,
+                                                     parse_function)
+                if errors_cnt > 0:
+                    print errors_cnt, "errors during parsing"
+                    print "Interrupting compilation"
+                    return None
+                all_p4_objects += p4_objects
+        finally:
+            self.build_stats["parse_cache_hits"] = cache.hits
+            self.build_stats["parse_cache_misses"] = cache.misses
+
+        return all_p4_objects
+
+    def _preprocess_and_parse_parallel(self, jobs, dump_preprocessed,
+                                       preprocess_cache, preprocessor_backend,
+                                       parse_cache):
+        """
+        Same as _preprocess_and_parse(), but each source is preprocessed and
+        parsed in a pool of 'jobs' worker processes. The results, including the
+        messages printed by the workers, are processed in source order, so that
+        the output and the resulting P4 objects are the same as for a serial
+        build.
+        """
+        tasks = []
+        for p4_source in self.source_files:
+            absolute_source = os.path.join(os.getcwd(), p4_source)
+            if not self._check_source_path(absolute_source):
+                tasks.append(None)
+                continue
+            tasks.append((absolute_source, "",
+                          '%s.i'%p4_source if dump_preprocessed else None,
+                          self.preprocessor_args, preprocess_cache,
+                          preprocessor_backend, parse_cache))
+        for p4_txt in self.source_txt:
+            tasks.append(("", p4_txt, None, self.preprocessor_args,
+                          preprocess_cache, preprocessor_backend, parse_cache))
+
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_preprocess_and_parse_worker,
+                               [t for t in tasks if t is not None])
+        finally:
+            pool.close()
+            pool.join()
+
+        self.build_stats["preprocess_cache_hits"] = sum(r[1] for r in results)
+        self.build_stats["preprocess_cache_misses"] = sum(r[2] for r in results)
+        logger.debug("preprocessor cache: %d hits, %d misses",
+                     self.build_stats["preprocess_cache_hits"],
+                     self.build_stats["preprocess_cache_misses"])
+        self.build_stats["parse_cache_hits"] = sum(r[3] for r in results)
+        self.build_stats["parse_cache_misses"] = sum(r[4] for r in results)
+        self.source_dependencies = sorted(set().union(*[r[8] for r in results]))
+
+        # Preprocessing errors are reported first, as in a serial build
+        results = iter(results)
+        parse_results = []
+        for p4_source, task in zip(self.source_files + self.source_txt, tasks):
+            if task is None:
+                print "Source file '" + p4_source + "' could not be opened or does not exist."
+                return None
+            preprocess_error, _, _, _, _, output, p4_objects, errors_cnt, _ = \
+                next(results)
+            if preprocess_error is not None:
+                print preprocess_error
+                return None
+            parse_results.append((output, p4_objects, errors_cnt))
+
+        all_p4_objects = []
+        for output, p4_objects, errors_cnt in parse_results:
+            sys.stdout.write(output)
+            if errors_cnt > 0:
+                print errors_cnt, "errors during parsing"
+                print "Interrupting compilation"
+                return None
+            all_p4_objects += p4_objects
+        return all_p4_objects
+
     def _check_source_path(self, source):
         return os.path.isfile(source)
 
+def _preprocess_and_parse_worker(task):
+    """
+    Preprocesses and parses a single source in a worker process (see
+    HLIR._preprocess_and_parse_parallel). Messages printed by the parser are
+    captured and returned to the parent process.
+    """
+    source, txt, dest, preprocessor_args, preprocess_cache, backend, \
+        parse_cache = task
+    preprocessor = _preprocessor.Preprocessor(use_cache = preprocess_cache,
+                                              backend = backend)
+    preprocessor.args += preprocessor_args
+    try:
+        if len(source) > 0:
+            preprocessed_source = preprocessor.preprocess_file(source, dest=dest)
+        else:
+            preprocessed_source = preprocessor.preprocess_str(txt, dest=dest)
+    except _preprocessor.PreprocessorException as e:
+        return (str(e), preprocessor.cache_hits, preprocessor.cache_misses,
+                0, 0, "", [], 0, preprocessor.dependencies)
+
+    cache = _parser.P4ParseCache(use_cache = parse_cache)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        p4_objects, errors_cnt = cache.parse(preprocessed_source, _parse)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    return (None, preprocessor.cache_hits, preprocessor.cache_misses,
+            cache.hits, cache.misses, output, p4_objects, errors_cnt,
+            preprocessor.dependencies)
+
+def _preprocess_variant_worker(task):
+    """
+    Preprocesses the sources of one variant (see HLIR.build_variants).
+    Returns the preprocessed sources (None on error), what was printed and
+    the preprocessing statistics.
+    """
+    source_files, source_txt, preprocessor_args, preprocess_cache, \
+        backend = task
+    h = HLIR(*source_files)
+    h.add_src_txt(*source_txt)
+    h.add_preprocessor_args(*preprocessor_args)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        sources = h._preprocess_sources(False, preprocess_cache, backend)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    return sources, output, h.build_stats
+
+def _build_variant_worker(task):
+    """
+    Runs the steps which follow parsing for one variant (see
+    HLIR.build_variants). Returns whether it succeeded, what was printed and
+    the statistics of the build.
+    """
+    primitives, analysis_args, p4_objects, optimize, analyze = task
+    h = HLIR()
+    h.primitives = PrimitivesView(primitives)
+    h.set_analysis_args(analysis_args)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        with h.context.activate():
+            success = h._build_from_ast(p4_objects, optimize, analyze)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    return success, output, h.build_stats
+
+def _parse(data):
+    with _parser.p4_parser_pool.parser() as parser:
+        return parser.parse(data)
+
 def HLIR_from_txt (program_str, **kwargs):
     h = HLIR()
     h.add_src_txt(program_str)
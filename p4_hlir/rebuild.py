@@ -0,0 +1,327 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Incremental rebuilds of HLIR instances after their sources were edited, see
+HLIR.rebuild().
+
+Every top-level declaration of the semantically checked program gets a
+fingerprint: a hash of its content, without the source positions, and its
+position. The fingerprints are compared with the ones of the previous rebuild,
+and if the only declarations whose content changed are actions whose body
+changed and tables whose 'reads' changed, the HLIR objects are updated in
+place:
+
+  - the changed actions, and the compound actions which call them, are built
+    again from their declaration, then validated for the tables which use
+    them and flattened;
+  - the match fields of the changed tables are built again;
+  - the objects of the declarations which only moved get their new position;
+  - the dependencies from and to the tables whose fields (matched, read or
+    written by their actions) changed are computed again, if they were
+    computed (see p4.p4_analyses.update()).
+
+The table graph does not depend on the body of the actions, except through
+the headers they add, remove or copy when it is optimized; if those changed,
+or if anything else changed, the program is built from scratch.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+from p4_hlir.util.build_context import P4BuildContext, \
+    show_last_build_messages
+from p4_hlir.util.startup import lazy_import
+
+_ast = lazy_import("p4_hlir.frontend.ast")
+_dumper = lazy_import("p4_hlir.frontend.dumper")
+p4 = lazy_import("p4_hlir.hlir.p4")
+_p4_tables = lazy_import("p4_hlir.hlir.p4_tables")
+_analysis_utils = lazy_import("p4_hlir.hlir.analysis_utils")
+
+# type of declaration -> the attribute which can change without building the
+# program from scratch
+_INCREMENTAL_ATTRIBUTES = {
+    "P4ActionFunction": "action_body",
+    "P4Table": "reads",
+}
+
+# not part of the content of the declarations
+_IGNORED_SLOTS = frozenset(["filename", "lineno", "_mark"])
+
+# class of AST node -> the names of the slots which are part of its content
+_content_slots = {}
+
+# values which are their own representation
+_ATOMIC_TYPES = frozenset([type(None), bool, int, long, float, str, unicode])
+
+def _canonical(value):
+    """
+    A representation of an AST node (or of an attribute value) made of tuples,
+    strings and numbers, without the source positions. The representation of
+    a node is its type name followed by (slot name, representation) pairs.
+    """
+    cls = type(value)
+    if cls in _ATOMIC_TYPES:
+        return value
+    slots = _content_slots.get(cls)
+    if slots is None and isinstance(value, _ast.P4TreeNode):
+        slots = tuple(name for name in cls.get_slots()
+                      if name not in _IGNORED_SLOTS)
+        _content_slots[cls] = slots
+    if slots is not None:
+        state = [cls.__name__]
+        for name in slots:
+            try:
+                attribute = getattr(value, name)
+            except AttributeError:
+                continue
+            state.append( (name, _canonical(attribute)) )
+        return tuple(state)
+    elif isinstance(value, (list, tuple)):
+        return tuple(_canonical(v) for v in value)
+    elif isinstance(value, (set, frozenset)):
+        return ("set",) + tuple(sorted(_canonical(v) for v in value))
+    elif isinstance(value, dict):
+        return ("dict",) + tuple(sorted(
+            (_canonical(k), _canonical(v)) for k, v in value.items()
+        ))
+    return value
+
+def _hash(value):
+    return hashlib.sha1(repr(value)).digest()
+
+def get_declarations(p4_program):
+    """
+    Returns an OrderedDict which maps the key of every declaration of the
+    program ((type, name), or (type, index) for the declarations without a
+    name) to its AST node, the hash of its content, the hash of its content
+    without the attribute which can change incrementally, and its position
+    """
+    declarations = OrderedDict()
+    unnamed = {}
+    for node in p4_program.objects:
+        type_name = type(node).__name__
+        name = getattr(node, "name", None)
+        if name is None:
+            name = unnamed.get(type_name, 0)
+            unnamed[type_name] = name + 1
+        content = _canonical(node)
+        attribute = _INCREMENTAL_ATTRIBUTES.get(type_name)
+        if attribute is None:
+            shape = content
+        else:
+            shape = tuple(item for item in content[1:]
+                          if item[0] != attribute)
+        declarations[(type_name, name)] = (node, _hash(content), _hash(shape),
+                                           (node.filename, node.lineno))
+    return declarations
+
+def _fingerprints(declarations):
+    return OrderedDict(
+        (key, declaration[1:]) for key, declaration in declarations.items()
+    )
+
+def _plan(previous, declarations):
+    """
+    Returns the declarations of the actions and of the tables which changed,
+    and the new position of the moved declarations, by old position, or None
+    if the program must be built from scratch
+    """
+    if previous.keys() != declarations.keys():
+        return None
+    changed = []
+    positions = {}
+    for key, (node, content, shape, position) in declarations.items():
+        old_content, old_shape, old_position = previous[key]
+        if positions.setdefault(old_position, position) != position:
+            return None
+        if content == old_content:
+            continue
+        if shape != old_shape:
+            return None
+        changed.append(node)
+    moved = dict((old_position, position)
+                 for old_position, position in positions.items()
+                 if old_position != position)
+    return changed, moved
+
+def _field_names(mask):
+    return frozenset(field.name
+                     for field in _analysis_utils.fields_from_mask(mask))
+
+def _table_fields(tables):
+    """
+    table -> the names of the fields it matches, and of the fields read and
+    written by each of its actions, as seen by the dependency analysis
+    """
+    fields = {}
+    with P4BuildContext().activate():
+        _analysis_utils.reset_state(include_valid = True)
+        for table in tables:
+            action_fields = []
+            for action in table.actions:
+                r, w, _ = _analysis_utils.retrieve_masks_from_one_action(action)
+                action_fields.append( (_field_names(r), _field_names(w)) )
+            fields[table] = (_field_names(table.retrieve_match_mask()),
+                             tuple(action_fields))
+    return fields
+
+def _update(hlir, declarations, changed, moved, optimize):
+    """
+    Updates the HLIR objects in place, see the module docstring. Returns the
+    tables whose fields changed, or None if the program must be built from
+    scratch (in which case the objects may have been partially updated).
+    """
+    for type_name, name in declarations:
+        if type_name == "P4Table" and name not in hlir.p4_tables:
+            # removed when the table graph was optimized, its actions were
+            # validated for it
+            return None
+
+    action_nodes = {}
+    table_nodes = OrderedDict()
+    for node in changed:
+        if type(node) is _ast.P4ActionFunction:
+            action_nodes[node.name] = node
+        else:
+            table_nodes[node.name] = node
+
+    # the compound actions which call a changed action (directly or not) are
+    # built again, the arguments of their calls were resolved when they were
+    # validated
+    callers = {}
+    for action in hlir.p4_actions.values():
+        for call in action.call_sequence:
+            callers.setdefault(call[0], set()).add(action)
+    rebuilt = set()
+    to_visit = [hlir.p4_actions[name] for name in action_nodes]
+    while to_visit:
+        action = to_visit.pop()
+        if action in rebuilt: continue
+        rebuilt.add(action)
+        to_visit.extend(callers.get(action, ()))
+    rebuilt_actions = [action for action in hlir.p4_actions.values()
+                       if action in rebuilt]
+    if optimize:
+        modified_hdrs = dict(
+            (action, _p4_tables._find_modified_hdrs([action]))
+            for action in rebuilt_actions
+        )
+
+    tables = [table for table in hlir.p4_tables.values()
+              if table.name in table_nodes or rebuilt.intersection(table.actions)]
+    previous_fields = _table_fields(tables)
+
+    # attaches the dump_to_p4() methods to the AST nodes
+    _dumper.P4HlirDumper()
+    for action in rebuilt_actions:
+        node = declarations[("P4ActionFunction", action.name)][0]
+        action.call_sequence = [call.dump_to_p4(hlir)
+                                for call in node.action_body]
+        action.flat_call_sequence = None
+        action.signature_widths = [None] * len(action.signature)
+        action.build(hlir)
+    for name, node in table_nodes.items():
+        table = hlir.p4_tables[name]
+        table.match_fields = [read.dump_to_p4(hlir) for read in node.reads]
+        table.build_fields(hlir)
+
+    try:
+        p4.p4_action_validate_types(hlir, rebuilt)
+    except p4.p4_compiler_msg:
+        # reported by the build from scratch
+        return None
+
+    if optimize:
+        for action in rebuilt_actions:
+            if _p4_tables._find_modified_hdrs([action]) != \
+               modified_hdrs[action]:
+                return None
+
+    if moved:
+        for p4_object in hlir.p4_objects:
+            position = (p4_object.filename, p4_object.lineno)
+            if position in moved:
+                p4_object.filename, p4_object.lineno = moved[position]
+        calculated_fields = []
+        for field, update_verify_list, filename, lineno in \
+            hlir.calculated_fields:
+            filename, lineno = moved.get((filename, lineno), (filename, lineno))
+            calculated_fields.append( (field, update_verify_list,
+                                       filename, lineno) )
+        hlir.calculated_fields = calculated_fields
+
+    fields = _table_fields(tables)
+    return [table for table in tables
+            if fields[table] != previous_fields[table]]
+
+def rebuild(hlir, optimize, analyze, preprocess_cache, preprocessor_backend,
+            parse_cache):
+    """
+    See HLIR.rebuild()
+    """
+    context = P4BuildContext()
+    try:
+        with context.activate():
+            return _rebuild(hlir, context, optimize, analyze,
+                            preprocess_cache, preprocessor_backend,
+                            parse_cache)
+    finally:
+        show_last_build_messages(context)
+
+def _rebuild(hlir, context, optimize, analyze, preprocess_cache,
+             preprocessor_backend, parse_cache):
+    build_stats = OrderedDict()
+    hlir.build_stats = build_stats
+    all_p4_objects = hlir._preprocess_and_parse(
+        False, preprocess_cache, preprocessor_backend, True, parse_cache
+    )
+    p4_program = None
+    if all_p4_objects is not None:
+        p4_program = hlir._check_ast(all_p4_objects)
+    if p4_program is None:
+        return False
+
+    declarations = get_declarations(p4_program)
+    options = (optimize, analyze)
+    changed_tables = None
+    if hlir._declarations is not None and \
+       hlir._declarations[0] == options:
+        plan = _plan(hlir._declarations[1], declarations)
+        if plan is not None:
+            changed, moved = plan
+            hlir.context = context
+            changed_tables = _update(hlir, declarations, changed, moved,
+                                     optimize)
+
+    if changed_tables is None:
+        hlir.context = context
+        hlir._init_objects()
+        build_stats["rebuild"] = "full"
+        success = hlir._build_from_program(p4_program, optimize, analyze)
+    else:
+        build_stats["rebuild"] = "incremental"
+        build_stats["changed_declarations"] = len(changed)
+        build_stats["moved_declarations"] = len(moved)
+        build_stats["changed_tables"] = len(changed_tables)
+        if analyze:
+            build_stats["analysis_times"] = OrderedDict()
+            hlir.p4_analyses.update(changed_tables)
+        success = True
+
+    hlir._declarations = None
+    if success:
+        hlir._declarations = (options, _fingerprints(declarations))
+    return success
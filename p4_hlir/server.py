@@ -0,0 +1,283 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compile server, which builds P4 programs in a long-running process so that the
+parser tables, the standard primitives and the in-memory AST cache are only
+built once (see bin/p4-hlir-server).
+
+Clients connect to a Unix socket and send one request, a JSON object on a
+single line, to which the server replies with a JSON object on a single line:
+
+  {"protocol": 2, "command": "build",
+   "cwd": "/path/to/dir",           # sources are relative to this directory
+   "sources": ["prog.p4"],
+   "source_txt": [],                 # program text, instead of files
+   "preprocessor_args": ["-DFOO", "-Iinclude"],
+   "primitives": [{...}],            # extra primitive declarations
+   "analysis_args": {},
+   "options": {"optimize": true, "analyze": true, ...},  # see BUILD_OPTIONS
+   "emit_hlir": false}
+
+  {"protocol": 2, "success": true, "output": "...", "build_stats": {...},
+   "hlir": {...}}                    # only if emit_hlir is true
+
+'output' is what the build printed, i.e. the diagnostics, and 'hlir' is the
+JSON export of the program (see json_export.py). A request which cannot be
+processed gets {"protocol": 2, "error": "..."}. The other commands are "ping"
+and "shutdown".
+"""
+
+import errno
+import importlib
+import json
+import logging
+import os
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+from cStringIO import StringIO
+
+from main import HLIR
+import json_export
+from p4_hlir.util.startup import lazy_import
+
+_parser = lazy_import("p4_hlir.frontend.parser")
+_primitives = lazy_import("p4_hlir.frontend.primitives")
+_p4 = lazy_import("p4_hlir.hlir.p4")
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever requests or responses change in an incompatible way
+PROTOCOL_VERSION = 2
+
+# HLIR.build() arguments a client may set, with their default value
+BUILD_OPTIONS = {
+    "optimize": True,
+    "analyze": True,
+    "preprocess_cache": True,
+    "preprocessor_backend": None,
+    "jobs": 1,
+    "parse_cache": True,
+    # the in-memory cache of the incremental parser stays warm in the server
+    "incremental_parse": True,
+}
+
+class P4ServerError(Exception):
+    def __init__(self, message):
+        super(P4ServerError, self).__init__(message)
+
+def get_socket_path():
+    """
+    $P4_HLIR_SERVER_SOCKET if it is set, otherwise a socket in
+    $XDG_RUNTIME_DIR or in the temporary directory, private to the user.
+    """
+    path = os.environ.get("P4_HLIR_SERVER_SOCKET")
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "p4_hlir.sock")
+    return os.path.join(tempfile.gettempdir(),
+                        "p4_hlir-%d.sock" % os.getuid())
+
+def _to_str(value):
+    # the HLIR expects byte strings, the json module returns unicode ones
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [_to_str(v) for v in value]
+    if isinstance(value, dict):
+        return dict((_to_str(k), _to_str(v)) for k, v in value.items())
+    return value
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = _to_str(json.loads(line))
+            if not isinstance(request, dict):
+                raise ValueError("a request must be a JSON object")
+        except ValueError as e:
+            response = {"error": "invalid request: %s" % e}
+        else:
+            response = self.server.process(request)
+        response["protocol"] = PROTOCOL_VERSION
+        try:
+            self.wfile.write(json.dumps(response) + "\n")
+        except socket.error:
+            # the client went away
+            pass
+
+class P4BuildServer(SocketServer.UnixStreamServer):
+    """
+    Serves build requests on a Unix socket, one at a time. The builds run in
+    this process: they share the parser pool, the standard primitives and the
+    cache of the incremental parser, and the on-disk caches.
+    """
+    def __init__(self, socket_path = None):
+        if socket_path is None:
+            socket_path = get_socket_path()
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            if ping(socket_path):
+                raise P4ServerError("a server is already listening on '%s'"
+                                    % socket_path)
+            # left by a server which did not exit cleanly
+            os.unlink(socket_path)
+        # the socket is only accessible to the user running the server
+        umask = os.umask(0077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                                   _RequestHandler)
+        finally:
+            os.umask(umask)
+        self.builds = 0
+
+    def warm_up(self):
+        """
+        Builds the parser tables and loads the standard primitives, which
+        would otherwise be done by the first build
+        """
+        for module in ["p4_hlir.frontend.preprocessor",
+                       "p4_hlir.frontend.semantic_check",
+                       "p4_hlir.frontend.dumper",
+                       "p4_hlir.hlir.p4"]:
+            importlib.import_module(module)
+        with _parser.p4_parser_pool.parser():
+            pass
+        _primitives.get_std_primitives()
+
+    def process(self, request):
+        if request.get("protocol") != PROTOCOL_VERSION:
+            return {"error": "unsupported protocol version %r, the server"
+                    " uses version %d" % (request.get("protocol"),
+                                          PROTOCOL_VERSION)}
+        command = request.get("command", "build")
+        if command == "ping":
+            return {"builds": self.builds}
+        if command == "shutdown":
+            # shutdown() waits for serve_forever() to return, which cannot
+            # happen while this request is being handled
+            threading.Thread(target = self.shutdown).start()
+            return {}
+        if command == "build":
+            try:
+                return self.build(request)
+            except P4ServerError as e:
+                return {"error": str(e)}
+        return {"error": "unknown command '%s'" % command}
+
+    def build(self, request):
+        options = dict(BUILD_OPTIONS)
+        for name, value in request.get("options", {}).items():
+            if name not in BUILD_OPTIONS:
+                raise P4ServerError("unknown build option '%s'" % name)
+            options[name] = value
+
+        cwd = os.getcwd()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            os.chdir(request.get("cwd", cwd))
+            h = HLIR_from_request(request)
+            success = h.build(**options)
+            if request.get("emit_hlir", False) and success:
+                # the export reads the annotations of the analyses, which
+                # print their diagnostics and may read files relative to the
+                # request's directory
+                h.analyze()
+            output = sys.stdout.getvalue()
+        except Exception as e:
+            logger.exception("build failed")
+            raise P4ServerError("build failed: %s: %s"
+                                % (type(e).__name__, e))
+        finally:
+            sys.stdout = stdout
+            os.chdir(cwd)
+            # the messages of the build are in h.context, the default context
+            # must not keep those of the last request alive
+            _p4.p4_compiler_msg_reset()
+        self.builds += 1
+        logger.info("build %d of %s: %s", self.builds,
+                    ", ".join(request.get("sources", [])) or "<text>",
+                    "success" if success else "failure")
+
+        response = {"success": success, "output": output,
+                    "build_stats": h.build_stats}
+        if request.get("emit_hlir", False) and success:
+            # the export is streamed to a buffer, not to the socket, so that
+            # it is only sent with the rest of a successful response
+            buf = StringIO()
+            json_export.export(h, buf)
+            response["hlir"] = json.loads(buf.getvalue())
+        return response
+
+    def serve_forever(self, *args, **kwargs):
+        try:
+            SocketServer.UnixStreamServer.serve_forever(self, *args, **kwargs)
+        finally:
+            self.server_close()
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+def HLIR_from_request(request):
+    h = HLIR(*request.get("sources", []))
+    h.add_src_txt(*request.get("source_txt", []))
+    h.add_preprocessor_args(*request.get("preprocessor_args", []))
+    h.set_analysis_args(request.get("analysis_args", {}))
+    for primitives in request.get("primitives", []):
+        h.add_primitives(primitives)
+    return h
+
+def send_request(request, socket_path = None):
+    """
+    Sends a request to the server and returns its response. Returns None if
+    no server is listening on the socket.
+    """
+    if socket_path is None:
+        socket_path = get_socket_path()
+    request = dict(request)
+    request.setdefault("protocol", PROTOCOL_VERSION)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except socket.error as e:
+            if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                return None
+            raise
+        sock.sendall(json.dumps(request) + "\n")
+        stream = sock.makefile("rb")
+        line = stream.readline()
+        stream.close()
+    finally:
+        sock.close()
+    if not line:
+        raise P4ServerError("no response from the server")
+    return _to_str(json.loads(line))
+
+def ping(socket_path = None):
+    try:
+        response = send_request({"command": "ping"}, socket_path)
+    except (socket.error, ValueError, P4ServerError):
+        return False
+    return response is not None and "error" not in response
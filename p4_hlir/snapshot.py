@@ -0,0 +1,299 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Binary snapshots of built HLIR instances, see HLIR.save() and HLIR.load().
+
+A snapshot is a stream of pickles: a header, then the state of the HLIR
+instance, then the state of every HLIR object (tables, fields, dependencies...)
+one after the other. References between HLIR objects are pickled as integer
+ids, so that the object graph, with its cycles, is pickled without deep
+recursion, and the identity of the objects is preserved. The enumerated
+constants (p4_match_type.P4_MATCH_EXACT...) are pickled by name and loaded as
+the constants of the running process.
+
+The header records the version of the format, a signature of the HLIR code
+and the content hash of the files the program was built from, a snapshot is
+rejected if any of them changed.
+"""
+
+import array
+import cPickle as pickle
+import gc
+import hashlib
+import importlib
+import itertools
+import os
+import sys
+from cStringIO import StringIO
+
+import p4_hlir
+from p4_hlir.frontend.preprocessor import PreprocessorCache
+from p4_hlir.util.startup import lazy_import
+
+p4 = lazy_import("p4_hlir.hlir.p4")
+
+# Bump this whenever the format of the snapshots changes
+SNAPSHOT_VERSION = 1
+
+_MAGIC = "p4-hlir snapshot"
+
+class P4SnapshotError(Exception):
+    def __init__(self, message):
+        super(P4SnapshotError, self).__init__(message)
+
+_code_signature = None
+def get_code_signature():
+    """
+    Hash of the modules which define the HLIR objects and how they are built,
+    snapshots written by a different version of p4-hlir are rejected
+    """
+    global _code_signature
+    if _code_signature is None:
+        key = hashlib.sha1(repr(SNAPSHOT_VERSION))
+        package_dir = os.path.dirname(os.path.abspath(p4_hlir.__file__))
+        for subdir in ["", "hlir", "frontend", "util"]:
+            directory = os.path.join(package_dir, subdir)
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(".py"): continue
+                key.update(name)
+                with open(os.path.join(directory, name), "rb") as f:
+                    key.update(f.read())
+        _code_signature = key.hexdigest()
+    return _code_signature
+
+_hash_file = PreprocessorCache._hash_file
+
+def _get_enum_names():
+    # enum class -> (module, name) of the first declaration of the class found
+    # in the hlir modules: p4_create_enum() creates classes which cannot be
+    # pickled by name, and whose names are not unique
+    names = {}
+    p4.p4_enum # the hlir modules are imported with p4
+    for module_name in sorted(sys.modules):
+        module = sys.modules[module_name]
+        if module is None or not module_name.startswith("p4_hlir.hlir."):
+            continue
+        for name, value in sorted(vars(module).items()):
+            if isinstance(value, type) and issubclass(value, p4.p4_enum) and \
+               value is not p4.p4_enum:
+                names.setdefault(value, (module_name, name))
+    return names
+
+def _get_enum_class(module_name, name):
+    return getattr(importlib.import_module(module_name), name)
+
+def _is_hlir_object(obj_type, _cache = {}):
+    # instances of the classes of the hlir package are pickled by reference
+    result = _cache.get(obj_type)
+    if result is None:
+        result = obj_type.__module__.startswith("p4_hlir.hlir.") and \
+            not issubclass(obj_type, (p4.p4_enum, int, long, BaseException))
+        _cache[obj_type] = result
+    return result
+
+class _SnapshotWriter(object):
+    """
+    Pickles the states of the HLIR objects one after the other, replacing the
+    references to the HLIR, to the HLIR objects and to the enumerated
+    constants with their index in a table, which is written first
+    """
+    def __init__(self, hlir):
+        self.hlir = hlir
+        self.buf = StringIO()
+        self.pickler = pickle.Pickler(self.buf, pickle.HIGHEST_PROTOCOL)
+        # only called for the objects which are not of a builtin type
+        self.pickler.inst_persistent_id = self.persistent_id
+        self.enum_names = _get_enum_names()
+        # id(object) -> its index in the table
+        self.ids = {}
+        self.objects = []
+        # the table: for each object, the index of its class in self.classes,
+        # or -1 for the objects described in self.external (the HLIR and the
+        # enumerated constants), which are not created when loading
+        self.class_ids = array.array("i")
+        self.classes = []
+        self.class_idx = {}
+        self.external = {}
+        self._add_external(hlir, ("hlir",))
+
+    def _add(self, obj, obj_type):
+        idx = len(self.objects)
+        self.ids[id(obj)] = idx
+        self.objects.append(obj)
+        class_idx = self.class_idx.get(obj_type)
+        if class_idx is None:
+            class_idx = len(self.classes)
+            self.class_idx[obj_type] = class_idx
+            self.classes.append(obj_type)
+        self.class_ids.append(class_idx)
+        return idx
+
+    def _add_external(self, obj, entry):
+        idx = len(self.objects)
+        self.ids[id(obj)] = idx
+        self.objects.append(obj)
+        self.class_ids.append(-1)
+        self.external[idx] = entry
+        return idx
+
+    def persistent_id(self, obj):
+        idx = self.ids.get(id(obj))
+        if idx is not None:
+            return idx
+        obj_type = type(obj)
+        if obj_type in self.enum_names:
+            module_name, name = self.enum_names[obj_type]
+            return self._add_external(obj, ("enum", module_name, name,
+                                            obj.value))
+        if obj_type is type and obj in self.enum_names:
+            module_name, name = self.enum_names[obj]
+            return self._add_external(obj, ("enum_class", module_name, name))
+        if not _is_hlir_object(obj_type):
+            return None
+        return self._add(obj, obj_type)
+
+    def write(self, f, header, hlir_state):
+        self.pickler.dump(hlir_state)
+        # pickling the states of objects discovers the objects they refer to,
+        # which are appended to self.objects: the states are pickled in
+        # batches, until there is no new object. The external objects have no
+        # state.
+        done = 0
+        while done < len(self.objects):
+            batch = []
+            for idx in xrange(done, len(self.objects)):
+                obj = self.objects[idx]
+                if self.class_ids[idx] < 0:
+                    batch.append(None)
+                elif hasattr(obj, "__getstate__"):
+                    batch.append(obj.__getstate__())
+                else:
+                    batch.append(obj.__dict__)
+            done += len(batch)
+            self.pickler.dump(batch)
+
+        pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump((self.classes, self.class_ids.tostring(), self.external),
+                    f, pickle.HIGHEST_PROTOCOL)
+        f.write(self.buf.getvalue())
+
+def _read_snapshot(hlir, f, check_sources):
+    try:
+        header = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError,
+            IndexError, KeyError, ValueError, TypeError):
+        raise P4SnapshotError("not a p4-hlir snapshot")
+    check_header(header, check_sources)
+
+    classes, class_ids_str, external = pickle.load(f)
+    class_ids = array.array("i")
+    class_ids.fromstring(class_ids_str)
+    # the objects are created empty, their states are restored below
+    objects = [classes[class_idx].__new__(classes[class_idx])
+               if class_idx >= 0 else None for class_idx in class_ids]
+    for idx, entry in external.items():
+        if entry[0] == "enum":
+            objects[idx] = _get_enum_class(*entry[1:3]).values[entry[3]]
+        elif entry[0] == "enum_class":
+            objects[idx] = _get_enum_class(*entry[1:3])
+        else:
+            objects[idx] = hlir
+
+    unpickler = pickle.Unpickler(f)
+    # the references are indices in the table, resolving them does not
+    # require a call to a Python function
+    unpickler.persistent_load = objects.__getitem__
+    hlir_state = unpickler.load()
+    states = []
+    while len(states) < len(objects):
+        states.extend(unpickler.load())
+
+    custom_state = set(cls for cls in classes if hasattr(cls, "__setstate__"))
+    for obj, state in itertools.izip(objects, states):
+        if state is None:
+            continue
+        if type(obj) in custom_state:
+            obj.__setstate__(state)
+        else:
+            # the unpickled dictionary is not used for anything else
+            obj.__dict__ = state
+    return hlir_state
+
+# HLIR attributes which are not saved: the build context only holds
+# diagnostics and the caches of the analyses
+_TRANSIENT_ATTRIBUTES = ["context"]
+
+def save(hlir, path):
+    """
+    Writes a snapshot of a built HLIR instance to 'path'
+    """
+    header = {
+        "magic": _MAGIC,
+        "version": SNAPSHOT_VERSION,
+        "code_signature": get_code_signature(),
+        "sources": [(dep_path, _hash_file(dep_path))
+                    for dep_path in hlir.source_dependencies],
+    }
+    hlir_state = dict(hlir.__dict__)
+    for name in _TRANSIENT_ATTRIBUTES:
+        hlir_state.pop(name, None)
+
+    tmp_path = path + ".tmp%d" % os.getpid()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(tmp_path, "wb") as f:
+            _SnapshotWriter(hlir).write(f, header, hlir_state)
+        os.rename(tmp_path, path)
+    finally:
+        if gc_enabled:
+            gc.enable()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def check_header(header, check_sources = True):
+    if not isinstance(header, dict) or header.get("magic") != _MAGIC:
+        raise P4SnapshotError("not a p4-hlir snapshot")
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise P4SnapshotError("snapshot format version %r is not supported"
+                              " (expected %d)" % (header.get("version"),
+                                                  SNAPSHOT_VERSION))
+    if header.get("code_signature") != get_code_signature():
+        raise P4SnapshotError("snapshot was written by a different version"
+                              " of p4-hlir")
+    if check_sources:
+        for dep_path, dep_hash in header["sources"]:
+            if _hash_file(dep_path) != dep_hash:
+                raise P4SnapshotError("snapshot is out of date, '%s' was"
+                                      " modified" % dep_path)
+
+def load(hlir, path, check_sources = True):
+    """
+    Restores a snapshot written by save() into 'hlir', a new HLIR instance.
+    Raises P4SnapshotError if the snapshot cannot be used, see check_header().
+    """
+    # the objects created while loading are not garbage, do not let the
+    # collector walk them over and over
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # unpickling from memory is faster than from a file
+        with open(path, "rb") as f:
+            data = f.read()
+        hlir_state = _read_snapshot(hlir, StringIO(data), check_sources)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    hlir.__dict__.update(hlir_state)
@@ -64,6 +64,10 @@ class OrderedSet(collections.MutableSet):
         self.discard(key)
         return key
 
+    def __reduce__(self):
+        # pickling the linked list itself would recurse once per element
+        return (self.__class__, (list(self),))
+
     def __repr__(self):
         if not self:
             return '%s()' % (self.__class__.__name__,)
@@ -0,0 +1,109 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+from contextlib import contextmanager
+
+class P4BuildContext(object):
+    """
+    The state of one HLIR build: diagnostic counters, compiler messages and the
+    caches of the analyses.
+
+    Every HLIR instance has its own context (HLIR.context), which is replaced
+    at the beginning of each build, so that several programs can be built at
+    the same time (e.g. in a thread pool) and so that the caches are freed
+    with the HLIR. Code which cannot reach the HLIR instance uses
+    current_context() to get the context of the build running in its thread.
+    """
+    def __init__(self):
+        # semantic checking (see P4TreeNode.print_error)
+        self.errors_cnt = 0
+        self.warnings_cnt = 0
+        # where semantic diagnostics are printed, sys.stdout if None
+        self.output = None
+        # header extracted last by the parser function being checked
+        self.last_extracted = None
+        # (counter / meter / register, table) pairs for direct objects
+        self.direct_objects = []
+
+        # p4_compiler_msg instances, and their number per level
+        self.messages = []
+        self.message_count = {}
+
+        # control flow -> entry point of its table graph
+        self.control_entry_points = {}
+        # action -> (fields read, fields written, all fields), as bitmasks
+        self.action_fields_cache = {}
+        # field or validity pseudo field -> its dense id, and id -> field;
+        # the analyses represent sets of fields as bitmasks of these ids
+        self.field_ids = {}
+        self.fields_by_id = []
+        # header instance -> bitmask of its fields
+        self.instance_field_masks = {}
+        # header instance -> its validity pseudo field
+        self.valid_pseudo_fields = {}
+        # whether the analyses take validity pseudo fields into account
+        self.include_valid = False
+
+    def get_output(self):
+        return self.output if self.output is not None else sys.stdout
+
+    @contextmanager
+    def activate(self):
+        """
+        Makes this context the one returned by current_context() in the
+        calling thread, until the end of the 'with' block.
+        """
+        stack = _active.__dict__.setdefault("stack", [])
+        stack.append(self)
+        try:
+            yield self
+        finally:
+            stack.pop()
+
+_active = threading.local()
+
+# used when HLIR objects are created or analyzed outside of a build
+_default_context = P4BuildContext()
+
+def current_context():
+    stack = getattr(_active, "stack", None)
+    if stack:
+        return stack[-1]
+    return _default_context
+
+def show_last_build_messages(context):
+    """
+    Makes the compiler messages of 'context', the one of the last finished
+    build, those of the default context, which are read by
+    p4_compiler_msg_list() and p4_compiler_msg_count() outside of a build.
+    The lists are replaced in place, so the messages of previous builds are
+    not kept.
+    """
+    if context is _default_context:
+        return
+    _default_context.messages[:] = context.messages
+    _default_context.message_count.clear()
+    _default_context.message_count.update(context.message_count)
+
+def context_of(hlir):
+    """
+    The context of an HLIR instance, or the current context for objects which
+    do not have one.
+    """
+    context = getattr(hlir, "context", None)
+    if context is None:
+        context = current_context()
+    return context
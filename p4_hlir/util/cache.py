@@ -0,0 +1,111 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers for the on-disk caches kept by p4_hlir between runs.
+
+All caches live under a single per-user directory, by default
+$XDG_CACHE_HOME/p4_hlir (or ~/.cache/p4_hlir). The location can be overridden
+with the P4_HLIR_CACHE_DIR environment variable; setting it to an empty string
+disables on-disk caching altogether.
+"""
+
+import os
+import threading
+
+def get_cache_dir(subdir = None):
+    """
+    Return the path of the cache directory (or of one of its sub-directories),
+    creating it if needed. Returns None if caching is disabled or if the
+    directory cannot be created or written to, in which case callers are
+    expected to fall back to their uncached behavior.
+    """
+    cache_dir = os.environ.get("P4_HLIR_CACHE_DIR")
+    if cache_dir is None:
+        xdg_cache = os.environ.get("XDG_CACHE_HOME")
+        if not xdg_cache:
+            xdg_cache = os.path.join(os.path.expanduser("~"), ".cache")
+        cache_dir = os.path.join(xdg_cache, "p4_hlir")
+    if not cache_dir:
+        return None
+    if subdir:
+        cache_dir = os.path.join(cache_dir, subdir)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+    except OSError:
+        # may have been created concurrently by another process
+        if not os.path.isdir(cache_dir):
+            return None
+    if not os.access(cache_dir, os.W_OK | os.X_OK):
+        return None
+    return cache_dir
+
+def get_tmp_path(path):
+    """
+    Return a unique, not yet existing, path next to 'path'. Cache files are
+    written there first and then renamed to 'path', so that concurrent
+    readers never see a partially written file.
+    """
+    return "%s.%d.%d.tmp" % (path, os.getpid(), threading.current_thread().ident)
+
+def commit_tmp_path(tmp_path, path):
+    """
+    Atomically move a file written with get_tmp_path() to its final location.
+    """
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def evict_lru(cache_dir, max_size, suffix):
+    """
+    Remove the least recently used files ending with 'suffix' from 'cache_dir'
+    until their total size is at most 'max_size' bytes. Caches record the use
+    of an entry by updating its modification time (see touch()).
+    """
+    entries = []
+    total_size = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix): continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total_size += st.st_size
+    if total_size <= max_size:
+        return
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_size: break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
+
+def touch(path):
+    """
+    Update the modification time of a cache entry, which is used for LRU
+    eviction.
+    """
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
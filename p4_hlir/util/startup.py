@@ -0,0 +1,62 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Helpers to keep the start-up time of p4_hlir low.
+"""
+
+import importlib
+import pkgutil
+import types
+
+class _LazyModule(types.ModuleType):
+    def __init__(self, name):
+        super(_LazyModule, self).__init__(name)
+
+    def _load(self):
+        module = self.__dict__.get("_module")
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        # only called for the attributes the placeholder does not have
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return "<lazily imported module '%s'>" % self.__name__
+
+def lazy_import(name):
+    """
+    Returns a placeholder for the module with absolute name 'name', which only
+    imports the module the first time one of its attributes is accessed. It
+    can be used as a drop-in replacement for the module, except for 'from ...
+    import' statements.
+    """
+    return _LazyModule(name)
+
+def read_resource(package, resource):
+    """
+    Returns the contents of the data file 'resource' of 'package', like
+    pkg_resources.resource_string() but without the cost of importing
+    pkg_resources. The package's loader is used, so this also works for
+    packages installed as zipped eggs.
+    """
+    data = pkgutil.get_data(package, resource)
+    if data is None:
+        raise IOError("cannot read resource '%s' of package '%s'"
+                      % (resource, package))
+    return data
@@ -23,7 +23,7 @@ import re
 
 SETUP_PY_PATH = os.path.dirname(__file__)
 
-scripts = ['p4-validate', 'p4-graphs', 'p4-shell']
+scripts = ['p4-validate', 'p4-graphs', 'p4-shell', 'p4-hlir-server']
 
 install_lib = None
 old_install = None
@@ -0,0 +1,267 @@
+# Copyright 2013-present Barefoot Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests of HLIR.rebuild(): after every edit of a program, the HLIR rebuilt
+(incrementally or not) must be the same as the one built from scratch, as
+checked by p4_hlir.compare.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from p4_hlir.main import HLIR
+from p4_hlir.compare import compare
+from p4_hlir.hlir import p4
+
+PROGRAM = """
+header_type h_t {
+    fields {
+        f0 : 32;
+        f1 : 32;
+        f2 : 32;
+        f3 : 32;
+    }
+}
+header h_t h;
+header h_t h2;
+
+parser start {
+    extract(h);
+    return ingress;
+}
+
+counter cnt {
+    type : packets;
+    instance_count : 16;
+}
+
+action a1(v) {
+    modify_field(h.f0, v);
+}
+
+action a2(v) {
+    a1(v);
+    add_to_field(h.f1, 1);
+}
+
+action a3() {
+    count(cnt, 1);
+}
+
+action nop() {
+}
+
+table t1 {
+    reads {
+        h.f0 : exact;
+    }
+    actions {
+        a1;
+        a2;
+    }
+}
+
+table t2 {
+    reads {
+        h.f1 : exact;
+    }
+    actions {
+        a2;
+        a3;
+    }
+}
+
+table t3 {
+    reads {
+        h.f2 : ternary;
+    }
+    actions {
+        nop;
+        a1;
+    }
+}
+
+control ingress {
+    apply(t1);
+    if (valid(h)) {
+        apply(t2);
+    }
+    apply(t3);
+}
+
+control egress {
+}
+"""
+
+def quiet(function):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        return function()
+    finally:
+        sys.stdout = stdout
+
+class RebuildTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "prog.p4")
+        self.text = PROGRAM
+        self.analysis_args = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self):
+        with open(self.path, "w") as f:
+            f.write(self.text)
+
+    def build(self):
+        h = HLIR(self.path)
+        h.set_analysis_args(self.analysis_args)
+        self.assertTrue(quiet(lambda: h.build(parse_cache = False)))
+        return h
+
+    def start(self):
+        self.write()
+        h = HLIR(self.path)
+        h.set_analysis_args(self.analysis_args)
+        self.assertTrue(quiet(lambda: h.rebuild(parse_cache = False)))
+        self.assertEqual(h.build_stats["rebuild"], "full")
+        self.assertEqual(compare(h, self.build()), [])
+        return h
+
+    def edit(self, h, old, new, expected):
+        """
+        Replaces 'old' with 'new' in the program and rebuilds 'h', which must
+        be done as 'expected' ("incremental" or "full")
+        """
+        self.assertIn(old, self.text)
+        self.text = self.text.replace(old, new, 1)
+        self.write()
+        self.assertTrue(quiet(lambda: h.rebuild(parse_cache = False)))
+        self.assertEqual(h.build_stats["rebuild"], expected)
+        self.assertEqual(compare(h, self.build()), [])
+
+    def test_action_body(self):
+        h = self.start()
+        self.edit(h, "modify_field(h.f0, v);", "modify_field(h.f2, v);",
+                  "incremental")
+        self.assertEqual(h.build_stats["changed_declarations"], 1)
+
+    def test_compound_action(self):
+        h = self.start()
+        # a2 calls a1, which is rebuilt with it
+        self.edit(h, "add_to_field(h.f1, 1);", "add_to_field(h.f3, 1);",
+                  "incremental")
+        self.edit(h, "modify_field(h.f0, v);", "modify_field(h.f3, v);",
+                  "incremental")
+
+    def test_table_reads(self):
+        h = self.start()
+        self.edit(h, "h.f1 : exact;", "h.f3 : exact;", "incremental")
+        self.assertEqual(h.build_stats["changed_tables"], 1)
+
+    def test_analyzed_before_edit(self):
+        h = self.start()
+        h.analyze()
+        self.edit(h, "h.f2 : ternary;", "h.f0 : ternary;", "incremental")
+        self.edit(h, "modify_field(h.f0, v);", "modify_field(h.f1, v);",
+                  "incremental")
+
+    def test_moved_declarations(self):
+        h = self.start()
+        self.edit(h, "action a1(v) {",
+                  "// a comment\n\naction a1(v) {\n    add_to_field(h.f2, 1);",
+                  "incremental")
+        self.assertTrue(h.build_stats["moved_declarations"] > 0)
+
+    def test_modified_headers(self):
+        h = self.start()
+        # the headers added by an action are used to optimize the table graph
+        self.edit(h, "count(cnt, 1);", "count(cnt, 1);\n    add_header(h2);",
+                  "full")
+
+    def test_removed_table(self):
+        h = self.start()
+        self.edit(h, "    apply(t3);\n", "", "full")
+        self.edit(h, "modify_field(h.f0, v);", "modify_field(h.f2, v);",
+                  "incremental")
+
+    def test_table_removed_by_optimization(self):
+        h = self.start()
+        self.edit(h, "    if (valid(h)) {\n        apply(t2);\n    }\n",
+                  "    if (valid(h)) {\n        if (not valid(h)) {\n"
+                  "            apply(t2);\n        }\n    }\n", "full")
+        self.assertNotIn("t2", h.p4_tables)
+        # the actions of t2 were not validated for it
+        self.edit(h, "add_to_field(h.f1, 1);", "add_to_field(h.f3, 1);",
+                  "full")
+
+    def test_other_declaration(self):
+        h = self.start()
+        self.edit(h, "instance_count : 16;", "instance_count : 32;", "full")
+        self.edit(h, "action a3() {", "action a3(v) {", "full")
+
+    def test_semantic_error(self):
+        h = self.start()
+        self.edit(h, "type : packets;", "type : packets;\n    static : t2;",
+                  "full")
+        # cnt can only be referenced by the actions of t2
+        self.text = self.text.replace("add_to_field(h.f1, 1);",
+                                      "add_to_field(h.f1, 1);\n"
+                                      "    count(cnt, 1);", 1)
+        self.write()
+        self.assertFalse(quiet(lambda: h.rebuild(parse_cache = False)))
+        ref = HLIR(self.path)
+        self.assertFalse(quiet(lambda: ref.build(parse_cache = False)))
+        # the HLIR was left as it was before the error
+        self.edit(h, "add_to_field(h.f1, 1);\n    count(cnt, 1);",
+                  "add_to_field(h.f1, 1);", "incremental")
+        self.assertEqual(h.build_stats["changed_declarations"], 0)
+        self.edit(h, "count(cnt, 1);", "count(cnt, 2);", "incremental")
+
+    def test_validation_error(self):
+        # the errors found when validating the rebuilt actions are reported by
+        # the build from scratch (the semantic checks find them first, the
+        # validation is made to fail here)
+        validate_types = p4.p4_action_validate_types
+        def fail_for_rebuilt_actions(hlir, actions = None):
+            if actions is not None:
+                raise p4.p4_compiler_msg("rebuilt actions are not valid")
+            validate_types(hlir, actions)
+        h = self.start()
+        p4.p4_action_validate_types = fail_for_rebuilt_actions
+        try:
+            self.edit(h, "modify_field(h.f0, v);", "modify_field(h.f2, v);",
+                      "full")
+        finally:
+            p4.p4_action_validate_types = validate_types
+            p4.p4_compiler_msg_reset()
+
+    def test_transitive_reduction(self):
+        self.analysis_args = {"do_transitive_reduction": True}
+        h = quiet(self.start)
+        h.analyze()
+        quiet(lambda: self.edit(h, "add_to_field(h.f1, 1);",
+                                "add_to_field(h.f0, 1);", "incremental"))
+
+if __name__ == "__main__":
+    unittest.main()